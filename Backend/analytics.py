@@ -0,0 +1,173 @@
+"""
+analytics.py - Aggregate Query Layer
+
+Process: Pushes month and category grouping down into SQL so only aggregate rows cross the wire,
+instead of every transaction being fetched and grouped in Python.
+
+Main Functionality:
+  - monthly_totals(): Income/expense totals per month
+  - category_month_totals(): Expense totals per category per month
+  - category_type_totals(): Lifetime totals per category and type
+  - active_days(): Number of distinct days with at least one transaction
+  - expense_rows(), month_expense_rows(), expense_rows_since(), month_expense_total(): Row-level reads
+  - fixed_categories(): Canonical names flagged as fixed costs in the user's category dictionary
+
+Categories are grouped by their interned integer id (see categories.py) and reported by canonical name.
+Month, category and day aggregates include archived months through their rollups (see archive.py); the
+row-level reads only cover the hot table, which always holds the recent months they look at.
+
+When the ledger cache (ledger.py) is enabled every function is answered from the user's cached columnar
+ledger. Otherwise it falls back to SQL, with an SQLite and a PostgreSQL spelling chosen from DATABASE_URL.
+"""
+from db import PLACEHOLDER, DATABASE_URL
+from ledger import ledger_cache
+from categories import fixed_category_names
+from archive import month_bounds, UNCATEGORIZED_ID
+
+DIALECT = "postgres" if DATABASE_URL else "sqlite"
+
+# Dates are stored as 'YYYY-MM-DD' TEXT on both backends
+MONTH_EXPR = {
+    "sqlite": "substr(date, 1, 7)",
+    "postgres": "LEFT(date, 7)",
+}
+
+# amount is REAL (float4) on PostgreSQL, where SUM would also add up in float4; widen it first
+SUM_EXPR = {
+    "sqlite": "TOTAL(amount)",
+    "postgres": "COALESCE(SUM(amount::double precision), 0)",
+}
+
+
+def _month():
+    return MONTH_EXPR[DIALECT]
+
+
+def _sum():
+    return SUM_EXPR[DIALECT]
+
+
+# Joins interned ids back to canonical names; uncategorized rows report ''
+HOT_CATEGORY_ID = f"COALESCE(category_id, {UNCATEGORIZED_ID})"
+CATEGORY_JOIN = "LEFT JOIN categories c ON c.id = a.category_id"
+CATEGORY_NAME = "COALESCE(c.name, '')"
+
+
+def monthly_totals(cur, user_id):
+    """Returns (month, type, total) rows."""
+    if ledger_cache.enabled:
+        return ledger_cache.get(cur, user_id).monthly_totals()
+    cur.execute(f"""
+        SELECT month, type, SUM(total) FROM (
+            SELECT {_month()} AS month, type, {_sum()} AS total
+            FROM transactions
+            WHERE user_id={PLACEHOLDER} AND date IS NOT NULL
+            GROUP BY 1, 2
+            UNION ALL
+            SELECT month, type, total FROM transaction_rollups WHERE user_id={PLACEHOLDER}
+        ) u
+        GROUP BY 1, 2
+    """, (user_id, user_id))
+    return cur.fetchall()
+
+
+def category_month_totals(cur, user_id):
+    """Returns (category, month, total) rows for expenses."""
+    if ledger_cache.enabled:
+        return ledger_cache.get(cur, user_id).category_month_totals()
+    cur.execute(f"""
+        SELECT {CATEGORY_NAME}, a.month, a.total FROM (
+            SELECT category_id, month, SUM(total) AS total FROM (
+                SELECT {HOT_CATEGORY_ID} AS category_id, {_month()} AS month, {_sum()} AS total
+                FROM transactions
+                WHERE user_id={PLACEHOLDER} AND type='expense' AND date IS NOT NULL
+                GROUP BY 1, 2
+                UNION ALL
+                SELECT category_id, month, total FROM transaction_rollups
+                WHERE user_id={PLACEHOLDER} AND type='expense'
+            ) u
+            GROUP BY 1, 2
+        ) a {CATEGORY_JOIN}
+    """, (user_id, user_id))
+    return cur.fetchall()
+
+
+def category_type_totals(cur, user_id):
+    """Returns (category, type, total) rows over the user's whole history."""
+    if ledger_cache.enabled:
+        return ledger_cache.get(cur, user_id).category_type_totals()
+    cur.execute(f"""
+        SELECT {CATEGORY_NAME}, a.type, a.total FROM (
+            SELECT category_id, type, SUM(total) AS total FROM (
+                SELECT {HOT_CATEGORY_ID} AS category_id, type, {_sum()} AS total
+                FROM transactions
+                WHERE user_id={PLACEHOLDER}
+                GROUP BY 1, 2
+                UNION ALL
+                SELECT category_id, type, total FROM transaction_rollups WHERE user_id={PLACEHOLDER}
+            ) u
+            GROUP BY 1, 2
+        ) a {CATEGORY_JOIN}
+    """, (user_id, user_id))
+    return cur.fetchall()
+
+
+def active_days(cur, user_id):
+    if ledger_cache.enabled:
+        return ledger_cache.get(cur, user_id).active_days()
+    cur.execute(f"""
+        SELECT (SELECT COUNT(DISTINCT date) FROM transactions WHERE user_id={PLACEHOLDER}),
+               (SELECT COALESCE(SUM(active_days), 0) FROM archived_months WHERE user_id={PLACEHOLDER})
+    """, (user_id, user_id))
+    row = cur.fetchone()
+    return (row[0] or 0) + (row[1] or 0) if row else 0
+
+
+def expense_rows(cur, user_id):
+    """Returns (id, amount, category) rows for every expense."""
+    if ledger_cache.enabled:
+        return ledger_cache.get(cur, user_id).expense_rows()
+    cur.execute(f"""
+        SELECT a.id, a.amount, {CATEGORY_NAME} FROM transactions a {CATEGORY_JOIN}
+        WHERE a.user_id={PLACEHOLDER} AND a.type='expense'
+    """, (user_id,))
+    return cur.fetchall()
+
+
+def month_expense_rows(cur, user_id, month):
+    """Returns (date, amount, category) rows for expenses in month 'YYYY-MM'."""
+    if ledger_cache.enabled:
+        return ledger_cache.get(cur, user_id).month_expense_rows(month)
+    cur.execute(f"""
+        SELECT a.date, a.amount, {CATEGORY_NAME} FROM transactions a {CATEGORY_JOIN}
+        WHERE a.user_id={PLACEHOLDER} AND a.date >= {PLACEHOLDER} AND a.date < {PLACEHOLDER} AND a.type='expense'
+    """, (user_id, *month_bounds(month)))
+    return cur.fetchall()
+
+
+def expense_rows_since(cur, user_id, cutoff):
+    """Returns (date, amount, category) rows for expenses on or after 'YYYY-MM-DD'."""
+    if ledger_cache.enabled:
+        return ledger_cache.get(cur, user_id).expense_rows_since(cutoff)
+    cur.execute(f"""
+        SELECT a.date, a.amount, {CATEGORY_NAME} FROM transactions a {CATEGORY_JOIN}
+        WHERE a.user_id={PLACEHOLDER} AND a.date >= {PLACEHOLDER} AND a.type='expense'
+    """, (user_id, cutoff))
+    return cur.fetchall()
+
+
+def month_expense_total(cur, user_id, month):
+    if ledger_cache.enabled:
+        return ledger_cache.get(cur, user_id).month_expense_total(month)
+    cur.execute(f"""
+        SELECT {_sum()} FROM transactions
+        WHERE user_id={PLACEHOLDER} AND date >= {PLACEHOLDER} AND date < {PLACEHOLDER} AND type='expense'
+    """, (user_id, *month_bounds(month)))
+    row = cur.fetchone()
+    return row[0] if row and row[0] else 0
+
+
+def fixed_categories(cur, user_id):
+    if ledger_cache.enabled:
+        return ledger_cache.get(cur, user_id).fixed
+    return fixed_category_names(cur, user_id)
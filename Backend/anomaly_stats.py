@@ -0,0 +1,236 @@
+"""
+anomaly_stats.py - Incremental Anomaly Statistics
+
+Process: Keeps running per-(user, category) expense statistics (count, mean and M2, Welford's algorithm) in the
+`category_stats` table, updated by every insert, update and delete. Write routes can then flag an anomalous
+amount in constant time, and /anomaly filters expenses against stored thresholds instead of recomputing them.
+
+Main Functionality:
+  - add_expense() / remove_expense(): Welford updates, each a single atomic statement per statistic row
+  - anomaly_bounds() / is_anomalous(): The anomaly rule, shared with utils.find_anomalies
+  - check_expense(): Flag for a just-written expense
+  - stored_anomalies(): Anomalous expense ids for a user from the stored statistics
+  - rebuild_stats(): Full recompute for a user (backfill, after archival, repair)
+  - check_consistency(): Compares stored_anomalies() against a full detect_anomalies() recompute
+"""
+import math
+
+import numpy as np
+
+from db import DATABASE_URL, PLACEHOLDER
+from categories import category_names
+
+DIALECT = "postgres" if DATABASE_URL else "sqlite"
+
+# Scalar max of two values
+GREATEST = {
+    "sqlite": "MAX",
+    "postgres": "GREATEST",
+}
+
+# Rows without a category are tracked under id 0, as in the archive rollups
+UNCATEGORIZED_ID = 0
+# Pseudo category holding every expense below SMALL_AMOUNT_LIMIT, for the global fallback mean
+SMALL_AMOUNTS_ID = -1
+SMALL_AMOUNT_LIMIT = 10000
+# Samples needed before the global fallback mean is trusted
+MIN_SMALL_SAMPLES = 5
+
+# Categories that are naturally large and exempt from the "global small mean" fallback
+LARGE_CATEGORIES = {"Rent", "Bills", "Education", "Health", "Investment"}
+
+
+def anomaly_bounds(category, count, mean, std, global_mean, user_budget=0):
+    """(above, at_least): an expense in the category is anomalous when amount > above and amount >= at_least.
+    None when no amount in the category can be flagged."""
+    # Method 1: Statistical outliers, 2 standard deviations above the category mean (3+ transactions)
+    if count >= 3:
+        return (mean + 2 * std, -math.inf) if std > 0 else None
+    # Method 2: 5x the global mean of small transactions, unless under half the monthly budget
+    if global_mean is not None and category not in LARGE_CATEGORIES:
+        return global_mean * 5, (user_budget * 0.5 if user_budget > 0 else -math.inf)
+    # Method 3: Large categories with very few records only flag amounts above the whole budget
+    if user_budget > 0 and category in LARGE_CATEGORIES:
+        return user_budget * 1.2, -math.inf
+    return None
+
+
+def is_anomalous(amount, category, count, mean, std, global_mean, user_budget=0):
+    bounds = anomaly_bounds(category, count, mean, std, global_mean, user_budget)
+    return bounds is not None and amount > bounds[0] and amount >= bounds[1]
+
+
+def _as_float(amount):
+    try:
+        return float(amount)
+    except (TypeError, ValueError):
+        return None
+
+
+def _stat_keys(category_id, amount):
+    keys = [category_id if category_id is not None else UNCATEGORIZED_ID]
+    if amount < SMALL_AMOUNT_LIMIT:
+        keys.append(SMALL_AMOUNTS_ID)
+    return keys
+
+
+# ---------------- INCREMENTAL UPDATES ---------------- #
+# excluded.mean is the new sample; every right-hand side reads the row's old values
+_ADD_SQL = f"""
+    INSERT INTO category_stats (user_id, category_id, count, mean, m2)
+    VALUES ({PLACEHOLDER}, {PLACEHOLDER}, 1, {PLACEHOLDER}, 0)
+    ON CONFLICT (user_id, category_id) DO UPDATE SET
+        count = category_stats.count + 1,
+        mean = category_stats.mean + (excluded.mean - category_stats.mean) / (category_stats.count + 1),
+        m2 = category_stats.m2 + (excluded.mean - category_stats.mean) * (excluded.mean - category_stats.mean)
+             * category_stats.count / (category_stats.count + 1)
+"""
+
+_REMOVE_SQL = f"""
+    UPDATE category_stats SET
+        count = count - 1,
+        mean = CASE WHEN count > 1 THEN (count * mean - {PLACEHOLDER}) / (count - 1) ELSE 0 END,
+        m2 = CASE WHEN count > 1
+             THEN {GREATEST[DIALECT]}(m2 - ({PLACEHOLDER} - mean) * ({PLACEHOLDER} - mean) * count / (count - 1), 0)
+             ELSE 0 END
+    WHERE user_id={PLACEHOLDER} AND category_id={PLACEHOLDER} AND count > 0
+"""
+
+
+def add_expense(cur, user_id, category_id, amount):
+    x = _as_float(amount)
+    if x is None:
+        return
+    for key in _stat_keys(category_id, x):
+        cur.execute(_ADD_SQL, (user_id, key, x))
+
+
+def remove_expense(cur, user_id, category_id, amount):
+    x = _as_float(amount)
+    if x is None:
+        return
+    for key in _stat_keys(category_id, x):
+        cur.execute(_REMOVE_SQL, (x, x, x, user_id, key))
+
+
+def record_write(cur, user_id, old=None, new=None):
+    """Applies a transaction write to the statistics. old/new are (category_id, amount, type) or None."""
+    if old and old[2] == "expense":
+        remove_expense(cur, user_id, old[0], old[1])
+    if new and new[2] == "expense":
+        add_expense(cur, user_id, new[0], new[1])
+
+
+# ---------------- READS ---------------- #
+def _latest_budget(cur, user_id):
+    # Same scale reference as detect_anomalies: the most recent budget on record
+    cur.execute(f"SELECT amount FROM budget WHERE user_id={PLACEHOLDER} ORDER BY month DESC LIMIT 1", (user_id,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _std(count, m2):
+    # Population standard deviation, as in find_anomalies
+    return math.sqrt(max(m2, 0) / count) if count else 0
+
+
+def _global_mean(small):
+    return small[1] if small and small[0] >= MIN_SMALL_SAMPLES else None
+
+
+def check_expense(cur, user_id, category_id, category, amount):
+    """Whether an expense that has already been added to the statistics is anomalous. A handful of indexed reads."""
+    x = _as_float(amount)
+    if x is None:
+        return False
+    key = category_id if category_id is not None else UNCATEGORIZED_ID
+    cur.execute(f"""
+        SELECT category_id, count, mean, m2 FROM category_stats
+        WHERE user_id={PLACEHOLDER} AND category_id IN ({PLACEHOLDER}, {PLACEHOLDER})
+    """, (user_id, key, SMALL_AMOUNTS_ID))
+    rows = {r[0]: r[1:] for r in cur.fetchall()}
+    count, mean, m2 = rows.get(key, (0, 0, 0))
+    return is_anomalous(x, category, count, mean, _std(count, m2),
+                        _global_mean(rows.get(SMALL_AMOUNTS_ID)), _latest_budget(cur, user_id))
+
+
+def stored_anomalies(cur, user_id):
+    """Ids of the user's anomalous expenses: thresholds come from category_stats, the filtering runs in SQL."""
+    cur.execute(f"SELECT category_id, count, mean, m2 FROM category_stats WHERE user_id={PLACEHOLDER}", (user_id,))
+    stats = {r[0]: r[1:] for r in cur.fetchall()}
+    global_mean = _global_mean(stats.pop(SMALL_AMOUNTS_ID, None))
+    budget = _latest_budget(cur, user_id)
+    names = category_names(cur, user_id)
+
+    clauses, params = [], []
+    for category_id, (count, mean, m2) in stats.items():
+        if not count:
+            continue
+        bounds = anomaly_bounds(names.get(category_id, ("", False))[0], count, mean, _std(count, m2),
+                                global_mean, budget)
+        if bounds is None:
+            continue
+        clause = f"(COALESCE(category_id, {UNCATEGORIZED_ID}) = {PLACEHOLDER} AND amount > {PLACEHOLDER}"
+        params += [category_id, bounds[0]]
+        if bounds[1] > -math.inf:
+            clause += f" AND amount >= {PLACEHOLDER}"
+            params.append(bounds[1])
+        clauses.append(clause + ")")
+    if not clauses:
+        return []
+
+    cur.execute(f"""
+        SELECT id FROM transactions
+        WHERE user_id={PLACEHOLDER} AND type='expense' AND ({' OR '.join(clauses)})
+        ORDER BY id
+    """, (user_id, *params))
+    return [r[0] for r in cur.fetchall()]
+
+
+# ---------------- FULL RECOMPUTE ---------------- #
+def rebuild_stats(cur, user_id):
+    """Recomputes the user's statistics from the hot table."""
+    cur.execute(f"""
+        SELECT COALESCE(category_id, {UNCATEGORIZED_ID}), amount FROM transactions
+        WHERE user_id={PLACEHOLDER} AND type='expense' AND amount IS NOT NULL
+    """, (user_id,))
+    rows = cur.fetchall()
+    cur.execute(f"DELETE FROM category_stats WHERE user_id={PLACEHOLDER}", (user_id,))
+    if not rows:
+        return
+
+    keys = np.array([r[0] for r in rows], dtype=np.int64)
+    amounts = np.array([r[1] for r in rows], dtype=np.float64)
+    small = amounts < SMALL_AMOUNT_LIMIT
+    keys = np.concatenate([keys, np.full(int(small.sum()), SMALL_AMOUNTS_ID)])
+    amounts = np.concatenate([amounts, amounts[small]])
+
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse)
+    means = np.bincount(inverse, weights=amounts) / counts
+    m2 = np.bincount(inverse, weights=(amounts - means[inverse]) ** 2)
+    cur.executemany(f"""
+        INSERT INTO category_stats (user_id, category_id, count, mean, m2)
+        VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})
+    """, [(user_id, k, c, mu, s) for k, c, mu, s in zip(uniq.tolist(), counts.tolist(), means.tolist(), m2.tolist())])
+
+
+def rebuild_all_stats(cur):
+    cur.execute("SELECT DISTINCT user_id FROM transactions WHERE type='expense'")
+    for (user_id,) in cur.fetchall():
+        rebuild_stats(cur, user_id)
+
+
+def check_consistency(cur, user_id):
+    """Stored-statistics anomalies vs a from-scratch detect_anomalies() for one user."""
+    # utils imports this module for the shared rule, so import it lazily
+    from utils import detect_anomalies
+
+    stored = set(stored_anomalies(cur, user_id))
+    recomputed = set(detect_anomalies(user_id))
+    return {
+        "user_id": user_id,
+        "consistent": stored == recomputed,
+        "missing": sorted(recomputed - stored),
+        "extra": sorted(stored - recomputed)
+    }
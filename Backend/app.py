@@ -10,7 +10,7 @@ Main Functionality:
   - AI Insights (Predictions, Anomaly Detection, Forecasting)
   - Financial Analytics (Category Efficiency, Budget Optimization)
 """
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, stream_with_context, g
 from flask_cors import CORS
 import os
 from datetime import datetime, timedelta
@@ -19,11 +19,35 @@ from dotenv import load_dotenv
 load_dotenv()
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
-from db import get_connection, init_db, PLACEHOLDER, DATABASE_URL
-from utils import detect_anomalies, recommend_budget, financial_coach_reply
+from db import get_connection, init_db, connection_stats, PLACEHOLDER, DATABASE_URL
+from versions import bump_versions, get_versions, make_etag, USER_SCOPE, RECURRING_SCOPE, CATEGORIES_SCOPE
+from changelog import changes_since, snapshot
+from analytics import (monthly_totals, category_month_totals, month_expense_rows, expense_rows_since,
+                       month_expense_total, fixed_categories)
+from categories import intern_category, list_categories, set_category_fixed
+from transactions import insert_transaction, after_transaction_write, expand_recurring, statement_rows
+from ledger import ledger_cache, ledger_for
+from search import search_transactions
+from categorizer import suggest, categorize_uncategorized, CATEGORIZE_MIN_CONFIDENCE, MAX_BATCH_ITEMS
+from cashflow import (current_balance, booked_rows, recurring_templates, variable_history_rows, projection_end,
+                      project_cash_flow, PROJECTION_MONTHS, MAX_PROJECTION_MONTHS)
+from simulation import simulate_month_end, SIMULATION_TRIALS, MAX_SIMULATION_TRIALS, SIMULATION_HISTORY_DAYS
+from profiler import start_request_profile, finish_request_profile
+from responses import (install_json_provider, wants_columnar, rows_to_columns, compress_response,
+                       COLUMNAR_MIMETYPE)
+from export import export_rows, csv_chunks, parquet_chunks, EXPORT_FORMATS
+from jobs import HANDLERS, enqueue, get_job, list_jobs, queue_stats
+from tasks import USER_JOB_KINDS, JOB_OUTPUT_DIR
+from archive import month_bounds, valid_month, archived_transactions
+from anomaly_stats import record_write, check_expense, stored_anomalies
+from utils import (recommend_budget, financial_coach_reply,
+                   predict_month_end, optimization_hints, savings_summary, budget_status, score_purchases,
+                   render_statement_pdf)
 import pickle
+import numpy as np
 
 app = Flask(__name__)
+install_json_provider(app)
 
 CORS(app, resources={
     r"/*": {
@@ -61,6 +85,60 @@ try:
 except:
     model = None
 
+# ---------------- CONDITIONAL GET HELPERS ---------------- #
+def _not_modified(etag):
+    """Returns a bare 304 when the client's If-None-Match already matches etag, otherwise None."""
+    if request.if_none_match.contains_weak(etag):
+        return _with_etag(app.response_class(status=304), etag)
+    return None
+
+def _with_etag(resp, etag):
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+def _rows_json(key, rows, names, columnar, **extra):
+    """jsonify({key: rows, **extra}): row objects by default, parallel arrays for the columnar media type.
+    rows are tuples in `names` order."""
+    if columnar:
+        resp = jsonify({**extra, key: rows_to_columns(rows, names)})
+        resp.mimetype = COLUMNAR_MIMETYPE
+    else:
+        resp = jsonify({**extra, key: [dict(zip(names, r)) for r in rows]})
+    resp.vary.add("Accept")
+    return resp
+
+def _is_admin():
+    """Operational endpoints require X-Admin-Token to match ADMIN_TOKEN; they are disabled when it is unset."""
+    token = os.getenv("ADMIN_TOKEN")
+    return bool(token) and request.headers.get("X-Admin-Token") == token
+
+@app.after_request
+def _compress(response):
+    return compress_response(response, request)
+
+# ---------------- PROFILING HOOKS ---------------- #
+@app.before_request
+def _start_profile():
+    route = request.url_rule.rule if request.url_rule else None
+    admin_requested = request.headers.get("X-Profile") == "1" and _is_admin()
+    g.profiler = start_request_profile(route, admin_requested)
+
+@app.teardown_request
+def _finish_profile(exc):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+    try:
+        user_id = get_jwt_identity()
+    except Exception:
+        # Unauthenticated route, or the JWT check failed
+        user_id = None
+    try:
+        finish_request_profile(profiler, request.url_rule.rule if request.url_rule else None, user_id)
+    except OSError as e:
+        print(f"Profile write failed: {e}")
+
 # ---------------- AUTH ROUTES ---------------- #
 @app.route("/register", methods=["POST"])
 def register():
@@ -157,13 +235,26 @@ def get_user():
     except Exception as e:
         return jsonify({"msg": f"Server error: {str(e)}"}), 500
 
+def _missing_transaction(cur, user_id, tx_id):
+    """Error response for an id that is not in the hot table: 409 when it was archived, 404 otherwise."""
+    # Only reached on a miss, so reading the user's archive files here costs nothing on the normal path
+    if any(row[0] == tx_id for row in archived_transactions(cur, user_id)):
+        return jsonify({"msg": "archived transactions are read-only"}), 409
+    return jsonify({"msg": "Transaction not found"}), 404
+
 @app.route("/delete/<int:id>", methods=["DELETE"])
 @jwt_required()
 def delete_tx(id):
     user_id = int(get_jwt_identity())
     conn = get_connection()
     cur = conn.cursor()
+    cur.execute(f"SELECT date, category_id, amount, type FROM transactions WHERE id={PLACEHOLDER} AND user_id={PLACEHOLDER}", (id, user_id))
+    old = cur.fetchone()
+    if not old:
+        return _missing_transaction(cur, user_id, id)
     cur.execute(f"DELETE FROM transactions WHERE id={PLACEHOLDER} AND user_id={PLACEHOLDER}", (id, user_id))
+    record_write(cur, user_id, old=old[1:])
+    after_transaction_write(cur, user_id, id, "delete", old[0][:7])
     conn.commit()
     return jsonify({"status": "deleted"}), 200
 
@@ -188,6 +279,7 @@ def set_budget():
         # SQLite
         cur.execute(f"REPLACE INTO budget (user_id, month, amount) VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})",
                     (user_id, data["month"], data["amount"]))
+    bump_versions(cur, user_id, data["month"])
     conn.commit()
     return jsonify({"status": "ok"})
 
@@ -197,9 +289,20 @@ def get_budget(month):
     user_id = int(get_jwt_identity())
     conn = get_connection()
     cur = conn.cursor()
+    etag = make_etag(user_id, get_versions(cur, user_id, month))
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+
     cur.execute(f"SELECT amount FROM budget WHERE user_id={PLACEHOLDER} AND month={PLACEHOLDER}", (user_id, month))
     row = cur.fetchone()
-    return jsonify({"budget": row[0] if row else 0})
+    return _with_etag(jsonify({"budget": row[0] if row else 0}), etag)
+
+def _written_expense_is_anomaly(cur, user_id, tx_id):
+    """Write-time anomaly flag from the running category statistics, without rescanning the user's history."""
+    cur.execute(f"SELECT category_id, category, amount, type FROM transactions WHERE id={PLACEHOLDER}", (tx_id,))
+    category_id, category, amount, tx_type = cur.fetchone()
+    return tx_type == "expense" and check_expense(cur, user_id, category_id, category, amount)
 
 @app.route("/add", methods=["POST"])
 @jwt_required()
@@ -210,57 +313,49 @@ def add_transaction():
     cur = conn.cursor()
 
     transaction_type = data.get("type", "expense").lower()
-    cur.execute(f"""
-        INSERT INTO transactions (user_id, date, category, amount, notes, type)
-        VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})
-    """, (user_id, data["date"], data.get("category", ""), data["amount"], data.get("notes", ""), transaction_type))
+    tx_id = insert_transaction(cur, user_id, data["date"], data.get("category", ""), data["amount"],
+                                data.get("notes", ""), transaction_type)
+    is_anomaly = _written_expense_is_anomaly(cur, user_id, tx_id)
 
     conn.commit()
-    return jsonify({"status": "success"}), 200
+    return jsonify({"status": "success", "id": tx_id, "is_anomaly": is_anomaly}), 200
+
+TRANSACTION_FIELDS = ("id", "date", "category", "amount", "notes", "type")
 
 @app.route("/transactions", methods=["GET"])
 @jwt_required()
 def get_transactions():
     user_id = int(get_jwt_identity())
     month = request.args.get("month")  # YYYY-MM
+    if month and not valid_month(month):
+        return jsonify({"msg": "month must be YYYY-MM"}), 400
     conn = get_connection()
     cur = conn.cursor()
+    columnar = wants_columnar(request)
+    # Each representation needs its own ETag
+    shape = ("columnar",) if columnar else ()
 
     if month:
-        # Process recurring transactions for THIS month if they don't exist
-        # We check if we already processed recurring for this month by looking at notes for 'Recurring Subscription'
-        cur.execute(f"SELECT id FROM recurring_transactions WHERE user_id={PLACEHOLDER}", (user_id,))
-        recurring_templates = cur.fetchall()
-        
-        for rt in recurring_templates:
-            # Check if this specific recurring item (by category and day) already exists for this month
-            # We look for the note ' [Recurring]' at the end
-            cur.execute(f"SELECT id FROM recurring_transactions WHERE id={PLACEHOLDER}", (rt[0],))
-            # Just get the details
-            cur.execute(f"SELECT amount, category, notes, type, day_of_month FROM recurring_transactions WHERE id={PLACEHOLDER}", (rt[0],))
-            rt_data = cur.fetchone()
-            if rt_data:
-                amt, cat, nts, typ, day = rt_data
-                day_str = str(day).zfill(2)
-                check_date = f"{month}-{day_str}"
-                check_notes = f"{nts} [Recurring]".strip()
-                
-                cur.execute(f"SELECT id FROM transactions WHERE user_id={PLACEHOLDER} AND date={PLACEHOLDER} AND category={PLACEHOLDER} AND notes={PLACEHOLDER}", 
-                           (user_id, check_date, cat, check_notes))
-                if not cur.fetchone():
-                    # Add it
-                    cur.execute(f"""
-                        INSERT INTO transactions (user_id, date, category, amount, notes, type)
-                        VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})
-                    """, (user_id, check_date, cat, amt, check_notes, typ))
-                    conn.commit()
+        etag = make_etag(user_id, get_versions(cur, user_id, month, RECURRING_SCOPE), *shape)
+    else:
+        etag = make_etag(user_id, get_versions(cur, user_id, USER_SCOPE), *shape)
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+
+    if month and expand_recurring(cur, user_id, month):
+        conn.commit()
+        # Expansion changed this month, so the response carries the new version
+        etag = make_etag(user_id, get_versions(cur, user_id, month, RECURRING_SCOPE), *shape)
 
+    if month:
+        # A date range (rather than substr) lets Postgres prune to the month's partition
         cur.execute(f"""
             SELECT id, date, category, amount, notes, type
             FROM transactions
-            WHERE user_id={PLACEHOLDER} AND substr(date,1,7)={PLACEHOLDER}
+            WHERE user_id={PLACEHOLDER} AND date >= {PLACEHOLDER} AND date < {PLACEHOLDER}
             ORDER BY date
-        """, (user_id, month,))
+        """, (user_id, *month_bounds(month)))
     else:
         cur.execute(f"""
             SELECT id, date, category, amount, notes, type
@@ -268,13 +363,54 @@ def get_transactions():
         """, (user_id,))
     
     rows = cur.fetchall()
+    archived = archived_transactions(cur, user_id, month)
+    if archived:
+        rows = sorted(archived + rows, key=lambda r: r[1] or "")
 
-    return jsonify({
-        "transactions": [
-            {"id": r[0], "date": r[1], "category": r[2], "amount": r[3], "notes": r[4], "type": r[5]}
-            for r in rows
-        ]
-    })
+    return _with_etag(_rows_json("transactions", rows, TRANSACTION_FIELDS, columnar), etag)
+
+@app.route("/search", methods=["GET"])
+@jwt_required()
+def search():
+    user_id = int(get_jwt_identity())
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"msg": "Missing search query 'q'"}), 400
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", 20)), 1), 100)
+    except ValueError:
+        return jsonify({"msg": "page and per_page must be integers"}), 400
+
+    conn = get_connection()
+    cur = conn.cursor()
+    results, has_more = search_transactions(cur, user_id, query,
+                                            date_from=request.args.get("from"),
+                                            date_to=request.args.get("to"),
+                                            page=page, per_page=per_page)
+    return jsonify({"results": results, "page": page, "per_page": per_page, "has_more": has_more})
+
+@app.route("/sync", methods=["GET"])
+@jwt_required()
+def sync():
+    """Delta sync: changes after the client's cursor, or a full snapshot when it has none."""
+    user_id = int(get_jwt_identity())
+    try:
+        since = int(request.args.get("since", 0))
+        limit = min(max(int(request.args.get("limit", 500)), 1), 5000)
+        after = request.args.get("after")
+        after = int(after) if after is not None else None
+    except ValueError:
+        return jsonify({"msg": "since, after and limit must be integers"}), 400
+
+    conn = get_connection()
+    cur = conn.cursor()
+    if after is not None:
+        # Next page of a snapshot taken at cursor `since` (0 for a user who has never written)
+        return jsonify(snapshot(cur, user_id, max(since, 0), after, limit))
+    if since <= 0:
+        return jsonify(snapshot(cur, user_id, limit=limit))
+    return jsonify(changes_since(cur, user_id, since, limit))
 
 @app.route("/recurring", methods=["GET"])
 @jwt_required()
@@ -296,10 +432,12 @@ def add_recurring():
     data = request.json
     conn = get_connection()
     cur = conn.cursor()
+    category_id, category = intern_category(cur, user_id, data.get("category", ""))
     cur.execute(f"""
-        INSERT INTO recurring_transactions (user_id, amount, category, notes, type, day_of_month)
-        VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})
-    """, (user_id, data["amount"], data.get("category", ""), data.get("notes", ""), data.get("type", "expense"), int(data.get("day_of_month", 1))))
+        INSERT INTO recurring_transactions (user_id, amount, category, category_id, notes, type, day_of_month)
+        VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})
+    """, (user_id, data["amount"], category, category_id, data.get("notes", ""), data.get("type", "expense"), int(data.get("day_of_month", 1))))
+    bump_versions(cur, user_id, RECURRING_SCOPE)
     conn.commit()
     return jsonify({"status": "added"}), 201
 
@@ -310,9 +448,74 @@ def delete_recurring(id):
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(f"DELETE FROM recurring_transactions WHERE id={PLACEHOLDER} AND user_id={PLACEHOLDER}", (id, user_id))
+    bump_versions(cur, user_id, RECURRING_SCOPE)
     conn.commit()
     return jsonify({"status": "deleted"}), 200
 
+@app.route("/categories", methods=["GET"])
+@jwt_required()
+def get_categories():
+    user_id = int(get_jwt_identity())
+    conn = get_connection()
+    cur = conn.cursor()
+    return jsonify(list_categories(cur, user_id))
+
+@app.route("/categories/<int:id>", methods=["PUT"])
+@jwt_required()
+def update_category(id):
+    """Flips a category between fixed and variable cost for every analytics route."""
+    user_id = int(get_jwt_identity())
+    data = request.json or {}
+    if "is_fixed" not in data:
+        return jsonify({"msg": "Missing is_fixed"}), 400
+
+    conn = get_connection()
+    cur = conn.cursor()
+    if not set_category_fixed(cur, user_id, id, bool(data["is_fixed"])):
+        return jsonify({"msg": "Category not found"}), 404
+    bump_versions(cur, user_id, CATEGORIES_SCOPE)
+    ledger_cache.invalidate(user_id)
+    conn.commit()
+    return jsonify({"status": "updated"}), 200
+
+@app.route("/categorize", methods=["POST"])
+@jwt_required()
+def categorize():
+    """Suggests categories for a batch of {notes, type} items from the user's own labeled transactions."""
+    user_id = int(get_jwt_identity())
+    items = (request.json or {}).get("items")
+    if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+        return jsonify({"msg": "items must be a list of {notes, type} objects"}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({"msg": f"At most {MAX_BATCH_ITEMS} items per request"}), 400
+
+    conn = get_connection()
+    cur = conn.cursor()
+    suggestions = suggest(cur, user_id, [(str(i.get("notes") or ""), i.get("type", "expense")) for i in items])
+    if suggestions is None:
+        return jsonify({"suggestions": [None] * len(items),
+                        "msg": "Not enough categorized transactions to learn from yet"})
+    return jsonify({"suggestions": suggestions})
+
+@app.route("/categorize/apply", methods=["POST"])
+@jwt_required()
+def categorize_apply():
+    """Fills in the category of uncategorized transactions whose suggestion is confident enough."""
+    user_id = int(get_jwt_identity())
+    data = request.json or {}
+    try:
+        min_confidence = float(data.get("min_confidence", CATEGORIZE_MIN_CONFIDENCE))
+    except (TypeError, ValueError):
+        return jsonify({"msg": "min_confidence must be a number"}), 400
+    if not 0 < min_confidence <= 1:
+        return jsonify({"msg": "min_confidence must be in (0, 1]"}), 400
+
+    conn = get_connection()
+    cur = conn.cursor()
+    result = categorize_uncategorized(cur, user_id, min_confidence, dry_run=bool(data.get("dry_run")))
+    conn.commit()
+    return jsonify(result)
+
 @app.route("/predict")
 @jwt_required()
 def predict():
@@ -320,37 +523,87 @@ def predict():
     conn = get_connection()
     cur = conn.cursor()
     
-    FIXED_CATS = ["Rent", "Bills", "Education", "Insurance", "Utilities", "Emi", "Loan"]
     today = datetime.now()
     this_month_str = today.strftime("%Y-%m")
+
+    # The prediction also depends on how far into the month we are
+    etag = make_etag(user_id, get_versions(cur, user_id, this_month_str, CATEGORIES_SCOPE), today.strftime("%Y-%m-%d"))
+    cached = _not_modified(etag)
+    if cached:
+        return cached
     
-    days_passed = max(today.day, 1)
-    days_in_month = 30 # Simplified
-    
-    cur.execute(f"SELECT date, amount, category FROM transactions WHERE user_id={PLACEHOLDER} AND substr(date,1,7)={PLACEHOLDER} AND type='expense'", (user_id, this_month_str))
-    rows = cur.fetchall()
-    
-    if not rows:
-        return jsonify({"prediction": 0})
-    
-    fixed_total = 0
-    variable_total = 0
-    
-    for r_date, r_amount, r_cat in rows:
-        cat_norm = r_cat.strip().title() if r_cat else ""
-        if cat_norm in FIXED_CATS:
-            fixed_total += r_amount
-        else:
-            variable_total += r_amount
-            
-    effective_days = max(days_passed, 5)
-    variable_avg_daily = variable_total / effective_days
-    remaining_days = max(days_in_month - days_passed, 0)
-    variable_predicted = variable_total + (variable_avg_daily * remaining_days)
-    
-    prediction = fixed_total + variable_predicted
+    rows = month_expense_rows(cur, user_id, this_month_str)
+    fixed = fixed_categories(cur, user_id)
     
-    return jsonify({"prediction": round(prediction, 2)})
+    return _with_etag(jsonify({"prediction": predict_month_end(rows, today, fixed)}), etag)
+
+@app.route("/simulate")
+@jwt_required()
+def simulate():
+    user_id = int(get_jwt_identity())
+    try:
+        trials = int(request.args.get("trials", SIMULATION_TRIALS))
+    except ValueError:
+        return jsonify({"msg": "trials must be an integer"}), 400
+    if not 1 <= trials <= MAX_SIMULATION_TRIALS:
+        return jsonify({"msg": f"trials must be between 1 and {MAX_SIMULATION_TRIALS}"}), 400
+    conn = get_connection()
+    cur = conn.cursor()
+
+    today = datetime.now().date()
+    this_month_str = today.strftime("%Y-%m")
+    # History spans earlier months too, so any write invalidates; the seed is fixed per user and day
+    etag = make_etag(user_id, get_versions(cur, user_id, USER_SCOPE, CATEGORIES_SCOPE), today.isoformat(), trials)
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+
+    cutoff = (today - timedelta(days=SIMULATION_HISTORY_DAYS)).isoformat()
+    cur.execute(f"SELECT amount FROM budget WHERE user_id={PLACEHOLDER} AND month={PLACEHOLDER}", (user_id, this_month_str))
+    budget_row = cur.fetchone()
+
+    result = simulate_month_end(expense_rows_since(cur, user_id, cutoff), month_expense_rows(cur, user_id, this_month_str),
+                                today, fixed_categories(cur, user_id), budget_row[0] if budget_row else 0,
+                                trials, seed=[user_id, today.toordinal()])
+    return _with_etag(jsonify(result), etag)
+
+CASHFLOW_FIELDS = ("date", "income", "expense", "variable", "balance")
+
+@app.route("/cashflow")
+@jwt_required()
+def cashflow():
+    """Read-only daily balance projection from recurring templates, booked future rows and expected variable spend."""
+    user_id = int(get_jwt_identity())
+    try:
+        months = int(request.args.get("months", PROJECTION_MONTHS))
+        min_balance = float(request.args.get("min_balance", 0))
+        balance = request.args.get("balance")
+        balance = float(balance) if balance is not None else None
+    except ValueError:
+        return jsonify({"msg": "months must be an integer, balance and min_balance numbers"}), 400
+    if not 1 <= months <= MAX_PROJECTION_MONTHS:
+        return jsonify({"msg": f"months must be between 1 and {MAX_PROJECTION_MONTHS}"}), 400
+    conn = get_connection()
+    cur = conn.cursor()
+
+    today = datetime.now().date()
+    columnar = wants_columnar(request)
+    etag = make_etag(user_id, get_versions(cur, user_id, USER_SCOPE, RECURRING_SCOPE, CATEGORIES_SCOPE),
+                     today.isoformat(), months, min_balance, balance, "columnar" if columnar else "")
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+
+    # Without a balance from the client, the projection starts from lifetime income minus expenses, which
+    # only means something for users who also log their income
+    start_balance = balance if balance is not None else current_balance(cur, user_id, today)
+    if start_balance is None:
+        return jsonify({"msg": "No income recorded to derive a balance from; pass balance= with the current balance"}), 400
+    end = projection_end(today, months)
+    rows, summary = project_cash_flow(start_balance, recurring_templates(cur, user_id),
+                                      booked_rows(cur, user_id, today, end), variable_history_rows(cur, user_id, today),
+                                      today, months, min_balance, fixed_categories(cur, user_id))
+    return _with_etag(_rows_json("days", rows, CASHFLOW_FIELDS, columnar, **summary), etag)
 
 @app.route("/recommend-budget")
 @jwt_required()
@@ -358,17 +611,18 @@ def recommend_budget_api():
     user_id = int(get_jwt_identity())
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute(f"SELECT date, amount FROM transactions WHERE user_id={PLACEHOLDER}", (user_id,))
-    rows = cur.fetchall()
-    data = [{"date": r[0], "amount": r[1]} for r in rows]
-    recommended = recommend_budget(data)
+    recommended = recommend_budget(category_month_totals(cur, user_id), fixed_categories(cur, user_id))
     return jsonify({"recommended_budget": recommended})
 
 @app.route("/anomaly")
 @jwt_required()
 def anomaly():
     user_id = int(get_jwt_identity())
-    return jsonify({"anomalies": detect_anomalies(user_id)})
+    conn = get_connection()
+    cur = conn.cursor()
+    return jsonify({"anomalies": stored_anomalies(cur, user_id)})
+
+FORECAST_FIELDS = ("date", "amount")
 
 @app.route("/forecast")
 @jwt_required()
@@ -377,33 +631,33 @@ def forecast():
     conn = get_connection()
     cur = conn.cursor()
     
-    cutoff = (datetime.now() - timedelta(days=60)).strftime("%Y-%m-%d")
-    cur.execute(f"SELECT date, amount, category FROM transactions WHERE user_id={PLACEHOLDER} AND date >= {PLACEHOLDER} AND type='expense'", (user_id, cutoff))
-    rows = cur.fetchall()
+    start = datetime.now()
+    columnar = wants_columnar(request)
+    # The 60-day window and forecast dates move with the day; fixed categories are left out of the average
+    etag = make_etag(user_id, get_versions(cur, user_id, USER_SCOPE, CATEGORIES_SCOPE), start.strftime("%Y-%m-%d"),
+                     "columnar" if columnar else "")
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+    
+    cutoff = (start - timedelta(days=60)).strftime("%Y-%m-%d")
+    rows = expense_rows_since(cur, user_id, cutoff)
     
     if not rows:
-        return jsonify({"forecast": []})
+        return _with_etag(_rows_json("forecast", [], FORECAST_FIELDS, columnar), etag)
 
-    FIXED_CATS = ["Rent", "Bills", "Education", "Insurance", "Utilities"]
-    variable_total = sum(r[1] for r in rows if r[2] not in FIXED_CATS)
+    fixed = fixed_categories(cur, user_id)
+    variable_total = sum(r[1] for r in rows if r[2] not in fixed)
     avg_daily_variable = variable_total / 60
     
-    fixed_by_month = {}
-    for r_date, r_amount, r_cat in rows:
-        if r_cat in FIXED_CATS:
-            m = r_date[:7]
-            if m not in fixed_by_month: fixed_by_month[m] = 0
-            fixed_by_month[m] += r_amount
-    
     forecast_list = []
-    start = datetime.now()
     
     for i in range(1, 31):
         fc_date_obj = start + timedelta(days=i)
         fc_date = fc_date_obj.strftime("%Y-%m-%d")
-        forecast_list.append({"date": fc_date, "amount": round(avg_daily_variable, 2)})
+        forecast_list.append((fc_date, round(avg_daily_variable, 2)))
 
-    return jsonify({"forecast": forecast_list})
+    return _with_etag(_rows_json("forecast", forecast_list, FORECAST_FIELDS, columnar), etag)
 
 @app.route("/update/<int:id>", methods=["PUT"])
 @jwt_required()
@@ -414,14 +668,22 @@ def update_transaction(id):
     cur = conn.cursor()
 
     transaction_type = data.get("type", "expense").lower()
+    cur.execute(f"SELECT date, category_id, amount, type FROM transactions WHERE id={PLACEHOLDER} AND user_id={PLACEHOLDER}", (id, user_id))
+    old = cur.fetchone()
+    if not old:
+        return _missing_transaction(cur, user_id, id)
+    category_id, category = intern_category(cur, user_id, data.get("category", ""))
     cur.execute(f"""
         UPDATE transactions
-        SET date={PLACEHOLDER}, category={PLACEHOLDER}, amount={PLACEHOLDER}, notes={PLACEHOLDER}, type={PLACEHOLDER}
+        SET date={PLACEHOLDER}, category={PLACEHOLDER}, category_id={PLACEHOLDER}, amount={PLACEHOLDER}, notes={PLACEHOLDER}, type={PLACEHOLDER}
         WHERE id={PLACEHOLDER} AND user_id={PLACEHOLDER}
-    """, (data["date"], data.get("category", ""), data["amount"], data.get("notes", ""), transaction_type, id, user_id))
+    """, (data["date"], category, category_id, data["amount"], data.get("notes", ""), transaction_type, id, user_id))
+    record_write(cur, user_id, old=old[1:], new=(category_id, data["amount"], transaction_type))
+    after_transaction_write(cur, user_id, id, "update", old[0][:7], data["date"][:7])
+    is_anomaly = _written_expense_is_anomaly(cur, user_id, id)
 
     conn.commit()
-    return jsonify({"status": "updated"}), 200
+    return jsonify({"status": "updated", "is_anomaly": is_anomaly}), 200
 
 @app.route("/optimize-budget", methods=["GET"])
 @jwt_required()
@@ -430,24 +692,10 @@ def optimize_budget():
     month_param = request.args.get("month") # YYYY-MM
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute(f"SELECT date, category, amount FROM transactions WHERE user_id={PLACEHOLDER} AND type='expense'", (user_id,))
-    rows = cur.fetchall()
-    if not rows:
+    totals = category_month_totals(cur, user_id)
+    if not totals:
         return jsonify([])
 
-    cat_month_sums = {}
-    all_categories = set()
-
-    for r_date_str, r_cat, r_amount in rows:
-        all_categories.add(r_cat)
-        try:
-            r_month = r_date_str[:7]
-            if r_cat not in cat_month_sums:
-                cat_month_sums[r_cat] = {}
-            cat_month_sums[r_cat][r_month] = cat_month_sums[r_cat].get(r_month, 0) + r_amount
-        except (TypeError, IndexError):
-            pass
-
     today_month = datetime.now().strftime("%Y-%m")
     target_month = month_param if month_param else today_month
 
@@ -455,30 +703,28 @@ def optimize_budget():
     budget_row = cur.fetchone()
     total_budget = budget_row[0] if budget_row else 0
 
-    FIXED_CATS = ["Rent", "Bills", "Education", "Insurance", "Utilities"]
-    result = []
+    return jsonify(optimization_hints(totals, total_budget, target_month, fixed_categories(cur, user_id)))
 
-    for cat in all_categories:
-        monthly_data = cat_month_sums.get(cat, {})
-        avg_monthly_spend = sum(monthly_data.values()) / len(monthly_data) if monthly_data else 0
-        category_recent_total = monthly_data.get(target_month, 0)
+def _purchase_context(cur, user_id, month):
+    """Budget and spending so far for a month, shared by single and batch necessity scoring."""
+    # Get current budget
+    cur.execute(f"SELECT amount FROM budget WHERE user_id={PLACEHOLDER} AND month={PLACEHOLDER}", (user_id, month))
+    budget_row = cur.fetchone()
+    budget = budget_row[0] if budget_row else 0
 
-        # Condition 1: Spending is 20% higher than historical average
-        if len(monthly_data) > 1 and avg_monthly_spend > 0 and category_recent_total > avg_monthly_spend * 1.2:
-            diff = category_recent_total - avg_monthly_spend
-            result.append({
-                "category": cat,
-                "message": f"Spending is ₹{round(diff)} above your monthly average. Try to scale back."
-            })
-        
-        # Condition 2: Category consumes > 50% of total budget (EXCLUDE FIXED COSTS)
-        elif total_budget > 0 and category_recent_total > total_budget * 0.5 and cat not in FIXED_CATS:
-             result.append({
-                "category": cat,
-                "message": f"This category accounts for {round((category_recent_total/total_budget)*100)}% of your total budget."
-            })
+    # Get total spent this month
+    spent = month_expense_total(cur, user_id, month)
+    return budget, spent
 
-    return jsonify(result)
+def _purchase_inputs(items):
+    """Splits purchase dicts into the parallel arrays score_purchases expects."""
+    amounts = [float(i.get("amount", 0) or 0) for i in items]
+    is_need = [i.get("type") == "need" for i in items]
+    frequency = [i.get("frequency", "low") for i in items]
+    return amounts, is_need, frequency
+
+def _impact(amount, budget):
+    return round((amount / budget * 100) if budget > 0 else 0, 1)
 
 @app.route("/necessity-score", methods=["POST"])
 @jwt_required()
@@ -486,139 +732,164 @@ def necessity_score():
     try:
         user_id = int(get_jwt_identity())
         data = request.json
-        
-        amount = float(data.get("amount", 0) or 0)
-        is_need = data.get("type") == "need"
-        freq = data.get("frequency", "low")
-        
-        # 1. Base Score from Type & Frequency
-        score = 45 if is_need else 10
-        
-        if freq == "high":
-            score += 25
-        elif freq == "medium":
-            score += 15
-        else:
-            score += 5
-            
-        # 2. Financial Context Fetching
+        if not isinstance(data, dict):
+            return jsonify({"msg": "Body must be a {amount, type, frequency} object"}), 400
+        amounts, is_need, frequency = _purchase_inputs([data])
+
         conn = get_connection()
         cur = conn.cursor()
         this_month = datetime.now().strftime("%Y-%m")
-        
-        # Get current budget
-        cur.execute(f"SELECT amount FROM budget WHERE user_id={PLACEHOLDER} AND month={PLACEHOLDER}", (user_id, this_month))
-        budget_row = cur.fetchone()
-        budget = budget_row[0] if budget_row else 0
-        
-        # Get total spent this month
-        cur.execute(f"SELECT SUM(amount) FROM transactions WHERE user_id={PLACEHOLDER} AND substr(date,1,7)={PLACEHOLDER} AND type='expense'", (user_id, this_month))
-        spent_row = cur.fetchone()
-        spent = spent_row[0] if spent_row and spent_row[0] else 0
-        
-        # 3. Budget Impact Scoring
-        if budget > 0:
-            remaining = budget - spent
-            usage_ratio = spent / budget
-            
-            # Penalty for being near or over budget
-            if usage_ratio > 0.9:
-                score -= 15
-            elif usage_ratio > 1.0:
-                score -= 30
-                
-            # Impact of THIS purchase
-            if amount > remaining:
-                score -= 20 # Would push over/further over
-            elif amount < (budget * 0.02):
-                score += 15 # Negligible impact
-            elif amount < (budget * 0.1):
-                score += 5
-        else:
-            # No budget set - conservative scoring
-            score += 10
-            
-        # 4. Final Final Adjustments
-        # Needs shouldn't be too easy to block if cheap, Wants should be hard to justify if expensive
-        if not is_need and amount > 5000:
-            score -= 10
-            
-        decision = "BUY" if score >= 70 else "DELAY" if score >= 35 else "AVOID"
-        
-        # Ensure needs that are cheap are at least DELAY
-        if is_need and amount < 500 and decision == "AVOID":
-            decision = "DELAY"
-            
+        budget, spent = _purchase_context(cur, user_id, this_month)
+
+        scores, decisions = score_purchases(amounts, is_need, frequency, budget, spent)
+
         return jsonify({
-            "score": max(0, min(score, 100)),
-            "decision": decision,
+            "score": scores[0],
+            "decision": decisions[0],
             "context": {
                 "spent": round(spent, 2),
                 "budget": round(budget, 2),
-                "impact": round((amount / budget * 100) if budget > 0 else 0, 1)
+                "impact": _impact(amounts[0], budget)
+            }
+        }), 200
+    except Exception as e:
+        return jsonify({"msg": f"Error: {str(e)}"}), 500
+
+@app.route("/necessity-score/batch", methods=["POST"])
+@jwt_required()
+def necessity_score_batch():
+    """Scores a whole wishlist against one budget lookup, independently and as a buy-in-order simulation."""
+    try:
+        user_id = int(get_jwt_identity())
+        items = (request.json or {}).get("items", [])
+        if not isinstance(items, list) or not items:
+            return jsonify({"msg": "Provide a non-empty 'items' list"}), 400
+        if not all(isinstance(i, dict) for i in items):
+            return jsonify({"msg": "items must be a list of {name, amount, type, frequency} objects"}), 400
+        if len(items) > 1000:
+            return jsonify({"msg": "At most 1000 items per batch"}), 400
+
+        amounts, is_need, frequency = _purchase_inputs(items)
+
+        conn = get_connection()
+        cur = conn.cursor()
+        this_month = datetime.now().strftime("%Y-%m")
+        budget, spent = _purchase_context(cur, user_id, this_month)
+
+        # Independent: every item scored against today's spending
+        scores, decisions = score_purchases(amounts, is_need, frequency, budget, spent)
+
+        # Sequential: each purchase adds to spending before the next one is scored
+        spent_before = spent + np.cumsum(amounts) - amounts
+        seq_scores, seq_decisions = score_purchases(amounts, is_need, frequency, budget, spent_before)
+
+        results = []
+        for idx, item in enumerate(items):
+            results.append({
+                "name": item.get("name"),
+                "amount": amounts[idx],
+                "score": scores[idx],
+                "decision": decisions[idx],
+                "impact": _impact(amounts[idx], budget)
+            })
+
+        simulation = []
+        for idx, item in enumerate(items):
+            simulation.append({
+                "name": item.get("name"),
+                "amount": amounts[idx],
+                "spent_before": round(float(spent_before[idx]), 2),
+                "remaining_before": round(budget - float(spent_before[idx]), 2) if budget > 0 else None,
+                "score": seq_scores[idx],
+                "decision": seq_decisions[idx]
+            })
+
+        return jsonify({
+            "items": results,
+            "sequential": simulation,
+            "context": {
+                "spent": round(spent, 2),
+                "budget": round(budget, 2),
+                "total": round(sum(amounts), 2),
+                "remaining_after": round(budget - spent - sum(amounts), 2) if budget > 0 else None
             }
         }), 200
     except Exception as e:
         return jsonify({"msg": f"Error: {str(e)}"}), 500
         
+SAVINGS_FIELDS = ("month", "budget", "spent", "income", "savings")
+
 @app.route("/savings", methods=["GET"])
 @jwt_required()
 def get_savings():
     user_id = int(get_jwt_identity())
     conn = get_connection()
     cur = conn.cursor()
+    current_month_str = datetime.now().strftime("%Y-%m")
+
+    columnar = wants_columnar(request)
+
+    # Lifetime savings only count months before the current one
+    etag = make_etag(user_id, get_versions(cur, user_id, USER_SCOPE), current_month_str,
+                     *(("columnar",) if columnar else ()))
+    cached = _not_modified(etag)
+    if cached:
+        return cached
     
-    cur.execute(f"SELECT date, amount, type FROM transactions WHERE user_id={PLACEHOLDER}", (user_id,))
-    tx_rows = cur.fetchall()
+    month_totals = monthly_totals(cur, user_id)
     
     cur.execute(f"SELECT month, amount FROM budget WHERE user_id={PLACEHOLDER}", (user_id,))
     budget_rows = cur.fetchall()
     
-    if not tx_rows and not budget_rows:
-        return jsonify({"total_savings": 0, "history": []})
-
-    monthly_spent = {}
-    monthly_income = {}
-    for r_date_str, r_amount, r_type in tx_rows:
-        try:
-            r_month = r_date_str[:7]
-            if r_type == 'income':
-                monthly_income[r_month] = monthly_income.get(r_month, 0) + r_amount
-            else:
-                monthly_spent[r_month] = monthly_spent.get(r_month, 0) + r_amount
-        except (TypeError, IndexError):
-            pass
+    if not month_totals and not budget_rows:
+        summary = {"total_savings": 0, "history": []}
+    else:
+        summary = savings_summary(month_totals, budget_rows, current_month_str)
+
+    history = [tuple(h[f] for f in SAVINGS_FIELDS) for h in summary["history"]]
+    return _with_etag(_rows_json("history", history, SAVINGS_FIELDS, columnar,
+                                 total_savings=summary["total_savings"]), etag)
+
+@app.route("/dashboard", methods=["GET"])
+@jwt_required()
+def dashboard():
+    """Computes every home-screen widget from a single load of the user's rows."""
+    user_id = int(get_jwt_identity())
+    month_param = request.args.get("month") # YYYY-MM
+    if month_param and not valid_month(month_param):
+        return jsonify({"msg": "month must be YYYY-MM"}), 400
+    conn = get_connection()
+    cur = conn.cursor()
+
+    # One load of the user's rows (shared with the other analytics routes through the ledger cache)
+    ledger = ledger_for(cur, user_id)
 
+    cur.execute(f"SELECT month, amount FROM budget WHERE user_id={PLACEHOLDER}", (user_id,))
+    budget_rows = cur.fetchall()
     budgets = {b[0]: b[1] for b in budget_rows}
-    all_months = set(list(monthly_spent.keys()) + list(budgets.keys()) + list(monthly_income.keys()))
-    
-    current_month_str = datetime.now().strftime("%Y-%m")
-    history = []
-    total_savings = 0
-    
-    for m in sorted(list(all_months), reverse=True):
-        budget = budgets.get(m, 0)
-        spent = monthly_spent.get(m, 0)
-        income = monthly_income.get(m, 0)
-        
-        savings = (budget - spent) + income
-        if m < current_month_str:
-            total_savings += savings
-        
-        history.append({
-            "month": m, 
-            "budget": budget, 
-            "spent": spent, 
-            "income": income, 
-            "savings": savings
-        })
-    
+
+    today = datetime.now()
+    today_month = today.strftime("%Y-%m")
+    target_month = month_param if month_param else today_month
+
+    current_budget = budgets.get(today_month, 0)
+
+    if len(ledger) or ledger.rollups or budget_rows:
+        savings = savings_summary(ledger.monthly_totals(), budget_rows, today_month)
+    else:
+        savings = {"total_savings": 0, "history": []}
+
+    month_expenses = ledger.month_expense_rows(today_month)
+    month_spent = sum(r[1] for r in month_expenses)
+
     return jsonify({
-        "total_savings": round(total_savings, 2),
-        "history": history
+        "prediction": predict_month_end(month_expenses, today, ledger.fixed),
+        "savings": savings,
+        "anomalies": stored_anomalies(cur, user_id),
+        "budget": budget_status(current_budget, month_spent, today_month),
+        "optimization": optimization_hints(ledger.category_month_totals(), current_budget, target_month, ledger.fixed)
     })
 
-from fpdf import FPDF
 import io
 
 @app.route("/export-pdf", methods=["GET"])
@@ -626,64 +897,21 @@ import io
 def export_pdf():
     user_id = int(get_jwt_identity())
     month = request.args.get("month", datetime.now().strftime("%Y-%m"))
+    if not valid_month(month):
+        return jsonify({"msg": "month must be YYYY-MM"}), 400
     
     conn = get_connection()
     cur = conn.cursor()
     
     # 1. Fetch Transactions
-    cur.execute(f"SELECT date, category, amount, notes, type FROM transactions WHERE user_id={PLACEHOLDER} AND substr(date,1,7)={PLACEHOLDER}", (user_id, month))
-    rows = cur.fetchall()
+    rows = statement_rows(cur, user_id, month)
     
     # 2. Generate PDF using fpdf2
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Helvetica", "B", 16)
-    pdf.cell(0, 10, f"Monthly Financial Statement - {month}", ln=True, align="C")
-    pdf.ln(10)
-    
-    # Summary Stats
-    total_spent = sum(r[2] for r in rows if r[4] == 'expense')
-    total_income = sum(r[2] for r in rows if r[4] == 'income')
-    
-    pdf.set_font("Helvetica", "B", 12)
-    pdf.cell(0, 10, f"Total Income: INR {total_income:,.2f}", ln=True)
-    pdf.cell(0, 10, f"Total Spent: INR {total_spent:,.2f}", ln=True)
-    pdf.cell(0, 10, f"Net Flow: INR {total_income - total_spent:,.2f}", ln=True)
-    pdf.ln(10)
+    pdf_bytes = render_statement_pdf(rows, month)
     
-    # Table Header
-    pdf.set_fill_color(240, 240, 240)
-    pdf.set_font("Helvetica", "B", 10)
-    pdf.cell(30, 10, "Date", border=1, fill=True)
-    pdf.cell(40, 10, "Category", border=1, fill=True)
-    pdf.cell(30, 10, "Amount", border=1, fill=True)
-    pdf.cell(20, 10, "Type", border=1, fill=True)
-    pdf.cell(70, 10, "Notes", border=1, fill=True)
-    pdf.ln()
-    
-    # Table Rows
-    pdf.set_font("Helvetica", "", 9)
-    for r_date, r_cat, r_amt, r_notes, r_type in rows:
-        # Format date for report: dd-mm-yy
-        formatted_date = r_date
-        try:
-            d_obj = datetime.strptime(r_date, "%Y-%m-%d")
-            formatted_date = d_obj.strftime("%d-%m-%y")
-        except:
-            pass
-            
-        pdf.cell(30, 8, formatted_date, border=1)
-        pdf.cell(40, 8, str(r_cat or "-"), border=1)
-        pdf.cell(30, 8, f"{r_amt:,.2f}", border=1)
-        pdf.cell(20, 8, str(r_type).upper(), border=1)
-        pdf.cell(70, 8, str(r_notes or "-")[:40], border=1) # Truncate long notes
-        pdf.ln()
-        
     # Return as safe stream
     from flask import send_file
-    output = io.BytesIO()
-    output.write(pdf.output())
-    output.seek(0)
+    output = io.BytesIO(pdf_bytes)
     
     return send_file(
         output,
@@ -692,6 +920,95 @@ def export_pdf():
         mimetype="application/pdf"
     )
 
+@app.route("/export", methods=["GET"])
+@jwt_required()
+def export_transactions():
+    """Streams every transaction between `from` and `to` (inclusive) as CSV or Parquet."""
+    user_id = int(get_jwt_identity())
+    fmt = request.args.get("format", "csv").lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"msg": "format must be csv or parquet"}), 400
+    try:
+        end = datetime.strptime(request.args.get("to") or datetime.now().strftime("%Y-%m-%d"), "%Y-%m-%d")
+        start = datetime.strptime(request.args.get("from") or f"{end.year}-01-01", "%Y-%m-%d")
+    except ValueError:
+        return jsonify({"msg": "from and to must be YYYY-MM-DD"}), 400
+    if start > end:
+        return jsonify({"msg": "from must not be after to"}), 400
+
+    start_str, end_str = start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+    rows = export_rows(get_connection(), user_id, start_str, (end + timedelta(days=1)).strftime("%Y-%m-%d"))
+    chunks = csv_chunks(rows) if fmt == "csv" else parquet_chunks(rows)
+    return app.response_class(
+        stream_with_context(chunks),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename=transactions_{start_str}_{end_str}.{fmt}"}
+    )
+
+@app.route("/jobs", methods=["POST"])
+@jwt_required()
+def create_job():
+    """Queues background work. Operational kinds (e.g. archive_months) additionally need the admin token."""
+    user_id = int(get_jwt_identity())
+    data = request.json or {}
+    kind = data.get("kind")
+    payload = data.get("payload") or {}
+    if kind not in HANDLERS:
+        return jsonify({"msg": f"kind must be one of {sorted(HANDLERS)}"}), 400
+    if kind not in USER_JOB_KINDS and not _is_admin():
+        return jsonify({"msg": "Admin token required for this job kind"}), 403
+    if not isinstance(payload, dict) or ("month" in payload and not valid_month(payload["month"])):
+        return jsonify({"msg": "payload must be an object; month must be YYYY-MM"}), 400
+    try:
+        priority = min(max(int(data.get("priority", 0)), 0), 9)
+    except (TypeError, ValueError):
+        return jsonify({"msg": "priority must be an integer"}), 400
+
+    conn = get_connection()
+    cur = conn.cursor()
+    job_id = enqueue(cur, kind, user_id if kind in USER_JOB_KINDS else None, payload, priority)
+    conn.commit()
+    return jsonify({"id": job_id, "status": "queued"}), 202
+
+@app.route("/jobs", methods=["GET"])
+@jwt_required()
+def get_jobs():
+    user_id = int(get_jwt_identity())
+    conn = get_connection()
+    cur = conn.cursor()
+    # Operational jobs belong to no user; the admin token sees every job
+    return jsonify({"jobs": list_jobs(cur, None if _is_admin() else user_id)})
+
+@app.route("/jobs/<int:id>", methods=["GET"])
+@jwt_required()
+def get_job_status(id):
+    user_id = int(get_jwt_identity())
+    conn = get_connection()
+    cur = conn.cursor()
+    job = get_job(cur, id, None if _is_admin() else user_id)
+    if not job:
+        return jsonify({"msg": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route("/jobs/<int:id>/download", methods=["GET"])
+@jwt_required()
+def download_job_result(id):
+    user_id = int(get_jwt_identity())
+    conn = get_connection()
+    cur = conn.cursor()
+    job = get_job(cur, id, None if _is_admin() else user_id)
+    if not job:
+        return jsonify({"msg": "Job not found"}), 404
+    if job["status"] != "done":
+        return jsonify({"msg": f"Job is {job['status']}"}), 409
+    name = (job["result"] or {}).get("file")
+    path = os.path.join(JOB_OUTPUT_DIR, name) if name else None
+    if not path or not os.path.exists(path):
+        return jsonify({"msg": "Job has no downloadable file"}), 404
+
+    from flask import send_file
+    return send_file(path, as_attachment=True, download_name=job["result"].get("download_name", name))
+
 @app.route("/chat/history", methods=["GET"])
 @jwt_required()
 def chat_history():
@@ -715,6 +1032,8 @@ def chat():
     
     # 1. Save User Message
     cur.execute(f"INSERT INTO chat_history (user_id, role, content) VALUES ({PLACEHOLDER}, 'user', {PLACEHOLDER})", (user_id, message))
+    # Commit before the LLM call: an open write transaction would hold SQLite's database lock for the whole reply
+    conn.commit()
     
     # 2. Get AI Response
     response_text = financial_coach_reply(user_id, message)
@@ -725,6 +1044,16 @@ def chat():
     conn.commit()
     return jsonify({"response": response_text})
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    if not _is_admin():
+        return jsonify({"msg": "Forbidden"}), 403
+    conn = get_connection()
+    cur = conn.cursor()
+    # Counters are per process; pid tells gunicorn workers apart
+    return jsonify({"pid": os.getpid(), "ledger_cache": ledger_cache.stats(), "jobs": queue_stats(cur),
+                    "db": connection_stats(cur)})
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     is_development = os.environ.get("FLASK_ENV") == "development"
@@ -0,0 +1,356 @@
+"""
+archive.py - Monthly Partitions and Cold Transaction Archive
+
+Process: Keeps the hot `transactions` table down to the recent months nearly every query touches. Months older
+than ARCHIVE_HORIZON_MONTHS are moved into zstd-compressed Parquet files under ARCHIVE_DIR, leaving behind
+per-(user, month, category, type) rollups so aggregate reads never have to open the files.
+
+Main Functionality:
+  - month_bounds(): ['YYYY-MM-01', next month) date range, prunes partitions and uses the (user_id, date) index
+  - valid_month(): Checks a 'YYYY-MM' request argument before it is turned into bounds
+  - ensure_partitioned(): One-time conversion of the PostgreSQL table to range partitions by month
+  - ensure_month_partitions(): Creates upcoming monthly partitions, and ones whose rows landed in the default partition (PostgreSQL)
+  - archive_months(): The archival job, also runnable as `python archive.py [--horizon MONTHS]`
+  - load_rollups(), archived_active_days(), archived_transactions(): Read side unioned into hot data
+  - iter_archived_transactions(): Batch-at-a-time read of a date range for exports
+
+Archived rows are read-only: /search and /sync only cover the hot table, and they cannot be updated or deleted.
+"""
+import os
+import re
+import time
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from db import BASE_DIR, DATABASE_URL, PLACEHOLDER
+from versions import bump_versions
+from anomaly_stats import rebuild_stats
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(BASE_DIR, "archive"))
+ARCHIVE_HORIZON_MONTHS = int(os.getenv("ARCHIVE_HORIZON_MONTHS", 24))
+
+# Partitions are created this many months ahead so inserts never fall into the default partition
+PARTITIONS_AHEAD = 2
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("user_id", pa.int64()),
+    ("date", pa.string()),
+    ("category", pa.string()),
+    ("category_id", pa.int64()),
+    ("amount", pa.float64()),
+    ("notes", pa.string()),
+    ("type", pa.string()),
+])
+ARCHIVE_COLUMNS = ", ".join(ARCHIVE_SCHEMA.names)
+
+# Rollups have no NULL key columns; uncategorized rows are stored under category id 0
+UNCATEGORIZED_ID = 0
+
+_MONTH_RE = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+
+def add_months(month, n):
+    index = int(month[:4]) * 12 + int(month[5:7]) - 1 + n
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def month_bounds(month):
+    """('YYYY-MM-01', first day of the next month) for a 'YYYY-MM' month."""
+    return f"{month}-01", f"{add_months(month, 1)}-01"
+
+
+def valid_month(month):
+    return bool(month) and _MONTH_RE.match(month) is not None
+
+
+def _valid_months(values):
+    return sorted({m for m in values if valid_month(m)})
+
+
+def _upcoming_months(today=None):
+    this_month = (today or date.today()).strftime("%Y-%m")
+    return [add_months(this_month, n) for n in range(PARTITIONS_AHEAD + 1)]
+
+
+# ---------------- POSTGRES PARTITIONING ---------------- #
+def _partition_name(month):
+    return f"transactions_p{month.replace('-', '_')}"
+
+
+# Stored columns of a transactions row (search_vector is generated)
+PARTITION_COLUMNS = "id, user_id, date, category, amount, notes, type, category_id"
+
+
+def ensure_month_partitions(cur, months):
+    """Creates missing monthly partitions. Rows of such a month that already landed in the default partition
+    (e.g. the worker was down over a month rollover) are moved into the new partition."""
+    if not DATABASE_URL:
+        return
+    for month in months:
+        name = _partition_name(month)
+        cur.execute("SELECT to_regclass(%s)", (name,))
+        if cur.fetchone()[0]:
+            continue
+        lo, hi = month_bounds(month)
+        cur.execute("SELECT COUNT(*) FROM transactions_default WHERE date >= %s AND date < %s", (lo, hi))
+        stranded = cur.fetchone()[0]
+        if not stranded:
+            cur.execute(f"CREATE TABLE {name} PARTITION OF transactions FOR VALUES FROM (%s) TO (%s)", (lo, hi))
+            continue
+
+        # A partition cannot be created while the default one holds rows in its range. Detaching the default
+        # locks the whole table until the caller commits, so the move is atomic to readers and writers
+        print(f"Partition {name} was missing; moving {stranded} rows for {month} out of transactions_default")
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('transactions_partitioning'))")
+        cur.execute("ALTER TABLE transactions DETACH PARTITION transactions_default")
+        cur.execute(f"CREATE TABLE {name} PARTITION OF transactions FOR VALUES FROM (%s) TO (%s)", (lo, hi))
+        cur.execute(f"""
+            INSERT INTO transactions ({PARTITION_COLUMNS})
+            SELECT {PARTITION_COLUMNS} FROM transactions_default WHERE date >= %s AND date < %s
+        """, (lo, hi))
+        cur.execute("DELETE FROM transactions_default WHERE date >= %s AND date < %s", (lo, hi))
+        cur.execute("ALTER TABLE transactions ATTACH PARTITION transactions_default DEFAULT")
+
+
+def _stranded_months(cur):
+    """Months with rows in the default partition, i.e. whose own partition was never created."""
+    cur.execute("SELECT DISTINCT substr(date, 1, 7) FROM transactions_default")
+    return _valid_months(r[0] for r in cur.fetchall())
+
+
+def ensure_partitioned(cur):
+    """Converts a plain PostgreSQL transactions table into one partitioned by month. No-op on SQLite."""
+    if not DATABASE_URL:
+        return
+    # Every worker runs init_db on startup; only the first one converts
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('transactions_partitioning'))")
+    cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'transactions'::regclass")
+    if cur.fetchone():
+        ensure_month_partitions(cur, sorted(set(_stranded_months(cur)) | set(_upcoming_months())))
+        return
+
+    cur.execute("ALTER TABLE transactions RENAME TO transactions_unpartitioned")
+    # Keep the id sequence (and with it every existing id) alive when the old table is dropped
+    cur.execute("ALTER SEQUENCE transactions_id_seq OWNED BY NONE")
+    # Unique keys on a partitioned table must include the partition key, hence (id, date)
+    cur.execute("""
+        CREATE TABLE transactions (
+            id INTEGER NOT NULL DEFAULT nextval('transactions_id_seq'),
+            user_id INTEGER,
+            date TEXT NOT NULL,
+            category TEXT,
+            amount REAL,
+            notes TEXT,
+            type TEXT DEFAULT 'expense',
+            category_id INTEGER,
+            search_vector tsvector GENERATED ALWAYS AS
+                (to_tsvector('simple', coalesce(notes, '') || ' ' || coalesce(category, ''))) STORED,
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date)
+    """)
+    cur.execute("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT")
+
+    cur.execute("SELECT DISTINCT substr(date, 1, 7) FROM transactions_unpartitioned")
+    months = _valid_months(r[0] for r in cur.fetchall())
+    ensure_month_partitions(cur, sorted(set(months) | set(_upcoming_months())))
+
+    cur.execute(f"""
+        INSERT INTO transactions ({PARTITION_COLUMNS})
+        SELECT id, user_id, COALESCE(date, ''), category, amount, notes, type, category_id
+        FROM transactions_unpartitioned
+    """)
+    cur.execute("DROP TABLE transactions_unpartitioned")
+    cur.execute("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (user_id, date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions (user_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_search ON transactions USING GIN (search_vector)")
+
+
+# ---------------- ARCHIVAL JOB ---------------- #
+def _archive_path(name):
+    return os.path.join(ARCHIVE_DIR, name)
+
+
+def _read_archive(name, user_id=None, columns=None):
+    filters = [("user_id", "=", user_id)] if user_id is not None else None
+    return pq.read_table(_archive_path(name), columns=columns, filters=filters, schema=ARCHIVE_SCHEMA)
+
+
+def _write_archive(table, month):
+    """Writes a new file for the month and returns its name. Files are never overwritten in place."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    name = f"transactions-{month}-{time.time_ns()}.parquet"
+    tmp = _archive_path(name + ".tmp")
+    pq.write_table(table, tmp, compression="zstd", row_group_size=64 * 1024)
+    os.replace(tmp, _archive_path(name))
+    return name
+
+
+def _replace_month_index(cur, month, table, name):
+    """Rewrites the rollups and per-user archive entries of one month from its full archived table."""
+    keyed = table.set_column(table.schema.get_field_index("category_id"), "category_id",
+                             pc.fill_null(table["category_id"], UNCATEGORIZED_ID))
+    rollups = keyed.group_by(["user_id", "category_id", "type"]).aggregate([("amount", "sum"), ("id", "count")])
+    days = table.set_column(table.schema.get_field_index("date"), "date",
+                            pc.utf8_slice_codeunits(table["date"], 0, 10))
+    users = days.group_by("user_id").aggregate([("id", "count"), ("date", "count_distinct")])
+
+    cur.execute(f"DELETE FROM transaction_rollups WHERE month={PLACEHOLDER}", (month,))
+    cur.execute(f"DELETE FROM archived_months WHERE month={PLACEHOLDER}", (month,))
+    cur.executemany(f"""
+        INSERT INTO transaction_rollups (user_id, month, category_id, type, total, tx_count)
+        VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})
+    """, [(r["user_id"], month, r["category_id"], r["type"], r["amount_sum"], r["id_count"])
+          for r in rollups.to_pylist()])
+    cur.executemany(f"""
+        INSERT INTO archived_months (user_id, month, path, tx_count, active_days)
+        VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})
+    """, [(r["user_id"], month, name, r["id_count"], r["date_count_distinct"]) for r in users.to_pylist()])
+    return [r["user_id"] for r in users.to_pylist()]
+
+
+def _archive_month(conn, month):
+    """Moves one month of every user's transactions into the archive. Returns the number of rows moved."""
+    cur = conn.cursor()
+    lo, hi = month_bounds(month)
+
+    # Block writers while the month is copied out and deleted so no insert slips between the two
+    if DATABASE_URL:
+        cur.execute("LOCK TABLE transactions IN SHARE ROW EXCLUSIVE MODE")
+    else:
+        cur.execute("BEGIN IMMEDIATE")
+
+    cur.execute(f"SELECT {ARCHIVE_COLUMNS} FROM transactions WHERE date >= {PLACEHOLDER} AND date < {PLACEHOLDER}",
+                (lo, hi))
+    rows = cur.fetchall()
+    if not rows:
+        conn.rollback()
+        return 0
+
+    table = pa.Table.from_arrays([pa.array(col, type=field.type) for col, field in zip(zip(*rows), ARCHIVE_SCHEMA)],
+                                 schema=ARCHIVE_SCHEMA)
+    # Rows back-dated into an already archived month are merged into a fresh file for that month
+    cur.execute(f"SELECT DISTINCT path FROM archived_months WHERE month={PLACEHOLDER}", (month,))
+    old_names = [r[0] for r in cur.fetchall()]
+    if old_names:
+        table = pa.concat_tables([_read_archive(n) for n in old_names] + [table])
+    table = table.sort_by([("user_id", "ascending"), ("date", "ascending"), ("id", "ascending")])
+
+    name = _write_archive(table, month)
+    try:
+        user_ids = _replace_month_index(cur, month, table, name)
+        cur.execute(f"""
+            DELETE FROM transaction_changes WHERE deleted=0 AND tx_id IN
+                (SELECT id FROM transactions WHERE date >= {PLACEHOLDER} AND date < {PLACEHOLDER})
+        """, (lo, hi))
+        if DATABASE_URL:
+            # Dropping the partition is instant and leaves no dead tuples behind; the DELETE below
+            # then only has to clear back-dated rows from the default partition
+            cur.execute(f"DROP TABLE IF EXISTS {_partition_name(month)}")
+        cur.execute(f"DELETE FROM transactions WHERE date >= {PLACEHOLDER} AND date < {PLACEHOLDER}", (lo, hi))
+        for user_id in user_ids:
+            bump_versions(cur, user_id, month)
+            # Anomaly statistics describe the hot table only, like detect_anomalies
+            rebuild_stats(cur, user_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        os.remove(_archive_path(name))
+        raise
+
+    for old in old_names:
+        if os.path.exists(_archive_path(old)):
+            os.remove(_archive_path(old))
+    return len(rows)
+
+
+def archive_months(conn, horizon=ARCHIVE_HORIZON_MONTHS, today=None):
+    """Archives every month older than `horizon` months before the current one. Returns {month: rows moved}."""
+    cutoff = add_months((today or date.today()).strftime("%Y-%m"), -horizon)
+    cur = conn.cursor()
+    cur.execute(f"SELECT DISTINCT substr(date, 1, 7) FROM transactions WHERE date < {PLACEHOLDER}", (f"{cutoff}-01",))
+    months = _valid_months(r[0] for r in cur.fetchall())
+    conn.commit()
+
+    moved = {month: _archive_month(conn, month) for month in months}
+
+    if DATABASE_URL:
+        cur = conn.cursor()
+        ensure_month_partitions(cur, sorted(set(_stranded_months(cur)) | set(_upcoming_months(today))))
+    conn.commit()
+    return moved
+
+
+# ---------------- READ SIDE ---------------- #
+def load_rollups(cur, user_id):
+    """(month, category_id, type, total) rows for the user's archived months."""
+    cur.execute(f"SELECT month, category_id, type, total FROM transaction_rollups WHERE user_id={PLACEHOLDER}",
+                (user_id,))
+    return cur.fetchall()
+
+
+def archived_active_days(cur, user_id):
+    cur.execute(f"SELECT COALESCE(SUM(active_days), 0) FROM archived_months WHERE user_id={PLACEHOLDER}", (user_id,))
+    return cur.fetchone()[0]
+
+
+def archived_months_for(cur, user_id):
+    cur.execute(f"SELECT month FROM archived_months WHERE user_id={PLACEHOLDER}", (user_id,))
+    return {r[0] for r in cur.fetchall()}
+
+
+def archived_transactions(cur, user_id, month=None):
+    """(id, date, category, amount, notes, type) rows from the user's archive files, optionally for one month."""
+    sql = f"SELECT path FROM archived_months WHERE user_id={PLACEHOLDER}"
+    params = (user_id,)
+    if month:
+        sql += f" AND month={PLACEHOLDER}"
+        params += (month,)
+    cur.execute(sql + " ORDER BY month", params)
+
+    rows = []
+    for (name,) in cur.fetchall():
+        table = _read_archive(name, user_id, ["id", "date", "category", "amount", "notes", "type"])
+        rows.extend(zip(*(table[c].to_pylist() for c in table.column_names)))
+    return rows
+
+
+def iter_archived_transactions(cur, user_id, start, end, batch_rows=10000):
+    """Yields the user's archived (id, date, category, amount, notes, type) rows with start <= date < end,
+    ordered by date, without loading more than one batch of a file at a time."""
+    cur.execute(f"""
+        SELECT path FROM archived_months
+        WHERE user_id={PLACEHOLDER} AND month >= {PLACEHOLDER} AND month <= {PLACEHOLDER}
+        ORDER BY month
+    """, (user_id, start[:7], end[:7]))
+    names = [r[0] for r in cur.fetchall()]
+
+    columns = ["id", "date", "category", "amount", "notes", "type"]
+    row_filter = (ds.field("user_id") == user_id) & (ds.field("date") >= start) & (ds.field("date") < end)
+    for name in names:
+        # Files are sorted by (user_id, date, id), so row group statistics skip other users' data
+        dataset = ds.dataset(_archive_path(name), format="parquet", schema=ARCHIVE_SCHEMA)
+        batches = dataset.to_batches(columns=columns, filter=row_filter, batch_size=batch_rows, use_threads=False)
+        for batch in batches:
+            yield from zip(*(col.to_pylist() for col in batch.columns))
+
+
+if __name__ == "__main__":
+    import argparse
+    from db import get_connection, init_db
+
+    parser = argparse.ArgumentParser(description="Move old months of transactions into the Parquet archive.")
+    parser.add_argument("--horizon", type=int, default=ARCHIVE_HORIZON_MONTHS,
+                        help="months to keep in the hot table (default: ARCHIVE_HORIZON_MONTHS)")
+    args = parser.parse_args()
+
+    init_db()
+    conn = get_connection()
+    for month, count in archive_months(conn, args.horizon).items():
+        print(f"{month}: archived {count} transactions")
+    conn.close()
@@ -0,0 +1,79 @@
+"""
+bench_analytics.py - Raw Row Fetch vs SQL GROUP BY
+
+Process: Compares the old "fetch every row, group in Python" pattern against the aggregate queries in
+analytics.py for /savings, /optimize-budget, /recommend-budget and the coach context.
+
+Usage:
+    python benchmarks/bench_analytics.py [rows]
+
+"Before" timings include the Python grouping loop. "After" runs the analytics.py functions twice: with the
+ledger cache (ledger.py) disabled, which times the SQL GROUP BY, and on a warm cache. Wire bytes are approximated by the pickled size of the rows the driver hands back.
+"""
+import pickle
+import sys
+
+from common import setup_db, seed_transactions, cleanup, timed, BENCH_USER_ID
+from db import PLACEHOLDER
+import analytics
+from ledger import ledger_cache
+
+
+def _group(rows, key):
+    """The dict loop the routes used to run over raw rows."""
+    sums = {}
+    for r in rows:
+        k = key(r)
+        sums[k] = sums.get(k, 0) + r[1 if len(r) < 4 else 2]
+    return sums
+
+
+# Each case: (name, raw query the route used to run, legacy Python grouping, aggregate function replacing both)
+CASES = [
+    ("savings", "SELECT date, amount, type FROM transactions WHERE user_id={p}",
+     lambda r: (r[0][:7], r[2]), analytics.monthly_totals),
+    ("optimize-budget", "SELECT date, amount, category FROM transactions WHERE user_id={p} AND type='expense'",
+     lambda r: (r[2], r[0][:7]), analytics.category_month_totals),
+    ("recommend-budget", "SELECT date, amount FROM transactions WHERE user_id={p}",
+     lambda r: r[0][:7], analytics.category_month_totals),
+    ("coach", "SELECT date, category, amount, type FROM transactions WHERE user_id={p}",
+     lambda r: (r[1], r[3]), analytics.category_type_totals),
+]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    conn = setup_db()
+    cleanup(conn)
+    seed_transactions(conn, n)
+    cur = conn.cursor()
+    print(f"{n} transactions for user {BENCH_USER_ID}\n")
+    print(f"{'route':<18}{'before rows':>12}{'before KB':>11}{'before ms':>11}{'after rows':>12}{'after KB':>10}"
+          f"{'sql ms':>9}{'cached ms':>11}")
+    cache_bytes = ledger_cache.max_bytes
+
+    try:
+        for name, raw_sql, key, aggregate in CASES:
+            def before():
+                cur.execute(raw_sql.format(p=PLACEHOLDER), (BENCH_USER_ID,))
+                rows = cur.fetchall()
+                _group(rows, key)
+                return rows
+
+            before_ms, before_rows = timed(before)
+            # Every analytics function answers from the ledger cache when it is enabled (the default)
+            ledger_cache.max_bytes = 0
+            sql_ms, after_rows = timed(lambda: aggregate(cur, BENCH_USER_ID))
+            ledger_cache.max_bytes = cache_bytes
+            aggregate(cur, BENCH_USER_ID)
+            cached_ms, _ = timed(lambda: aggregate(cur, BENCH_USER_ID))
+            print(f"{name:<18}{len(before_rows):>12}{len(pickle.dumps(before_rows)) / 1024:>11.1f}{before_ms:>11.1f}"
+                  f"{len(after_rows):>12}{len(pickle.dumps(after_rows)) / 1024:>10.1f}{sql_ms:>9.1f}{cached_ms:>11.1f}")
+    finally:
+        ledger_cache.max_bytes = cache_bytes
+        cleanup(conn)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
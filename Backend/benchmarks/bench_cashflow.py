@@ -0,0 +1,61 @@
+"""
+bench_cashflow.py - Cash-Flow Projection Latency
+
+Process: Seeds N transactions and times what GET /cashflow does for one user: the balance and history reads,
+then the projection itself for 1 to 24 month horizons with a varying number of recurring templates. Templates
+are generated in memory, so nothing here depends on recurring_transactions contents.
+
+Usage:
+    python benchmarks/bench_cashflow.py [rows]
+"""
+import random
+import sys
+from datetime import date
+
+from common import setup_db, seed_transactions, cleanup, timed, BENCH_USER_ID
+from cashflow import current_balance, booked_rows, variable_history_rows, projection_end, project_cash_flow
+from ledger import ledger_cache
+
+HORIZONS = [1, 6, 24]
+TEMPLATE_COUNTS = [10, 100, 1000]
+
+
+def make_templates(n, seed=7):
+    rnd = random.Random(seed)
+    return [(round(rnd.uniform(100, 30000), 2), "income" if rnd.random() < 0.2 else "expense", rnd.randint(1, 31), i,
+             f"template {i}") for i in range(n)]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    conn = setup_db()
+    cleanup(conn)
+    seed_transactions(conn, n)
+    cur = conn.cursor()
+    today = date.today()
+
+    def load():
+        return (current_balance(cur, BENCH_USER_ID, today),
+                booked_rows(cur, BENCH_USER_ID, today, projection_end(today, max(HORIZONS))),
+                variable_history_rows(cur, BENCH_USER_ID, today))
+
+    ledger_cache.invalidate(BENCH_USER_ID)
+    cold_ms, _ = timed(lambda: (ledger_cache.invalidate(BENCH_USER_ID), load()), repeat=3)
+    warm_ms, (balance, booked, history) = timed(load)
+    print(f"{n} transactions, {len(history)} in the history window\n")
+    print(f"load rows (cold cache)  {cold_ms:8.1f} ms")
+    print(f"load rows (warm cache)  {warm_ms:8.1f} ms\n")
+
+    print(f"{'templates':>10}{'months':>8}{'project ms':>12}{'low days':>10}")
+    for count in TEMPLATE_COUNTS:
+        templates = make_templates(count)
+        for months in HORIZONS:
+            ms, (_, summary) = timed(lambda: project_cash_flow(balance, templates, booked, history, today, months))
+            low_days = sum(p["days"] for p in summary["low_balance_periods"])
+            print(f"{count:>10}{months:>8}{ms:>12.2f}{low_days:>10}")
+
+    cleanup(conn)
+
+
+if __name__ == "__main__":
+    main()
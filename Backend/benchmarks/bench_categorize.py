@@ -0,0 +1,63 @@
+"""
+bench_categorize.py - Auto-Categorization Throughput
+
+Process: Builds N labeled synthetic transactions (merchant-style notes with typos and noise words), trains the
+per-user categorizer on them and times batch prediction at several batch sizes. Also reports accuracy on a
+held-out set, to catch speedups that cost quality.
+
+Usage:
+    python benchmarks/bench_categorize.py [rows]
+"""
+import random
+import sys
+
+from common import timed
+from categorizer import train, MAX_TRAINING_ROWS
+
+MERCHANTS = {
+    1: ["swiggy", "zomato", "dominos", "starbucks", "bigbasket"],
+    2: ["uber", "ola", "irctc", "indigo", "rapido"],
+    3: ["electricity", "airtel", "jio", "water board", "gas cylinder"],
+    4: ["amazon", "flipkart", "myntra", "decathlon", "ikea"],
+    5: ["apollo pharmacy", "practo", "lab test", "dental clinic", "gym"],
+}
+NOISE = ["order", "payment", "upi", "ref", "monthly", "online", "card", "txn"]
+BATCHES = [100, 1000, 5000]
+
+
+def make_rows(n, seed=7):
+    rnd = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        cid = rnd.choice(list(MERCHANTS))
+        name = rnd.choice(MERCHANTS[cid])
+        if rnd.random() < 0.2:
+            # Drop one letter: the typos character trigrams are there for
+            i = rnd.randrange(len(name))
+            name = name[:i] + name[i + 1:]
+        rows.append((f"{name} {rnd.choice(NOISE)} {rnd.randrange(10 ** 6)}", "expense", cid))
+    return rows
+
+
+def main():
+    n = min(int(sys.argv[1]) if len(sys.argv) > 1 else MAX_TRAINING_ROWS, MAX_TRAINING_ROWS)
+    rows = make_rows(n)
+    held_out = make_rows(5000, seed=11)
+
+    train_ms, model = timed(lambda: train(rows), repeat=3)
+    print(f"{n} labeled rows, {len(model.vocab)} tokens, {len(model.category_ids)} categories\n")
+    print(f"train                   {train_ms:8.1f} ms\n")
+
+    print(f"{'batch':>8}{'predict ms':>12}{'rows/s':>12}")
+    for size in BATCHES:
+        items = [(r[0], r[1]) for r in held_out[:size]]
+        ms, _ = timed(lambda: model.predict(items))
+        print(f"{size:>8}{ms:>12.1f}{size / ms * 1000:>12.0f}")
+
+    predicted = model.predict([(r[0], r[1]) for r in held_out])
+    accuracy = sum(cid == r[2] for (cid, _), r in zip(predicted, held_out)) / len(held_out)
+    print(f"\nheld-out accuracy       {accuracy:8.1%}")
+
+
+if __name__ == "__main__":
+    main()
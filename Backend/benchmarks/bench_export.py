@@ -0,0 +1,69 @@
+"""
+bench_export.py - Streaming Export Throughput and Memory
+
+Process: Seeds N transactions and drains the /export generators for the whole range, reporting rows per second,
+output size and the peak Python heap (tracemalloc) for a small and the full range. With streaming, peak memory
+should be flat across ranges instead of growing with the row count.
+
+Usage:
+    python benchmarks/bench_export.py [rows]
+"""
+import sys
+import time
+import tracemalloc
+
+from common import setup_db, seed_transactions, cleanup, BENCH_USER_ID
+import db
+from export import export_rows, csv_chunks, parquet_chunks
+from archive import month_bounds
+
+FORMATS = [("csv", csv_chunks), ("parquet", parquet_chunks)]
+
+# The first month of seeded data, and everything
+RANGES = [("1 month", None), ("all", ("2000-01-01", "2100-01-01"))]
+
+
+def _drain(encode, start, end):
+    """Returns (rows, bytes, seconds) for one full export."""
+    counted = [0]
+
+    def counting(rows):
+        for row in rows:
+            counted[0] += 1
+            yield row
+
+    t0 = time.perf_counter()
+    size = sum(len(chunk) for chunk in encode(counting(export_rows(db.get_connection(), BENCH_USER_ID, start, end))))
+    return counted[0], size, time.perf_counter() - t0
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    conn = setup_db()
+    cleanup(conn)
+    seed_transactions(conn, n)
+    cur = conn.cursor()
+    cur.execute(f"SELECT MIN(date) FROM transactions WHERE user_id={db.PLACEHOLDER}", (BENCH_USER_ID,))
+    first_month = month_bounds(cur.fetchone()[0][:7])
+    print(f"{n} transactions for user {BENCH_USER_ID}\n")
+    print(f"{'format':<9}{'range':<9}{'rows':>9}{'MB':>9}{'seconds':>9}{'rows/s':>11}{'peak heap MB':>14}")
+
+    try:
+        for fmt, encode in FORMATS:
+            for label, bounds in RANGES:
+                start, end = bounds or first_month
+                rows, size, seconds = _drain(encode, start, end)
+                # Second pass under tracemalloc, which slows things down too much to time
+                tracemalloc.start()
+                _drain(encode, start, end)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"{fmt:<9}{label:<9}{rows:>9}{size / 2**20:>9.1f}{seconds:>9.2f}{rows / seconds:>11,.0f}"
+                      f"{peak / 2**20:>14.1f}")
+    finally:
+        cleanup(conn)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
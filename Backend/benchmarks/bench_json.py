@@ -0,0 +1,61 @@
+"""
+bench_json.py - JSON Serialization and Payload Size
+
+Process: Builds a /transactions-shaped response for N synthetic rows and times each way of encoding it:
+Flask's default provider vs the orjson provider (responses.py), row objects vs the columnar shape, and gzip on
+top. Reports encode time (best of 5) and raw/gzip payload sizes.
+
+Usage:
+    python benchmarks/bench_json.py [rows]
+"""
+import gzip
+import random
+import sys
+from datetime import date, timedelta
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from common import timed, CATEGORIES
+from responses import OrjsonProvider, rows_to_columns, orjson, GZIP_LEVEL
+
+FIELDS = ("id", "date", "category", "amount", "notes", "type")
+
+
+def make_rows(n, seed=7):
+    rnd = random.Random(seed)
+    start = date.today() - timedelta(days=3 * 365)
+    return [(i, (start + timedelta(days=rnd.randrange(3 * 365))).isoformat(), rnd.choice(CATEGORIES),
+             round(rnd.uniform(10, 5000), 2), f"note {i}", "expense" if rnd.random() < 0.9 else "income")
+            for i in range(1, n + 1)]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rows = make_rows(n)
+    app = Flask(__name__)
+    providers = [("default", DefaultJSONProvider(app))]
+    if orjson is not None:
+        providers.append(("orjson", OrjsonProvider(app)))
+    else:
+        print("orjson not installed; only the default provider is measured")
+
+    shapes = [
+        ("rows", lambda: {"transactions": [dict(zip(FIELDS, r)) for r in rows]}),
+        ("columnar", lambda: {"transactions": rows_to_columns(rows, FIELDS)}),
+    ]
+
+    print(f"{n} transactions\n")
+    print(f"{'provider':<10}{'shape':<10}{'encode ms':>11}{'raw KB':>10}{'gzip KB':>10}{'gzip ms':>10}")
+    with app.app_context():
+        for pname, provider in providers:
+            for sname, build in shapes:
+                # Building the payload is part of the cost: row dicts are what the columnar shape avoids
+                ms, body = timed(lambda: provider.response(build()).get_data())
+                gzip_ms, packed = timed(lambda: gzip.compress(body, compresslevel=GZIP_LEVEL))
+                print(f"{pname:<10}{sname:<10}{ms:>11.1f}{len(body) / 1024:>10.0f}{len(packed) / 1024:>10.0f}"
+                      f"{gzip_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
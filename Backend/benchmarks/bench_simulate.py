@@ -0,0 +1,52 @@
+"""
+bench_simulate.py - Monte Carlo Simulation Latency
+
+Process: Seeds N transactions and times what GET /simulate does for one user: loading the last 90 days and the
+current month (through the ledger cache, cold and warm), then the vectorized bootstrap at several trial counts.
+The target is under 50 ms per request at the default 20,000 trials.
+
+Usage:
+    python benchmarks/bench_simulate.py [rows]
+"""
+import sys
+from datetime import date, timedelta
+
+from common import setup_db, seed_transactions, cleanup, timed, BENCH_USER_ID
+from analytics import expense_rows_since, month_expense_rows, fixed_categories
+from ledger import ledger_cache
+from simulation import simulate_month_end, SIMULATION_HISTORY_DAYS
+
+TRIALS = [1000, 20000, 100000]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    conn = setup_db()
+    cleanup(conn)
+    seed_transactions(conn, n)
+    cur = conn.cursor()
+    today = date.today()
+    cutoff = (today - timedelta(days=SIMULATION_HISTORY_DAYS)).isoformat()
+    month = today.strftime("%Y-%m")
+
+    def load():
+        return (expense_rows_since(cur, BENCH_USER_ID, cutoff), month_expense_rows(cur, BENCH_USER_ID, month),
+                fixed_categories(cur, BENCH_USER_ID))
+
+    ledger_cache.invalidate(BENCH_USER_ID)
+    cold_ms, _ = timed(lambda: (ledger_cache.invalidate(BENCH_USER_ID), load()), repeat=3)
+    warm_ms, (history, month_rows, fixed) = timed(load)
+    print(f"{n} transactions, {len(history)} in the last {SIMULATION_HISTORY_DAYS} days\n")
+    print(f"load rows (cold cache)  {cold_ms:8.1f} ms")
+    print(f"load rows (warm cache)  {warm_ms:8.1f} ms\n")
+
+    print(f"{'trials':>8}{'simulate ms':>13}{'p50':>12}{'p95':>12}")
+    for trials in TRIALS:
+        ms, result = timed(lambda: simulate_month_end(history, month_rows, today, fixed, 50000, trials, seed=1))
+        print(f"{trials:>8}{ms:>13.1f}{result['month_end']['p50']:>12.0f}{result['month_end']['p95']:>12.0f}")
+
+    cleanup(conn)
+
+
+if __name__ == "__main__":
+    main()
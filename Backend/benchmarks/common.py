@@ -0,0 +1,72 @@
+"""
+common.py - Shared Benchmark Helpers
+
+Process: Points db.py at a throwaway SQLite file (or the DATABASE_URL Postgres instance) and seeds
+synthetic transactions for a dedicated benchmark user.
+
+Main Functionality:
+  - setup_db(): Creates the schema in the benchmark database
+  - seed_transactions(): Bulk inserts N synthetic transactions spread over several years
+  - cleanup(): Removes the benchmark user's rows
+  - timed(): Best-of-N wall clock timing in milliseconds
+"""
+import os
+import sys
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from categories import intern_category
+
+BENCH_USER_ID = 900000001
+CATEGORIES = ["Food", "Rent", "Travel", "Bills", "Shopping", "Health", "Utilities", "Entertainment", "Education"]
+
+
+def setup_db():
+    """Uses a temporary SQLite file unless DATABASE_URL points at Postgres."""
+    if not db.DATABASE_URL:
+        db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="finance_bench_"), "bench.db")
+    db.init_db()
+    return db.get_connection()
+
+
+def seed_transactions(conn, n, user_id=BENCH_USER_ID, years=3, seed=7):
+    rnd = random.Random(seed)
+    start = date.today() - timedelta(days=365 * years)
+    span = 365 * years
+    cur = conn.cursor()
+    category_ids = {cat: intern_category(cur, user_id, cat)[0] for cat in CATEGORIES}
+    rows = []
+    for i in range(n):
+        cat = rnd.choice(CATEGORIES)
+        tx_type = "income" if rnd.random() < 0.05 else "expense"
+        amount = round(rnd.uniform(20000, 25000) if cat == "Rent" else rnd.lognormvariate(6, 1), 2)
+        day = (start + timedelta(days=rnd.randrange(span))).isoformat()
+        rows.append((user_id, day, cat, category_ids[cat], amount, f"{cat.lower()} purchase #{i}", tx_type))
+    cur.executemany(f"""
+        INSERT INTO transactions (user_id, date, category, category_id, amount, notes, type)
+        VALUES ({db.PLACEHOLDER}, {db.PLACEHOLDER}, {db.PLACEHOLDER}, {db.PLACEHOLDER}, {db.PLACEHOLDER}, {db.PLACEHOLDER}, {db.PLACEHOLDER})
+    """, rows)
+    conn.commit()
+
+
+def cleanup(conn, user_id=BENCH_USER_ID):
+    cur = conn.cursor()
+    cur.execute(f"DELETE FROM transactions WHERE user_id={db.PLACEHOLDER}", (user_id,))
+    cur.execute(f"DELETE FROM categories WHERE user_id={db.PLACEHOLDER}", (user_id,))
+    conn.commit()
+
+
+def timed(fn, repeat=5):
+    """Returns (best milliseconds, last result)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, (time.perf_counter() - t0) * 1000)
+    return best, result
@@ -0,0 +1,306 @@
+"""
+load_test.py - Concurrent Load and Soak Test
+
+Process: Starts the app under gunicorn (or targets a running server with --url) and drives it with N virtual
+users. Each user registers, seeds a few months of transactions, then loops over a weighted mix of login, add,
+month view, dashboard, chat, and PDF export with random think time. The Gemini client is replaced by the local
+stub in utils.py (LLM_STUB=1), so chat latency and failures are controlled and no API quota is used.
+
+Every --report-every seconds it prints throughput, latency percentiles, error rate and the DB connection counts
+from /metrics; at the end it prints a per-action summary (and writes it as JSON with --json).
+
+Usage:
+    python benchmarks/load_test.py --users 200 --duration 1800 --workers 4 --threads 8
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --admin-token $ADMIN_TOKEN --users 50
+"""
+import argparse
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Relative frequency of each action in a virtual user's loop
+ACTIONS = {
+    "add": 30,
+    "month_view": 25,
+    "dashboard": 20,
+    "chat": 10,
+    "login": 5,
+    "export_pdf": 5,
+}
+CATEGORIES = ["Food", "Rent", "Travel", "Bills", "Shopping", "Health", "Entertainment"]
+SEED_TRANSACTIONS = 40
+REQUEST_TIMEOUT = 60
+
+
+class Recorder:
+    """Thread-safe request log: per-action latencies and errors, plus a rolling window for interval reports."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+        self.window = []
+
+    def record(self, action, seconds, status):
+        # status is the HTTP status, or the exception class name when the request never got a response
+        failed = not isinstance(status, int) or status >= 400
+        with self.lock:
+            self.latencies.setdefault(action, []).append(seconds)
+            self.errors[action] = self.errors.get(action, 0) + failed
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            self.window.append((seconds, failed))
+
+    def drain_window(self):
+        with self.lock:
+            window, self.window = self.window, []
+        return window
+
+
+def _percentiles(values):
+    if not len(values):
+        return {"p50": 0, "p95": 0, "p99": 0, "max": 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return {"p50": round(p50, 1), "p95": round(p95, 1), "p99": round(p99, 1), "max": round(max(values) * 1000, 1)}
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, base_url, index, run_id, recorder, deadline, think_seconds, start_delay):
+        super().__init__(daemon=True)
+        self.base = base_url
+        self.email = f"load-{run_id}-{index}@example.com"
+        self.recorder = recorder
+        self.deadline = deadline
+        self.think = think_seconds
+        self.start_delay = start_delay
+        self.rnd = random.Random(index)
+        self.session = requests.Session()
+
+    def call(self, action, method, path, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            r = self.session.request(method, self.base + path, timeout=REQUEST_TIMEOUT, **kwargs)
+            status = r.status_code
+        except requests.RequestException as e:
+            r, status = None, type(e).__name__
+        self.recorder.record(action, time.perf_counter() - t0, status)
+        return r
+
+    def _random_tx(self, days_back):
+        d = date.today() - timedelta(days=self.rnd.randint(0, days_back))
+        expense = self.rnd.random() < 0.9
+        return {
+            "date": d.isoformat(),
+            "category": self.rnd.choice(CATEGORIES),
+            "amount": round(self.rnd.uniform(50, 5000), 2) if expense else 60000,
+            "notes": "load test",
+            "type": "expense" if expense else "income",
+        }
+
+    def login(self):
+        r = self.call("login", "POST", "/login", json={"email": self.email, "password": "load-test"})
+        if r is not None and r.ok:
+            self.session.headers["Authorization"] = f"Bearer {r.json()['access_token']}"
+
+    def setup(self):
+        r = self.call("register", "POST", "/register",
+                      json={"email": self.email, "password": "load-test", "name": "Load Test"})
+        if r is None or not r.ok:
+            return False
+        self.session.headers["Authorization"] = f"Bearer {r.json()['access_token']}"
+        for _ in range(SEED_TRANSACTIONS):
+            self.call("seed", "POST", "/add", json=self._random_tx(90))
+        self.call("seed", "POST", "/budget", json={"month": date.today().strftime("%Y-%m"), "amount": 50000})
+        return True
+
+    def step(self, action):
+        if action == "add":
+            self.call(action, "POST", "/add", json=self._random_tx(10))
+        elif action == "month_view":
+            self.call(action, "GET", "/transactions", params={"month": date.today().strftime("%Y-%m")})
+        elif action == "dashboard":
+            self.call(action, "GET", "/dashboard")
+        elif action == "chat":
+            self.call(action, "POST", "/chat", json={"message": "How am I doing this month?"})
+        elif action == "login":
+            self.login()
+        elif action == "export_pdf":
+            self.call(action, "GET", "/export-pdf", params={"month": date.today().strftime("%Y-%m")})
+
+    def run(self):
+        # Ramp-up: users arrive spread over the ramp period instead of all at once
+        time.sleep(self.start_delay)
+        if not self.setup():
+            return
+        actions, weights = zip(*ACTIONS.items())
+        while time.time() < self.deadline:
+            self.step(self.rnd.choices(actions, weights)[0])
+            time.sleep(self.rnd.expovariate(1 / self.think) if self.think > 0 else 0)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, admin_token):
+    """gunicorn on a throwaway SQLite file (unless DATABASE_URL is set) with the LLM stub enabled."""
+    port = _free_port()
+    env = {
+        **os.environ,
+        "LLM_STUB": "1",
+        "LLM_STUB_LATENCY_MS": str(args.llm_latency_ms),
+        "LLM_STUB_FAILURE_RATE": str(args.llm_failure_rate),
+        "ADMIN_TOKEN": admin_token,
+        "JWT_SECRET_KEY": secrets.token_hex(32),
+    }
+    if not os.getenv("DATABASE_URL"):
+        env["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="finance_load_"), "load.db")
+    cmd = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+           "--workers", str(args.workers), "--threads", str(args.threads), "--timeout", "120",
+           "--log-level", "warning"]
+    server = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env)
+
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(120):
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited with code {server.returncode}")
+        try:
+            requests.get(base + "/metrics", headers={"X-Admin-Token": admin_token}, timeout=2)
+            return server, base
+        except requests.RequestException:
+            time.sleep(0.5)
+    server.terminate()
+    raise SystemExit("gunicorn did not start")
+
+
+class MetricsPoller:
+    """Keeps the latest /metrics DB counters per worker process (each poll reaches one gunicorn worker)."""
+
+    def __init__(self, base_url, admin_token):
+        self.base = base_url
+        self.headers = {"X-Admin-Token": admin_token}
+        self.by_pid = {}
+        self.server_sessions = None
+        self.peak_server_sessions = 0
+
+    def poll(self, samples=4):
+        for _ in range(samples):
+            try:
+                r = requests.get(self.base + "/metrics", headers=self.headers, timeout=5)
+            except requests.RequestException:
+                continue
+            if not r.ok:
+                continue
+            data = r.json()
+            self.by_pid[data["pid"]] = data["db"]
+            if "server_sessions" in data["db"]:
+                self.server_sessions = data["db"]["server_sessions"]
+                self.peak_server_sessions = max(self.peak_server_sessions, self.server_sessions)
+
+    def totals(self):
+        stats = list(self.by_pid.values())
+        return {
+            "processes_seen": len(stats),
+            "live": sum(s["live"] for s in stats),
+            "peak_live": sum(s["peak_live"] for s in stats),
+            "opened": sum(s["opened"] for s in stats),
+            "server_sessions": self.server_sessions,
+            "peak_server_sessions": self.peak_server_sessions if self.server_sessions is not None else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed-traffic load and soak test")
+    parser.add_argument("--url", help="Target a running server instead of starting gunicorn")
+    parser.add_argument("--admin-token", default=os.getenv("ADMIN_TOKEN"), help="For /metrics when using --url")
+    parser.add_argument("--users", type=int, default=50, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=int, default=120, help="Seconds to run (use thousands for a soak)")
+    parser.add_argument("--ramp", type=float, default=10, help="Seconds over which users arrive")
+    parser.add_argument("--think", type=float, default=1.0, help="Mean think time between a user's actions")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="Stubbed Gemini latency")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.02, help="Stubbed Gemini failure probability")
+    parser.add_argument("--report-every", type=float, default=10, help="Seconds between interval reports")
+    parser.add_argument("--json", help="Write the final summary to this file")
+    args = parser.parse_args()
+
+    server = None
+    admin_token = args.admin_token
+    if args.url:
+        base = args.url.rstrip("/")
+    else:
+        admin_token = secrets.token_hex(16)
+        server, base = start_server(args, admin_token)
+    poller = MetricsPoller(base, admin_token) if admin_token else None
+
+    recorder = Recorder()
+    run_id = secrets.token_hex(4)
+    started = time.time()
+    deadline = started + args.ramp + args.duration
+    users = [VirtualUser(base, i, run_id, recorder, deadline, args.think, args.ramp * i / max(args.users, 1))
+             for i in range(args.users)]
+    for u in users:
+        u.start()
+
+    print(f"{args.users} users, {args.duration}s after {args.ramp}s ramp-up against {base}")
+    print(f"{'t(s)':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err %':>8}{'db live':>9}{'db peak':>9}")
+    try:
+        last = time.time()
+        while any(u.is_alive() for u in users):
+            time.sleep(args.report_every)
+            now = time.time()
+            window = recorder.drain_window()
+            if poller:
+                poller.poll()
+            pct = _percentiles([w[0] for w in window])
+            errors = 100 * sum(w[1] for w in window) / len(window) if window else 0
+            db_stats = poller.totals() if poller else {"live": "-", "peak_live": "-"}
+            print(f"{now - started:>6.0f}{len(window) / (now - last):>9.1f}{pct['p50']:>9}{pct['p95']:>9}"
+                  f"{pct['p99']:>9}{errors:>8.2f}{db_stats['live']:>9}{db_stats['peak_live']:>9}")
+            last = now
+    except KeyboardInterrupt:
+        print("Interrupted, summarizing what ran so far")
+    finally:
+        elapsed = time.time() - started
+        if poller:
+            poller.poll()
+        if server:
+            server.terminate()
+            server.wait()
+
+    summary = {"users": args.users, "seconds": round(elapsed, 1), "actions": {}, "statuses": recorder.statuses}
+    print(f"\n{'action':<12}{'count':>8}{'req/s':>9}{'err %':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    total = sum(len(v) for v in recorder.latencies.values())
+    for action, values in sorted(recorder.latencies.items()):
+        pct = _percentiles(values)
+        err = 100 * recorder.errors[action] / len(values)
+        summary["actions"][action] = {"count": len(values), "error_pct": round(err, 2), **pct}
+        print(f"{action:<12}{len(values):>8}{len(values) / elapsed:>9.1f}{err:>8.2f}"
+              f"{pct['p50']:>9}{pct['p95']:>9}{pct['p99']:>9}{pct['max']:>9}")
+    print(f"\n{total} requests, {total / elapsed:.1f} req/s, statuses {recorder.statuses}")
+    if poller:
+        summary["db"] = poller.totals()
+        print(f"DB connections: {summary['db']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
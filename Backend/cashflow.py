@@ -0,0 +1,218 @@
+"""
+cashflow.py - Cash-Flow Calendar Projection
+
+Process: Projects a user's balance day by day over the coming months without writing anything. Every recurring
+template is expanded for every month of the horizon at once (a months x templates grid of dates), transactions
+already booked for future dates are placed on their day, and expected variable spend is the user's average
+non-recurring spend outside fixed categories for that weekday over the last 90 days (as in simulation.py). The daily running balance is one cumulative sum,
+so a 24-month calendar costs about as much as a one-month one.
+
+Recurring occurrences that expand_recurring (transactions.py) has already written are not counted twice: they are
+matched on the same date, category and notes it checks before inserting.
+
+Main Functionality:
+  - projection_end(): Last day of a horizon of N months
+  - current_balance(): Lifetime income minus expenses up to today, or None for users who log no income
+  - template_occurrences(): (day offset, signed amount) arrays for every template occurrence in the horizon
+  - expected_variable_spend(): Expected spend for each projected day from the weekday averages
+  - project_cash_flow(): The daily calendar plus its low-balance periods
+"""
+import calendar
+from datetime import date, timedelta
+
+import numpy as np
+
+from db import PLACEHOLDER
+from analytics import monthly_totals, CATEGORY_JOIN, CATEGORY_NAME, SUM_EXPR, DIALECT
+from simulation import daily_variable_spend, SIMULATION_HISTORY_DAYS
+
+PROJECTION_MONTHS = 3
+MAX_PROJECTION_MONTHS = 24
+# Suffix expand_recurring puts on the notes of the rows it writes
+RECURRING_SUFFIX = "[Recurring]"
+
+
+def _add_months(day, months):
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _clamped_day(value):
+    """'YYYY-MM-DD' -> date, pulling days past the month end back to its last day ('2024-02-31' -> Feb 29).
+    expand_recurring writes the template's day as is, so such dates do exist."""
+    try:
+        year, month, day = int(value[:4]), int(value[5:7]), int(value[8:10])
+        return date(year, month, max(1, min(day, calendar.monthrange(year, month)[1])))
+    except (TypeError, ValueError, calendar.IllegalMonthError):
+        return None
+
+
+def projection_end(today, months):
+    """Last day of the calendar: the same day of the month `months` months after today."""
+    return _add_months(today, months)
+
+
+def _signed(amounts, types):
+    return np.where(np.asarray(types) == "income", 1.0, -1.0) * np.asarray(amounts, dtype=float)
+
+
+def current_balance(cur, user_id, today):
+    """Income minus expenses over every transaction dated up to today, archived months included. None when the
+    user has no income rows: most users only log expenses, and their net would be a meaningless large deficit."""
+    totals = [(tx_type, total) for _, tx_type, total in monthly_totals(cur, user_id) if total]
+    if not any(tx_type == "income" for tx_type, _ in totals):
+        return None
+    net = sum(total if tx_type == "income" else -total for tx_type, total in totals)
+    # Monthly totals also hold rows dated after today (e.g. expanded recurring ones); those are projected on their day
+    cur.execute(f"""
+        SELECT amount, type FROM transactions WHERE user_id={PLACEHOLDER} AND date > {PLACEHOLDER}
+    """, (user_id, today.isoformat()))
+    later = cur.fetchall()
+    if later:
+        net -= float(_signed([a or 0 for a, _ in later], [t for _, t in later]).sum())
+    return round(net, 2)
+
+
+def booked_rows(cur, user_id, today, end):
+    """(date, amount, type, category_id, notes) for transactions dated from today through end's month.
+    Today's rows are only needed to recognise template occurrences that are already written."""
+    # String bounds: unclamped dates like '2024-02-31' still sort inside their month
+    cur.execute(f"""
+        SELECT date, amount, type, category_id, notes FROM transactions
+        WHERE user_id={PLACEHOLDER} AND date >= {PLACEHOLDER} AND date < {PLACEHOLDER}
+    """, (user_id, today.isoformat(), _add_months(end.replace(day=1), 1).isoformat()))
+    return cur.fetchall()
+
+
+def recurring_templates(cur, user_id):
+    cur.execute(f"""
+        SELECT amount, type, day_of_month, category_id, notes FROM recurring_transactions WHERE user_id={PLACEHOLDER}
+    """, (user_id,))
+    return cur.fetchall()
+
+
+def variable_history_rows(cur, user_id, today):
+    """(date, total, category) expense totals per day and category of the history window, without the rows
+    written from templates. Shaped like expense rows so daily_variable_spend() takes them as is."""
+    cur.execute(f"""
+        SELECT a.date, {SUM_EXPR[DIALECT]}, {CATEGORY_NAME} FROM transactions a {CATEGORY_JOIN}
+        WHERE a.user_id={PLACEHOLDER} AND a.type='expense' AND a.date >= {PLACEHOLDER} AND a.date < {PLACEHOLDER}
+          AND COALESCE(a.notes, '') NOT LIKE {PLACEHOLDER}
+        GROUP BY a.date, {CATEGORY_NAME}
+    """, (user_id, (today - timedelta(days=SIMULATION_HISTORY_DAYS)).isoformat(), today.isoformat(),
+          f"%{RECURRING_SUFFIX}"))
+    return cur.fetchall()
+
+
+def template_occurrences(templates, today, end, booked=()):
+    """Every template occurrence dated from today to end that is not already among the booked rows.
+    templates: (amount, type, day_of_month, category_id, notes). Returns (day offsets from today, signed amounts)."""
+    if not templates:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    n_months = (end.year - today.year) * 12 + end.month - today.month + 1
+    firsts = [_add_months(today.replace(day=1), m) for m in range(n_months)]
+    month_lengths = np.array([calendar.monthrange(f.year, f.month)[1] for f in firsts])
+    first_offsets = np.array([(f - today).days for f in firsts])
+    days = np.array([t[2] or 1 for t in templates], dtype=np.int64)
+
+    # (months x templates): the template's day, pulled back to the end of shorter months
+    offsets = first_offsets[:, None] + np.clip(days[None, :], 1, month_lengths[:, None]) - 1
+    amounts = np.broadcast_to(_signed([t[0] or 0 for t in templates], [t[1] for t in templates]), offsets.shape)
+    keep = (offsets >= 0) & (offsets <= (end - today).days)
+
+    if booked:
+        # Same key expand_recurring checks before it inserts: the unclamped date, category id and suffixed notes
+        month_index = {f.strftime("%Y-%m"): m for m, f in enumerate(firsts)}
+        template_index = {}
+        for t, (_, _, day, category_id, notes) in enumerate(templates):
+            template_index.setdefault((day, category_id, f"{notes} {RECURRING_SUFFIX}".strip()), []).append(t)
+        for tx_date, _, _, category_id, notes in booked:
+            m = month_index.get((tx_date or "")[:7])
+            if m is None or not (notes or "").endswith(RECURRING_SUFFIX):
+                continue
+            try:
+                day = int(tx_date[8:10])
+            except ValueError:
+                continue
+            for t in template_index.get((day, category_id, notes), ()):
+                keep[m, t] = False
+    return offsets[keep], amounts[keep]
+
+
+def expected_variable_spend(history_rows, today, n_days, fixed_cats=frozenset()):
+    """Expected non-recurring spend for each of the n_days from today: the mean spend of that weekday over the
+    history window. Fixed categories are left out: rent or EMIs come from their templates or booked rows, and
+    averaging them over weekdays would count them twice. Today is left at zero, since its spending so far is
+    already in the balance."""
+    end = today
+    start = end - timedelta(days=SIMULATION_HISTORY_DAYS)
+    dated = [d for d in (_clamped_day(r[0]) for r in history_rows) if d is not None]
+    start = max(start, min(dated)) if dated else end
+    daily, weekdays = daily_variable_spend(history_rows, start, end, fixed_cats)
+
+    expected = np.zeros(n_days)
+    if len(daily):
+        counts = np.bincount(weekdays, minlength=7)
+        sums = np.bincount(weekdays, weights=daily, minlength=7)
+        # A history shorter than a week leaves some weekdays unseen; they get the overall mean
+        by_weekday = np.where(counts > 0, sums / np.maximum(counts, 1), daily.mean())
+        expected = by_weekday[(np.arange(n_days) + today.weekday()) % 7]
+        expected[0] = 0
+    return expected
+
+
+def _low_periods(dates, balance, min_balance):
+    """Runs of consecutive days below min_balance, each with its lowest point."""
+    low = balance < min_balance
+    if not low.any():
+        return []
+    edges = np.diff(np.concatenate(([0], low.astype(np.int8), [0])))
+    starts, stops = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    periods = []
+    for s, e in zip(starts.tolist(), stops.tolist()):
+        i = s + int(balance[s:e].argmin())
+        periods.append({"from": dates[s], "to": dates[e - 1], "days": e - s,
+                        "lowest_date": dates[i], "lowest_balance": round(float(balance[i]), 2)})
+    return periods
+
+
+def project_cash_flow(start_balance, templates, booked, history_rows, today, months=PROJECTION_MONTHS, min_balance=0,
+                      fixed_cats=frozenset()):
+    """Daily calendar from today to the same day `months` months later. Returns (rows, summary): rows are
+    (date, income, expense, variable, balance) tuples, one per day; summary is a JSON-ready dict."""
+    end = projection_end(today, months)
+    n_days = (end - today).days + 1
+
+    offsets, amounts = template_occurrences(templates, today, end, booked)
+    # Rows dated up to today are already in start_balance (compared as strings, like current_balance does)
+    later = [r for r in booked if (r[0] or "") > today.isoformat()]
+    picked = [(d, r) for d, r in zip((_clamped_day(r[0]) for r in later), later) if d is not None and d <= end]
+    if picked:
+        offsets = np.concatenate([offsets, np.array([(d - today).days for d, _ in picked], dtype=np.int64)])
+        amounts = np.concatenate([amounts, _signed([r[1] or 0 for _, r in picked], [r[2] for _, r in picked])])
+
+    income = np.bincount(offsets, weights=np.maximum(amounts, 0), minlength=n_days)
+    expense = np.bincount(offsets, weights=np.maximum(-amounts, 0), minlength=n_days)
+    variable = expected_variable_spend(history_rows, today, n_days, fixed_cats)
+    balance = start_balance + np.cumsum(income - expense - variable)
+
+    dates = np.arange(np.datetime64(today), np.datetime64(end) + 1).astype(str).tolist()
+    columns = [np.round(c, 2).tolist() for c in (income, expense, variable, balance)]
+    rows = list(zip(dates, *columns))
+
+    lowest = int(balance.argmin())
+    summary = {
+        "from": dates[0],
+        "to": dates[-1],
+        "months": months,
+        "start_balance": round(float(start_balance), 2),
+        "end_balance": columns[3][-1],
+        "min_balance": min_balance,
+        "lowest": {"date": dates[lowest], "balance": columns[3][lowest]},
+        "low_balance_periods": _low_periods(dates, balance, min_balance),
+        "scheduled_income": round(float(income.sum()), 2),
+        "scheduled_expense": round(float(expense.sum()), 2),
+        "expected_variable": round(float(variable.sum()), 2),
+    }
+    return rows, summary
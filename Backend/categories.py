@@ -0,0 +1,81 @@
+"""
+categories.py - Interned Per-User Category Dictionary
+
+Process: Maps free-text categories onto one row per user and canonical name in the `categories` table,
+so transactions and recurring templates reference them by integer id and the fixed/variable split is a lookup.
+
+Main Functionality:
+  - normalize_category(): Canonical spelling ("  food  court " -> "Food Court")
+  - intern_category(): Returns the id for a user's category, creating it on first use
+  - fixed_category_names(): Names the user's analytics treat as fixed costs
+  - list_categories() / set_category_fixed(): Read and edit the dictionary
+  - backfill_category_ids(): Assigns ids to rows written before the dictionary existed
+"""
+from db import PLACEHOLDER
+
+# Default classification for newly interned categories; users can flip the flag per category
+FIXED_CATEGORIES = {"Rent", "Bills", "Education", "Insurance", "Utilities", "Emi", "Loan"}
+
+
+def normalize_category(name):
+    """Collapses whitespace and title-cases. Empty input stays '' (uncategorized, no id)."""
+    if not name:
+        return ""
+    return " ".join(str(name).split()).title()
+
+
+def intern_category(cur, user_id, name):
+    """Returns (category_id, canonical name). Uncategorized input returns (None, '')."""
+    canonical = normalize_category(name)
+    if not canonical:
+        return None, ""
+    cur.execute(f"SELECT id FROM categories WHERE user_id={PLACEHOLDER} AND name={PLACEHOLDER}", (user_id, canonical))
+    row = cur.fetchone()
+    if not row:
+        cur.execute(f"""
+            INSERT INTO categories (user_id, name, is_fixed) VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})
+            ON CONFLICT (user_id, name) DO NOTHING
+        """, (user_id, canonical, 1 if canonical in FIXED_CATEGORIES else 0))
+        cur.execute(f"SELECT id FROM categories WHERE user_id={PLACEHOLDER} AND name={PLACEHOLDER}", (user_id, canonical))
+        row = cur.fetchone()
+    return row[0], canonical
+
+
+def category_names(cur, user_id):
+    """{category_id: (name, is_fixed)} for one user."""
+    cur.execute(f"SELECT id, name, is_fixed FROM categories WHERE user_id={PLACEHOLDER}", (user_id,))
+    return {r[0]: (r[1], bool(r[2])) for r in cur.fetchall()}
+
+
+def fixed_category_names(cur, user_id):
+    cur.execute(f"SELECT name FROM categories WHERE user_id={PLACEHOLDER} AND is_fixed=1", (user_id,))
+    return {r[0] for r in cur.fetchall()}
+
+
+def list_categories(cur, user_id):
+    cur.execute(f"SELECT id, name, is_fixed FROM categories WHERE user_id={PLACEHOLDER} ORDER BY name", (user_id,))
+    return [{"id": r[0], "name": r[1], "is_fixed": bool(r[2])} for r in cur.fetchall()]
+
+
+def set_category_fixed(cur, user_id, category_id, is_fixed):
+    """Returns False when the category does not belong to the user."""
+    cur.execute(f"UPDATE categories SET is_fixed={PLACEHOLDER} WHERE id={PLACEHOLDER} AND user_id={PLACEHOLDER}",
+                (1 if is_fixed else 0, category_id, user_id))
+    return cur.rowcount > 0
+
+
+def backfill_category_ids(cur):
+    """Interns the raw category text of rows that have no category_id yet. Cheap no-op once done."""
+    for table in ("transactions", "recurring_transactions"):
+        cur.execute(f"""
+            SELECT DISTINCT user_id, category FROM {table}
+            WHERE category_id IS NULL AND category IS NOT NULL AND category <> ''
+        """)
+        for user_id, raw in cur.fetchall():
+            category_id, _ = intern_category(cur, user_id, raw)
+            if category_id is None:
+                continue
+            cur.execute(f"""
+                UPDATE {table} SET category_id={PLACEHOLDER}
+                WHERE user_id={PLACEHOLDER} AND category={PLACEHOLDER} AND category_id IS NULL
+            """, (category_id, user_id, raw))
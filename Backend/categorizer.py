@@ -0,0 +1,244 @@
+"""
+categorizer.py - Local Transaction Auto-Categorization
+
+Process: Learns each user's own labeling from their categorized transactions (notes and type -> category) and
+suggests categories for new or uncategorized ones. Notes become TF-IDF vectors over word and character-trigram
+tokens, and the classifier is linear: one L2-normalized centroid per category (Rocchio / nearest centroid),
+so training is a single pass and scoring a batch is one sparse-times-dense product. Pure NumPy; nothing leaves
+the server.
+
+Models are cached per user and keyed by the user's data version (see versions.py), so any write retrains on
+the next call and unchanged users are never retrained. The cache is bounded by CATEGORIZER_CACHE_BYTES.
+
+Main Functionality:
+  - train(): Fits a model from (notes, type, category_id) rows
+  - CategoryModel.predict(): (category_id, confidence) for a batch of (notes, type) items
+  - model_for(): Cached model for a user, or None when there are too few labeled rows
+  - categorize_uncategorized(): Fills in the category of a user's uncategorized transactions
+"""
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from db import PLACEHOLDER
+from versions import get_versions, bump_versions, USER_SCOPE
+from changelog import record_change
+from categories import category_names
+from anomaly_stats import record_write
+from ledger import ledger_cache
+
+CATEGORIZER_CACHE_BYTES = int(os.getenv("CATEGORIZER_CACHE_BYTES", 64 * 1024 * 1024))
+# Suggestions scoring below this cosine similarity are not applied
+CATEGORIZE_MIN_CONFIDENCE = float(os.getenv("CATEGORIZE_MIN_CONFIDENCE", 0.35))
+MIN_TRAINING_ROWS = 5
+MAX_TRAINING_ROWS = 20000
+MAX_BATCH_ITEMS = 5000
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _tokens(notes, tx_type):
+    text = (notes or "").lower().replace("[recurring]", "")
+    tokens = [f"t:{tx_type or 'expense'}"]
+    for word in _WORD.findall(text):
+        tokens.append(f"w:{word}")
+        # Character trigrams make misspellings and merchant-name variants ("swiggy", "swigy") overlap
+        padded = f"#{word}#"
+        tokens.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return tokens
+
+
+def _sparse_counts(docs, vocab, grow):
+    """Token lists -> (row, column, count) arrays. With grow, unseen tokens are added to vocab."""
+    rows, cols = [], []
+    for r, tokens in enumerate(docs):
+        for t in tokens:
+            c = vocab.get(t)
+            if c is None:
+                if not grow:
+                    continue
+                c = vocab[t] = len(vocab)
+            rows.append(r)
+            cols.append(c)
+    rows = np.array(rows, dtype=np.int64)
+    cols = np.array(cols, dtype=np.int64)
+    if not len(rows):
+        return rows, cols, np.zeros(0)
+    # Collapse repeated (row, column) pairs into counts
+    keys, counts = np.unique(rows * max(len(vocab), 1) + cols, return_counts=True)
+    return keys // max(len(vocab), 1), keys % max(len(vocab), 1), counts.astype(float)
+
+
+def _tfidf(rows, cols, counts, idf, n_docs):
+    """Sublinear TF times IDF, L2-normalized per document. Returns the weights for (rows, cols)."""
+    weights = (1 + np.log(counts)) * idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=n_docs))
+    return weights / np.where(norms > 0, norms, 1)[rows]
+
+
+class CategoryModel:
+    def __init__(self, vocab, idf, centroids, category_ids):
+        self.vocab = vocab
+        self.idf = idf
+        # (categories x vocabulary), rows L2-normalized
+        self.centroids = centroids
+        self.category_ids = category_ids
+        self.type_cols = np.array([c for t, c in vocab.items() if t.startswith("t:")], dtype=np.int64)
+        self.nbytes = self._size()
+
+    def _size(self):
+        # The centroid matrix dominates (categories x vocabulary float64); the vocab dict holds a key string per column
+        labels = sys.getsizeof(self.vocab) + sum(sys.getsizeof(t) for t in self.vocab)
+        arrays = (self.idf, self.centroids, self.type_cols)
+        return sum(a.nbytes for a in arrays) + labels + len(self.category_ids) * 32 + 512
+
+    def predict(self, items):
+        """items: (notes, type) pairs. Returns [(category_id, confidence)], confidence being the cosine
+        similarity to the best category centroid (0 when no word of the notes is known)."""
+        if not items:
+            return []
+        rows, cols, counts = _sparse_counts([_tokens(n, t) for n, t in items], self.vocab, grow=False)
+        scores = np.zeros((len(items), len(self.category_ids)))
+        if len(rows):
+            weights = _tfidf(rows, cols, counts, self.idf, len(items))
+            # Sparse documents times dense centroids: each nonzero adds its weight times a centroid column
+            np.add.at(scores, rows, weights[:, None] * self.centroids[:, cols].T)
+        best = scores.argmax(axis=1)
+        confidence = scores[np.arange(len(items)), best]
+        # The type token alone would pull empty notes towards the biggest category; that is not a prediction
+        has_text = np.bincount(rows[~np.isin(cols, self.type_cols)], minlength=len(items)) > 0
+        confidence = np.where(has_text, confidence, 0)
+        return [(self.category_ids[b], round(float(c), 4)) for b, c in zip(best.tolist(), confidence.tolist())]
+
+
+def train(rows):
+    """rows: (notes, type, category_id). Returns a CategoryModel, or None without enough rows or categories."""
+    labels = [r[2] for r in rows]
+    category_ids = sorted(set(labels))
+    if len(rows) < MIN_TRAINING_ROWS or len(category_ids) < 2:
+        return None
+
+    vocab = {}
+    doc_rows, cols, counts = _sparse_counts([_tokens(r[0], r[1]) for r in rows], vocab, grow=True)
+    n_docs = len(rows)
+    df = np.bincount(cols, minlength=len(vocab))
+    idf = np.log((1 + n_docs) / (1 + df)) + 1
+    weights = _tfidf(doc_rows, cols, counts, idf, n_docs)
+
+    label_index = {c: i for i, c in enumerate(category_ids)}
+    doc_labels = np.array([label_index[c] for c in labels], dtype=np.int64)
+    flat = doc_labels[doc_rows] * len(vocab) + cols
+    centroids = np.bincount(flat, weights=weights, minlength=len(category_ids) * len(vocab))
+    centroids = centroids.reshape(len(category_ids), len(vocab))
+    norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+    centroids /= np.where(norms > 0, norms, 1)
+    return CategoryModel(vocab, idf, centroids, category_ids)
+
+
+def training_rows(cur, user_id):
+    # The most recent labels win when a user has changed how they categorize
+    cur.execute(f"""
+        SELECT notes, type, category_id FROM transactions
+        WHERE user_id={PLACEHOLDER} AND category_id IS NOT NULL AND notes IS NOT NULL AND notes <> ''
+        ORDER BY id DESC LIMIT {MAX_TRAINING_ROWS}
+    """, (user_id,))
+    return cur.fetchall()
+
+
+# Bytes charged for a cached "too few labels" (None) entry
+_EMPTY_ENTRY_BYTES = 64
+
+
+class _ModelCache:
+    """LRU of user_id -> (data version, CategoryModel or None), bounded by the models' bytes like LedgerCache."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+
+    def get(self, cur, user_id):
+        version = get_versions(cur, user_id, USER_SCOPE)[USER_SCOPE]
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+        model = train(training_rows(cur, user_id))
+        self._put(user_id, version, model)
+        return model
+
+    def _put(self, user_id, version, model):
+        size = model.nbytes if model is not None else _EMPTY_ENTRY_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(user_id, None)
+            if old:
+                self.bytes -= old[2]
+            self._entries[user_id] = (version, model, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+
+_models = _ModelCache(CATEGORIZER_CACHE_BYTES)
+
+
+def model_for(cur, user_id):
+    return _models.get(cur, user_id)
+
+
+def suggest(cur, user_id, items):
+    """[(notes, type)] -> [{"category": name, "category_id": id, "confidence": c} or None]."""
+    model = model_for(cur, user_id)
+    if model is None:
+        return None
+    names = category_names(cur, user_id)
+    return [{"category": names[cid][0], "category_id": cid, "confidence": conf} if conf > 0 else None
+            for cid, conf in model.predict(items)]
+
+
+def categorize_uncategorized(cur, user_id, min_confidence=CATEGORIZE_MIN_CONFIDENCE, dry_run=False):
+    """Assigns the predicted category to the user's uncategorized transactions scoring at least min_confidence.
+    Runs in the caller's transaction. Returns {"candidates", "updated", "changes": [{id, category, confidence}]}."""
+    cur.execute(f"""
+        SELECT id, date, notes, type, amount FROM transactions
+        WHERE user_id={PLACEHOLDER} AND category_id IS NULL
+    """, (user_id,))
+    pending = cur.fetchall()
+    model = model_for(cur, user_id) if pending else None
+    if model is None:
+        return {"candidates": len(pending), "updated": 0, "changes": []}
+
+    names = category_names(cur, user_id)
+    changes, months = [], set()
+    for (tx_id, tx_date, _, tx_type, amount), (cid, conf) in zip(pending, model.predict([(p[2], p[3]) for p in pending])):
+        if conf < min_confidence:
+            continue
+        changes.append({"id": tx_id, "category": names[cid][0], "confidence": conf})
+        if dry_run:
+            continue
+        # category_id IS NULL guards against a concurrent edit that categorized the row in the meantime
+        cur.execute(f"""
+            UPDATE transactions SET category={PLACEHOLDER}, category_id={PLACEHOLDER}
+            WHERE id={PLACEHOLDER} AND user_id={PLACEHOLDER} AND category_id IS NULL
+        """, (names[cid][0], cid, tx_id, user_id))
+        if cur.rowcount != 1:
+            changes.pop()
+            continue
+        record_write(cur, user_id, old=(None, amount, tx_type), new=(cid, amount, tx_type))
+        record_change(cur, user_id, tx_id, "update")
+        months.add((tx_date or "")[:7])
+
+    if changes and not dry_run:
+        # One version bump for the whole batch instead of one per row (see transactions.after_transaction_write)
+        bump_versions(cur, user_id, *sorted(months))
+        ledger_cache.invalidate(user_id)
+    return {"candidates": len(pending), "updated": 0 if dry_run else len(changes), "changes": changes}
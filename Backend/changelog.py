@@ -0,0 +1,104 @@
+"""
+changelog.py - Transaction Change Log for Delta Sync
+
+Process: Records every insert, update and delete of a transaction against a per-user sequence number,
+so clients can fetch only what changed since their last sync.
+
+Main Functionality:
+  - record_change(): Stamps a transaction with the next sequence number (deletes leave a tombstone)
+  - changes_since(): Returns the compacted set of changes after a client's cursor
+  - snapshot(): Full initial sync for clients without a cursor, paged by transaction id
+
+The log is compacted on write: each transaction keeps a single row holding its latest sequence number,
+so reading changes costs O(changes since cursor) rather than O(history).
+"""
+from db import PLACEHOLDER
+from versions import next_version, get_versions, CHANGES_SCOPE
+
+TX_COLUMNS = "t.id, t.date, t.category, t.amount, t.notes, t.type"
+
+
+def record_change(cur, user_id, tx_id, op):
+    """op is 'insert', 'update' or 'delete'. Runs inside the caller's transaction; returns the sequence number."""
+    seq = next_version(cur, user_id, CHANGES_SCOPE)
+    # Rows written before the change log existed get first_seq 0, i.e. "already known to every client"
+    first_seq = seq if op == "insert" else 0
+    cur.execute(f"""
+        INSERT INTO transaction_changes (tx_id, user_id, seq, first_seq, deleted)
+        VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})
+        ON CONFLICT (tx_id) DO UPDATE SET seq = excluded.seq, deleted = excluded.deleted
+    """, (tx_id, user_id, seq, first_seq, 1 if op == "delete" else 0))
+    return seq
+
+
+def current_seq(cur, user_id):
+    return get_versions(cur, user_id, CHANGES_SCOPE)[CHANGES_SCOPE]
+
+
+def _row_dict(r):
+    return {"id": r[0], "date": r[1], "category": r[2], "amount": r[3], "notes": r[4], "type": r[5]}
+
+
+def snapshot(cur, user_id, seq=None, after=0, limit=500):
+    """Initial sync, one page at a time: live transactions by id after `after`, as of change-log position `seq`.
+    The first page (seq None) reads the cursor and sets reset; later pages pass back the returned seq and after."""
+    first_page = seq is None
+    if first_page:
+        # Read the cursor first: anything written after this point reaches the client through changes_since(seq)
+        seq = current_seq(cur, user_id)
+    # Rows created after the cursor are left to the delta sync too; sending them here could leave a ghost row on
+    # the client, because a row both created and deleted after its cursor gets no tombstone
+    cur.execute(f"""
+        SELECT {TX_COLUMNS} FROM transactions t
+        LEFT JOIN transaction_changes c ON c.tx_id = t.id
+        WHERE t.user_id={PLACEHOLDER} AND t.id > {PLACEHOLDER} AND COALESCE(c.first_seq, 0) <= {PLACEHOLDER}
+        ORDER BY t.id
+        LIMIT {PLACEHOLDER}
+    """, (user_id, after, seq, limit + 1))
+    rows = cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "seq": seq,
+        "reset": first_page,
+        "upserts": [_row_dict(r) for r in rows],
+        "deletes": [],
+        "has_more": has_more,
+        # Snapshot continuation: pass back as ?since=<seq>&after=<after>; null once the snapshot is complete
+        "after": rows[-1][0] if has_more else None
+    }
+
+
+def changes_since(cur, user_id, since, limit=500):
+    """Compacted changes after `since`: latest state for live rows, tombstone ids for deleted ones."""
+    head = current_seq(cur, user_id)
+    cur.execute(f"""
+        SELECT c.seq, c.first_seq, c.deleted, c.tx_id, t.date, t.category, t.amount, t.notes, t.type
+        FROM transaction_changes c
+        LEFT JOIN transactions t ON t.id = c.tx_id
+        WHERE c.user_id={PLACEHOLDER} AND c.seq > {PLACEHOLDER}
+        ORDER BY c.seq
+        LIMIT {PLACEHOLDER}
+    """, (user_id, since, limit + 1))
+    rows = cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    upserts, deletes = [], []
+    for seq, first_seq, deleted, *tx in rows:
+        if deleted:
+            # Created and removed since the cursor: the client never saw it, so skip the tombstone
+            if first_seq <= since:
+                deletes.append(tx[0])
+        elif tx[1] is not None:
+            upserts.append(_row_dict(tx))
+
+    return {
+        "seq": rows[-1][0] if has_more else max(head, since),
+        "reset": False,
+        "upserts": upserts,
+        "deletes": deletes,
+        "has_more": has_more
+    }
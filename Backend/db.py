@@ -5,25 +5,69 @@ Process: Manages Database connection and schema setup for both SQLite (Local) an
 
 Main Functionality:
   - get_connection(): Returns a database connection instance based on DATABASE_URL
+  - connection_stats(): Connections opened by this process and how many are still alive (for /metrics)
   - init_db(): Creates tables if they don't exist, with syntax adjustments for Postgres compatibility
+  - add_column(): Idempotent column migration for tables created by older versions
+  - init_search_index(): Full-text index over transaction notes and categories
+
+On PostgreSQL, transactions is range-partitioned by month (see archive.py).
 """
 import sqlite3
 import os
+import threading
+import weakref
 import psycopg2
+import psycopg2.extensions
 from urllib.parse import urlparse
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "finance.db")
+DB_PATH = os.getenv("SQLITE_PATH", os.path.join(BASE_DIR, "finance.db"))
 DATABASE_URL = os.getenv("DATABASE_URL")
 PLACEHOLDER = "%s" if DATABASE_URL else "?"
 
+
+# The driver connection classes don't support weak references; these subclasses only add that,
+# so live connections can be counted without keeping them alive
+class _SqliteConnection(sqlite3.Connection):
+    pass
+
+
+class _PostgresConnection(psycopg2.extensions.connection):
+    pass
+
+
+_live_connections = weakref.WeakSet()
+_connection_lock = threading.Lock()
+_connection_counts = {"opened": 0, "peak_live": 0}
+
+
+def _track(conn):
+    with _connection_lock:
+        _live_connections.add(conn)
+        _connection_counts["opened"] += 1
+        _connection_counts["peak_live"] = max(_connection_counts["peak_live"], len(_live_connections))
+    return conn
+
+
 def get_connection():
     if DATABASE_URL:
         # Fix: Render uses 'postgres://' but psycopg2 needs 'postgresql://'
         url = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-        return psycopg2.connect(url, sslmode="require")
+        return _track(psycopg2.connect(url, sslmode="require", connection_factory=_PostgresConnection))
     else:
-        return sqlite3.connect(DB_PATH, check_same_thread=False)
+        return _track(sqlite3.connect(DB_PATH, check_same_thread=False, factory=_SqliteConnection))
+
+
+def connection_stats(cur=None):
+    """Connections opened by this process, how many are still referenced, and the peak of the latter.
+    With a cursor on PostgreSQL, also the server-side session count for the database (all processes)."""
+    with _connection_lock:
+        stats = {**_connection_counts, "live": len(_live_connections)}
+    if cur is not None and DATABASE_URL:
+        cur.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE datname = current_database()")
+        stats["server_sessions"] = cur.fetchone()[0]
+    return stats
+
 
 def init_db():
     conn = get_connection()
@@ -31,6 +75,8 @@ def init_db():
 
     # Use SERIAL for Postgres, AUTOINCREMENT for SQLite
     id_type = "SERIAL PRIMARY KEY" if DATABASE_URL else "INTEGER PRIMARY KEY AUTOINCREMENT"
+    # REAL is float4 on Postgres; aggregates that must keep the paise use float_type
+    float_type = "DOUBLE PRECISION" if DATABASE_URL else "REAL"
 
     cur.execute(f"""
         CREATE TABLE IF NOT EXISTS transactions (
@@ -44,6 +90,11 @@ def init_db():
         )
     """)
 
+    # Every read is scoped to one user and usually a date range
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (user_id, date)")
+    # Snapshot sync pages through a user's rows by id
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions (user_id, id)")
+
     cur.execute("""
         CREATE TABLE IF NOT EXISTS budget (
             user_id INTEGER,
@@ -84,5 +135,183 @@ def init_db():
         )
     """)
 
+    # Per-user (and per-month) write counters backing ETags on read routes
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_id INTEGER,
+            scope TEXT,
+            version INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, scope)
+        )
+    """)
+
+    # Compacted change log for delta sync: one row per transaction, stamped with its latest sequence number
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS transaction_changes (
+            tx_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            seq INTEGER,
+            first_seq INTEGER,
+            deleted INTEGER DEFAULT 0
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transaction_changes_user_seq ON transaction_changes (user_id, seq)")
+
+    # Interned per-user categories; transactions and templates reference them by id
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS categories (
+            id {id_type},
+            user_id INTEGER,
+            name TEXT,
+            is_fixed INTEGER DEFAULT 0,
+            UNIQUE (user_id, name)
+        )
+    """)
+    add_column(cur, "transactions", "category_id", "INTEGER")
+    add_column(cur, "recurring_transactions", "category_id", "INTEGER")
+
+    from categories import backfill_category_ids
+    backfill_category_ids(cur)
+
+    init_search_index(cur)
+
+    # Aggregates and per-user file index for months moved to the Parquet archive (see archive.py)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS transaction_rollups (
+            user_id INTEGER,
+            month TEXT,
+            category_id INTEGER,
+            type TEXT,
+            total {float_type},
+            tx_count INTEGER,
+            PRIMARY KEY (user_id, month, category_id, type)
+        )
+    """)
+    if DATABASE_URL:
+        # Tables created by older versions hold float4 totals
+        cur.execute("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'transaction_rollups' AND column_name = 'total'
+        """)
+        row = cur.fetchone()
+        if row and row[0] == "real":
+            cur.execute("ALTER TABLE transaction_rollups ALTER COLUMN total TYPE DOUBLE PRECISION")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS archived_months (
+            user_id INTEGER,
+            month TEXT,
+            path TEXT,
+            tx_count INTEGER,
+            active_days INTEGER,
+            PRIMARY KEY (user_id, month)
+        )
+    """)
+
+    # Background job queue (see jobs.py); timestamps are UTC 'YYYY-MM-DD HH:MM:SS' text
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id {id_type},
+            kind TEXT NOT NULL,
+            user_id INTEGER,
+            payload TEXT,
+            status TEXT DEFAULT 'queued',
+            priority INTEGER DEFAULT 0,
+            attempts INTEGER DEFAULT 0,
+            max_attempts INTEGER DEFAULT 3,
+            run_at TEXT,
+            locked_by TEXT,
+            locked_at TEXT,
+            result TEXT,
+            error TEXT,
+            dedupe_key TEXT UNIQUE,
+            created_at TEXT,
+            finished_at TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority, run_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, id)")
+
+    # Running per-category expense statistics for write-time anomaly flags (see anomaly_stats.py)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS category_stats (
+            user_id INTEGER,
+            category_id INTEGER,
+            count INTEGER,
+            mean {float_type},
+            m2 {float_type},
+            PRIMARY KEY (user_id, category_id)
+        )
+    """)
+
+    from archive import ensure_partitioned
+    ensure_partitioned(cur)
+
+    # One-time backfill for databases that predate category_stats. Runs after ensure_partitioned,
+    # whose advisory lock keeps concurrently starting Postgres workers from backfilling twice.
+    cur.execute("SELECT 1 FROM category_stats LIMIT 1")
+    if not cur.fetchone():
+        from anomaly_stats import rebuild_all_stats
+        rebuild_all_stats(cur)
+
     conn.commit()
     conn.close()
+
+
+def add_column(cur, table, column, col_type):
+    """Adds a column to an existing table if it is missing (tables created by older versions)."""
+    if DATABASE_URL:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {col_type}")
+        return
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in [r[1] for r in cur.fetchall()]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+
+
+def init_search_index(cur):
+    """Full-text index over transactions.notes and .category (FTS5 on SQLite, tsvector + GIN on Postgres)."""
+    if DATABASE_URL:
+        # A generated column keeps the vector in sync on every insert/update without triggers
+        cur.execute("""
+            ALTER TABLE transactions ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (to_tsvector('simple', coalesce(notes, '') || ' ' || coalesce(category, ''))) STORED
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_search ON transactions USING GIN (search_vector)")
+        return
+
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='transactions_fts'")
+    exists = cur.fetchone() is not None
+    if exists:
+        cur.execute("SELECT * FROM transactions_fts LIMIT 0")
+        if "user_id" not in [d[0] for d in cur.description]:
+            # Indexes from before user_id was indexed: drop them with their triggers and rebuild below
+            for trigger in ("transactions_fts_ai", "transactions_fts_ad", "transactions_fts_au"):
+                cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            cur.execute("DROP TABLE transactions_fts")
+            exists = False
+
+    # External-content table: the text lives in transactions, triggers keep the index in sync.
+    # user_id is indexed so a search only walks the caller's rows (search.py puts it in the MATCH), and the
+    # prefix indexes keep short prefixes like "a*" from expanding over every term in the table
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts
+        USING fts5(notes, category, user_id, content='transactions', content_rowid='id', prefix='1 2 3')
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_ai AFTER INSERT ON transactions BEGIN
+            INSERT INTO transactions_fts(rowid, notes, category, user_id) VALUES (new.id, new.notes, new.category, new.user_id);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_ad AFTER DELETE ON transactions BEGIN
+            INSERT INTO transactions_fts(transactions_fts, rowid, notes, category, user_id) VALUES ('delete', old.id, old.notes, old.category, old.user_id);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_au AFTER UPDATE OF notes, category, user_id ON transactions BEGIN
+            INSERT INTO transactions_fts(transactions_fts, rowid, notes, category, user_id) VALUES ('delete', old.id, old.notes, old.category, old.user_id);
+            INSERT INTO transactions_fts(rowid, notes, category, user_id) VALUES (new.id, new.notes, new.category, new.user_id);
+        END
+    """)
+    if not exists:
+        # Index rows written before the search table existed
+        cur.execute("INSERT INTO transactions_fts(transactions_fts) VALUES ('rebuild')")
@@ -0,0 +1,240 @@
+"""
+jobs.py - Durable Background Job Queue
+
+Process: Stores jobs in the `jobs` table of the application database, so no external broker is needed.
+Request handlers enqueue; worker.py claims jobs and runs the handlers registered in tasks.py.
+
+Main Functionality:
+  - job_handler(): Registers a handler for a job kind, with a per-kind concurrency limit
+  - enqueue(): Adds a job (optionally de-duplicated by key, e.g. one nightly run per day)
+  - claim(): Atomically hands the next due job to one worker (FOR UPDATE SKIP LOCKED on PostgreSQL,
+    a compare-and-set UPDATE on SQLite)
+  - complete() / fail(): Record the outcome; failures are retried with exponential backoff
+  - heartbeat(): Renews the lease of a worker's running jobs; worker.py calls it on a timer
+  - requeue_stale(): Returns jobs of crashed workers to the queue once their heartbeat stops
+  - delete_finished(): Removes done and failed jobs past the retention period
+  - get_job(), list_jobs(), queue_stats(): Status reads for the API and /metrics
+
+Job states: queued -> running -> done | failed (failed only after max_attempts).
+"""
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from db import DATABASE_URL, PLACEHOLDER
+
+# A running job's locked_at is renewed every JOB_HEARTBEAT_SECONDS; the lease only expires once that stops,
+# so it bounds how long a crashed worker's jobs wait, not how long a job may run
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", 30))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 5 * 60))
+JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", 30))
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+# kind -> (handler(conn, job) -> JSON-serializable result, max concurrently running jobs of that kind)
+HANDLERS = {}
+
+JOB_COLUMNS = ("id, kind, user_id, payload, status, priority, attempts, max_attempts, run_at, "
+               "result, error, created_at, finished_at")
+
+
+def job_handler(kind, concurrency=1):
+    def register(fn):
+        HANDLERS[kind] = (fn, concurrency)
+        return fn
+    return register
+
+
+def _now(offset_seconds=0):
+    """UTC timestamp as sortable 'YYYY-MM-DD HH:MM:SS' text (the same on both backends)."""
+    return (datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _job_dict(r):
+    return {
+        "id": r[0], "kind": r[1], "user_id": r[2],
+        "payload": json.loads(r[3]) if r[3] else {},
+        "status": r[4], "priority": r[5], "attempts": r[6], "max_attempts": r[7], "run_at": r[8],
+        "result": json.loads(r[9]) if r[9] else None,
+        "error": r[10], "created_at": r[11], "finished_at": r[12]
+    }
+
+
+def enqueue(cur, kind, user_id=None, payload=None, priority=0, max_attempts=3, delay_seconds=0, dedupe_key=None):
+    """Queues a job inside the caller's transaction. Higher priority runs first.
+    Returns the job id, or None when a job with the same dedupe_key already exists."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    sql = f"""
+        INSERT INTO jobs (kind, user_id, payload, status, priority, attempts, max_attempts, run_at, dedupe_key, created_at)
+        VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, 'queued', {PLACEHOLDER}, 0, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})
+        ON CONFLICT (dedupe_key) DO NOTHING
+    """
+    params = (kind, user_id, json.dumps(payload or {}), priority, max_attempts, _now(delay_seconds), dedupe_key, _now())
+    if DATABASE_URL:
+        cur.execute(sql + " RETURNING id", params)
+        row = cur.fetchone()
+        return row[0] if row else None
+    cur.execute(sql, params)
+    return cur.lastrowid if cur.rowcount else None
+
+
+def claim(conn, worker_id, kinds):
+    """Marks the next due job of one of `kinds` as running for this worker and returns it, or None."""
+    if not kinds:
+        return None
+    kinds = sorted(kinds)
+    kind_list = ", ".join([PLACEHOLDER] * len(kinds))
+    pick = f"""
+        SELECT id FROM jobs
+        WHERE status='queued' AND run_at <= {PLACEHOLDER} AND kind IN ({kind_list})
+        ORDER BY priority DESC, run_at, id
+        LIMIT 1
+    """
+    now = _now()
+    cur = conn.cursor()
+
+    if DATABASE_URL:
+        # SKIP LOCKED lets concurrent workers pass over rows another worker is claiming instead of queueing behind it
+        cur.execute(f"""
+            UPDATE jobs SET status='running', attempts=attempts + 1, locked_by=%s, locked_at=%s
+            WHERE id = ({pick} FOR UPDATE SKIP LOCKED)
+            RETURNING {JOB_COLUMNS}
+        """, (worker_id, now, now, *kinds))
+        row = cur.fetchone()
+        conn.commit()
+        return _job_dict(row) if row else None
+
+    # SQLite serializes writers, so an UPDATE guarded by status='queued' is an atomic compare-and-set;
+    # losing the race to another worker just means trying the next candidate
+    for _ in range(5):
+        cur.execute(pick, (now, *kinds))
+        row = cur.fetchone()
+        if not row:
+            return None
+        cur.execute("""
+            UPDATE jobs SET status='running', attempts=attempts + 1, locked_by=?, locked_at=?
+            WHERE id=? AND status='queued'
+        """, (worker_id, now, row[0]))
+        won = cur.rowcount == 1
+        conn.commit()
+        if won:
+            cur.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id=?", (row[0],))
+            return _job_dict(cur.fetchone())
+    return None
+
+
+def complete(conn, job, worker_id, result):
+    cur = conn.cursor()
+    # The locked_by guard keeps a worker whose lease expired from overwriting the job's newer run
+    cur.execute(f"""
+        UPDATE jobs SET status='done', result={PLACEHOLDER}, error=NULL, finished_at={PLACEHOLDER}, locked_by=NULL
+        WHERE id={PLACEHOLDER} AND locked_by={PLACEHOLDER}
+    """, (json.dumps(result), _now(), job["id"], worker_id))
+    lost = cur.rowcount != 1
+    conn.commit()
+    if lost:
+        _report_lost(job, worker_id, "result")
+
+
+def fail(conn, job, worker_id, error):
+    """Requeues with exponential backoff, or marks the job failed once it has used all its attempts."""
+    cur = conn.cursor()
+    if job["attempts"] < job["max_attempts"]:
+        delay = JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+        cur.execute(f"""
+            UPDATE jobs SET status='queued', error={PLACEHOLDER}, run_at={PLACEHOLDER}, locked_by=NULL
+            WHERE id={PLACEHOLDER} AND locked_by={PLACEHOLDER}
+        """, (error, _now(delay), job["id"], worker_id))
+    else:
+        cur.execute(f"""
+            UPDATE jobs SET status='failed', error={PLACEHOLDER}, finished_at={PLACEHOLDER}, locked_by=NULL
+            WHERE id={PLACEHOLDER} AND locked_by={PLACEHOLDER}
+        """, (error, _now(), job["id"], worker_id))
+    lost = cur.rowcount != 1
+    conn.commit()
+    if lost:
+        _report_lost(job, worker_id, "failure")
+
+
+def _report_lost(job, worker_id, outcome):
+    print(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} was lost by {worker_id}: its lease expired "
+          f"and the job was requeued or failed meanwhile, so this {outcome} was discarded")
+
+
+def heartbeat(conn, worker_id):
+    """Renews the lease of every job this worker is running. Returns the number of leases renewed."""
+    cur = conn.cursor()
+    cur.execute(f"UPDATE jobs SET locked_at={PLACEHOLDER} WHERE status='running' AND locked_by={PLACEHOLDER}",
+                (_now(), worker_id))
+    renewed = cur.rowcount
+    conn.commit()
+    return renewed
+
+
+def requeue_stale(conn):
+    """Running jobs whose lease has not been renewed for JOB_LEASE_SECONDS belong to a worker that died
+    (its heartbeat stopped); retry or fail them."""
+    cur = conn.cursor()
+    expired = _now(-JOB_LEASE_SECONDS)
+    cur.execute(f"""
+        UPDATE jobs SET status='failed', error='lease expired', finished_at={PLACEHOLDER}, locked_by=NULL
+        WHERE status='running' AND locked_at < {PLACEHOLDER} AND attempts >= max_attempts
+    """, (_now(), expired))
+    cur.execute(f"""
+        UPDATE jobs SET status='queued', error='lease expired', locked_by=NULL
+        WHERE status='running' AND locked_at < {PLACEHOLDER}
+    """, (expired,))
+    conn.commit()
+
+
+def running_counts(cur):
+    cur.execute("SELECT kind, COUNT(*) FROM jobs WHERE status='running' GROUP BY kind")
+    return dict(cur.fetchall())
+
+
+def get_job(cur, job_id, user_id=None):
+    """The job as a dict, or None. With user_id, only that user's jobs are visible."""
+    sql = f"SELECT {JOB_COLUMNS} FROM jobs WHERE id={PLACEHOLDER}"
+    params = (job_id,)
+    if user_id is not None:
+        sql += f" AND user_id={PLACEHOLDER}"
+        params += (user_id,)
+    cur.execute(sql, params)
+    row = cur.fetchone()
+    return _job_dict(row) if row else None
+
+
+def list_jobs(cur, user_id=None, limit=50):
+    """Most recent jobs first. With user_id, only that user's jobs."""
+    if user_id is None:
+        cur.execute(f"SELECT {JOB_COLUMNS} FROM jobs ORDER BY id DESC LIMIT {PLACEHOLDER}", (limit,))
+    else:
+        cur.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE user_id={PLACEHOLDER} ORDER BY id DESC LIMIT {PLACEHOLDER}",
+                    (user_id, limit))
+    return [_job_dict(r) for r in cur.fetchall()]
+
+
+def delete_finished(cur, older_than_days):
+    """Deletes done and failed jobs that finished more than older_than_days ago, inside the caller's transaction.
+    Returns the deleted jobs, so their output files can be removed too."""
+    cutoff = _now(-older_than_days * 86400)
+    cur.execute(f"""
+        SELECT {JOB_COLUMNS} FROM jobs WHERE status IN ('done', 'failed') AND finished_at < {PLACEHOLDER}
+    """, (cutoff,))
+    deleted = [_job_dict(r) for r in cur.fetchall()]
+    cur.execute(f"DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < {PLACEHOLDER}", (cutoff,))
+    return deleted
+
+
+def queue_stats(cur):
+    """Job counts by status, plus the age in seconds of the oldest due queued job."""
+    cur.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+    counts = dict(cur.fetchall())
+    cur.execute(f"SELECT MIN(run_at) FROM jobs WHERE status='queued' AND run_at <= {PLACEHOLDER}", (_now(),))
+    oldest = cur.fetchone()[0]
+    lag = 0
+    if oldest:
+        due = datetime.strptime(oldest, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+        lag = max(int((datetime.now(timezone.utc) - due).total_seconds()), 0)
+    return {**{s: counts.get(s, 0) for s in JOB_STATUSES}, "queue_lag_seconds": lag}
@@ -0,0 +1,290 @@
+"""
+ledger.py - In-Process Per-User Ledger Cache
+
+Process: Loads a user's transactions once into a compact columnar Ledger (NumPy arrays of days, amounts,
+interned category codes and type codes) and keeps it in a byte-size bounded LRU cache shared by the analytics routes.
+
+Main Functionality:
+  - Ledger: Columnar view of one user's transactions with the aggregates the analytics layer needs
+  - LedgerCache: Thread-safe LRU keyed by user id, bounded by LEDGER_CACHE_BYTES, with hit/miss stats
+  - ledger_for(): Cached ledger when the cache is enabled, otherwise a freshly loaded one
+
+Archived months (see archive.py) are carried as their rollups and merged into the aggregates, so
+the ledger's arrays only ever hold the hot table.
+
+Freshness: every entry remembers the user's data version (see versions.py) it was built from. Write routes
+invalidate their own process directly, and other worker processes notice the bumped version on next read.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from db import PLACEHOLDER
+from versions import get_versions, USER_SCOPE
+from categories import category_names
+from archive import load_rollups, archived_active_days
+
+LEDGER_CACHE_BYTES = int(os.getenv("LEDGER_CACHE_BYTES", 32 * 1024 * 1024))
+
+# Day number used for rows whose date cannot be parsed; they are left out of date-based aggregates
+INVALID_DAY = np.iinfo(np.int32).min
+
+
+def _parse_days(dates):
+    """'YYYY-MM-DD' strings -> int32 days since 1970-01-01."""
+    try:
+        return np.array([d[:10] for d in dates], dtype="datetime64[D]").astype(np.int32)
+    except (TypeError, ValueError):
+        days = np.empty(len(dates), dtype=np.int32)
+        for i, d in enumerate(dates):
+            try:
+                days[i] = np.datetime64(d[:10], "D").astype(np.int32)
+            except (TypeError, ValueError):
+                days[i] = INVALID_DAY
+        return days
+
+
+def _factorize(values):
+    """Returns (int codes, list of distinct values in first-seen order)."""
+    index = {}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int32, count=len(values))
+    return codes, list(index)
+
+
+def _month_strings(month_codes):
+    return np.datetime_as_string(np.asarray(month_codes, dtype="datetime64[M]"), unit="M").tolist()
+
+
+def _day_strings(day_codes):
+    return np.datetime_as_string(np.asarray(day_codes, dtype="datetime64[D]"), unit="D").tolist()
+
+
+def _merge_totals(rows, extra):
+    """Adds (*key, total) rows from extra into rows, summing totals of equal keys."""
+    if not extra:
+        return rows
+    merged = {}
+    for *key, total in rows:
+        merged[tuple(key)] = total
+    for *key, total in extra:
+        merged[tuple(key)] = merged.get(tuple(key), 0) + total
+    return [(*key, total) for key, total in merged.items()]
+
+
+class Ledger:
+    """Columnar snapshot of one user's transactions."""
+
+    def __init__(self, ids, days, amounts, cat_codes, categories, type_codes, types, fixed=frozenset(),
+                 rollups=(), archived_days=0):
+        self.ids = ids
+        self.days = days
+        self.amounts = amounts
+        self.cat_codes = cat_codes
+        self.categories = categories
+        self.type_codes = type_codes.astype(np.int8)
+        self.types = types
+        self.fixed = fixed
+        # (month, category, type, total) aggregates of archived months
+        self.rollups = list(rollups)
+        self.archived_days = archived_days
+
+        self.valid = days != INVALID_DAY
+        self.months = np.where(
+            self.valid,
+            days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int32),
+            0
+        ).astype(np.int32)
+        self.is_expense = self._type_mask("expense")
+        self.nbytes = self._size()
+
+    @classmethod
+    def from_rows(cls, rows, category_names=None, rollups=(), archived_days=0):
+        """rows are (id, date, category_id, amount, type) tuples; category_names is {id: (name, is_fixed)};
+        rollups are (month, category_id, type, total) rows of archived months."""
+        category_names = category_names or {}
+        fixed = frozenset(name for name, is_fixed in category_names.values() if is_fixed)
+        rollups = [(m, category_names.get(cid, ("", False))[0], t, total) for m, cid, t, total in rollups]
+        if not rows:
+            empty = np.empty(0, dtype=np.int32)
+            return cls(np.empty(0, dtype=np.int64), empty, np.empty(0), empty, [], empty, [], fixed,
+                       rollups, archived_days)
+        ids, dates, cat_ids, amounts, types = zip(*rows)
+        # Codes index the user's distinct category ids; uncategorized (NULL id) rows report ''
+        cat_codes, distinct_ids = _factorize(cat_ids)
+        categories = [category_names.get(cid, ("", False))[0] for cid in distinct_ids]
+        type_codes, type_names = _factorize(types)
+        return cls(
+            np.array(ids, dtype=np.int64),
+            _parse_days(dates),
+            np.array(amounts, dtype=np.float64),
+            cat_codes, categories,
+            type_codes, type_names,
+            fixed, rollups, archived_days
+        )
+
+    def __len__(self):
+        """Number of hot rows; check `rollups` for archived history."""
+        return len(self.ids)
+
+    def _size(self):
+        arrays = (self.ids, self.days, self.amounts, self.cat_codes, self.type_codes,
+                  self.valid, self.months, self.is_expense)
+        labels = sum(sys.getsizeof(c) for c in (*self.categories, *self.types, *self.fixed))
+        # Rollup tuples hold interned month/category/type strings; count the tuple and its float
+        rollups = len(self.rollups) * (sys.getsizeof((0,) * 4) + 24)
+        return sum(a.nbytes for a in arrays) + labels + rollups + 512
+
+    def _type_mask(self, name):
+        if name not in self.types:
+            return np.zeros(len(self.ids), dtype=bool)
+        return self.type_codes == self.types.index(name)
+
+    def _group_sum(self, mask, *keys):
+        """Sums amounts over rows in mask grouped by the given code arrays. Returns (unique key rows, totals)."""
+        if not mask.any():
+            return np.empty((0, len(keys)), dtype=np.int64), np.empty(0)
+        columns = [k[mask].astype(np.int64) for k in keys]
+        lows = [c.min() for c in columns]
+        sizes = [int(c.max() - low) + 1 for c, low in zip(columns, lows)]
+        # One mixed-radix int64 key per row: a 1-D unique is several times faster than np.unique(axis=0)
+        flat = np.ravel_multi_index([c - low for c, low in zip(columns, lows)], sizes)
+        uniq, inverse = np.unique(flat, return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=self.amounts[mask], minlength=len(uniq))
+        return np.stack(np.unravel_index(uniq, sizes), axis=1) + np.array(lows), totals
+
+    # ---- Aggregates mirroring analytics.py ---- #
+    def monthly_totals(self):
+        keys, totals = self._group_sum(self.valid, self.months, self.type_codes)
+        months = _month_strings(keys[:, 0])
+        rows = [(m, self.types[t], float(v)) for m, t, v in zip(months, keys[:, 1].tolist(), totals.tolist())]
+        return _merge_totals(rows, [(m, t, v) for m, _, t, v in self.rollups])
+
+    def category_month_totals(self):
+        keys, totals = self._group_sum(self.valid & self.is_expense, self.cat_codes, self.months)
+        months = _month_strings(keys[:, 1])
+        rows = [(self.categories[c], m, float(v)) for c, m, v in zip(keys[:, 0].tolist(), months, totals.tolist())]
+        return _merge_totals(rows, [(c, m, v) for m, c, t, v in self.rollups if t == "expense"])
+
+    def category_type_totals(self):
+        keys, totals = self._group_sum(np.ones(len(self.ids), dtype=bool), self.cat_codes, self.type_codes)
+        rows = [(self.categories[c], self.types[t], float(v))
+                for c, t, v in zip(keys[:, 0].tolist(), keys[:, 1].tolist(), totals.tolist())]
+        return _merge_totals(rows, [(c, t, v) for _, c, t, v in self.rollups])
+
+    def active_days(self):
+        return int(len(np.unique(self.days[self.valid]))) + self.archived_days
+
+    # ---- Row views for the per-transaction analytics ---- #
+    def expense_rows(self):
+        """(id, amount, category) for every expense, as detect_anomalies expects."""
+        idx = np.flatnonzero(self.is_expense)
+        return [(i, a, self.categories[c]) for i, a, c in
+                zip(self.ids[idx].tolist(), self.amounts[idx].tolist(), self.cat_codes[idx].tolist())]
+
+    def _dated_expense_rows(self, mask):
+        idx = np.flatnonzero(mask & self.is_expense & self.valid)
+        return [(d, a, self.categories[c]) for d, a, c in
+                zip(_day_strings(self.days[idx]), self.amounts[idx].tolist(), self.cat_codes[idx].tolist())]
+
+    def month_expense_rows(self, month):
+        """(date, amount, category) for expenses in month 'YYYY-MM'."""
+        code = np.datetime64(month, "M").astype(np.int32)
+        return self._dated_expense_rows(self.months == code)
+
+    def expense_rows_since(self, cutoff):
+        """(date, amount, category) for expenses on or after cutoff 'YYYY-MM-DD'."""
+        day = np.datetime64(cutoff, "D").astype(np.int32)
+        return self._dated_expense_rows(self.days >= day)
+
+    def month_expense_total(self, month):
+        code = np.datetime64(month, "M").astype(np.int32)
+        return float(self.amounts[(self.months == code) & self.is_expense & self.valid].sum())
+
+
+def load_ledger(cur, user_id):
+    cur.execute(f"SELECT id, date, category_id, amount, type FROM transactions WHERE user_id={PLACEHOLDER}", (user_id,))
+    rows = cur.fetchall()
+    return Ledger.from_rows(rows, category_names(cur, user_id), load_rollups(cur, user_id),
+                            archived_active_days(cur, user_id))
+
+
+class LedgerCache:
+    """Byte-bounded LRU of user_id -> (data version, Ledger)."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, cur, user_id):
+        # Read the version before the rows: a concurrent write then only causes an extra reload, never a stale hit
+        version = get_versions(cur, user_id, USER_SCOPE)[USER_SCOPE]
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        ledger = load_ledger(cur, user_id)
+        self._put(user_id, version, ledger)
+        return ledger
+
+    def _put(self, user_id, version, ledger):
+        if ledger.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(user_id, None)
+            if old:
+                self.bytes -= old[1].nbytes
+            self._entries[user_id] = (version, ledger)
+            self.bytes += ledger.nbytes
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry:
+                self.bytes -= entry[1].nbytes
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+ledger_cache = LedgerCache(LEDGER_CACHE_BYTES)
+
+
+def ledger_for(cur, user_id):
+    """The user's ledger, from the cache when enabled or loaded once for this request otherwise."""
+    if ledger_cache.enabled:
+        return ledger_cache.get(cur, user_id)
+    return load_ledger(cur, user_id)
@@ -0,0 +1,152 @@
+"""
+profiler.py - Opt-in Per-Request Sampling Profiler
+
+Process: A background thread samples the stack of the thread serving a selected request every few milliseconds
+and counts identical stacks. When the request ends, the counts are written to PROFILE_DIR in folded format
+("outer;inner;leaf count" lines, as read by flamegraph.pl, speedscope and inferno), one file per request tagged
+with the route and user.
+
+Requests are selected either by the env flag (PROFILE_REQUESTS=1, optionally narrowed with PROFILE_ROUTES and
+thinned with PROFILE_SAMPLE_RATE) or by an admin asking for it (X-Profile: 1 plus X-Admin-Token). Both are capped
+by PROFILE_MAX_PER_MINUTE and PROFILE_MAX_ACTIVE per process, so it can stay enabled in production.
+
+Main Functionality:
+  - start_request_profile(): Decides whether a request is profiled and starts the sampler
+  - finish_request_profile(): Stops the sampler and writes the folded stacks
+  - SamplingProfiler: The sampler itself, usable around any block of code
+"""
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from db import BASE_DIR
+
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS") == "1"
+# Comma-separated route rules (e.g. "/savings,/export-pdf"); empty means every route
+PROFILE_ROUTES = {r.strip() for r in os.getenv("PROFILE_ROUTES", "").split(",") if r.strip()}
+# Fraction of matching requests profiled under PROFILE_REQUESTS (admin requests skip this)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.05))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_MAX_PER_MINUTE = int(os.getenv("PROFILE_MAX_PER_MINUTE", 6))
+PROFILE_MAX_ACTIVE = int(os.getenv("PROFILE_MAX_ACTIVE", 1))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+# Oldest profiles beyond this many are deleted
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 500))
+
+MAX_STACK_DEPTH = 200
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    # ';' separates frames in folded format (the count is split off at the last space, so spaces are fine)
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _fold(frame):
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """Samples one thread's stack every interval_ms from a daemon thread. stop() returns Counter({stack: samples})."""
+
+    def __init__(self, thread_id=None, interval_ms=PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval_ms / 1000
+        self.counts = Counter()
+        self.started = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[_fold(frame)] += 1
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+
+class _RateLimiter:
+    """At most per_minute starts in any rolling minute and max_active at once, per process."""
+
+    def __init__(self, per_minute, max_active):
+        self.per_minute = per_minute
+        self.max_active = max_active
+        self.starts = []
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        now = time.monotonic()
+        with self.lock:
+            self.starts = [t for t in self.starts if now - t < 60]
+            if len(self.starts) >= self.per_minute or self.active >= self.max_active:
+                return False
+            self.starts.append(now)
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+
+_limiter = _RateLimiter(PROFILE_MAX_PER_MINUTE, PROFILE_MAX_ACTIVE)
+
+
+def start_request_profile(route, admin_requested=False):
+    """Returns a running SamplingProfiler when this request should be profiled, otherwise None."""
+    if not admin_requested:
+        if not PROFILE_REQUESTS or route is None:
+            return None
+        if PROFILE_ROUTES and route not in PROFILE_ROUTES:
+            return None
+        if random.random() >= PROFILE_SAMPLE_RATE:
+            return None
+    if not _limiter.acquire():
+        return None
+    return SamplingProfiler().start()
+
+
+def _route_tag(route):
+    return re.sub(r"[^A-Za-z0-9]+", "_", route or "").strip("_") or "root"
+
+
+def _prune():
+    names = sorted(n for n in os.listdir(PROFILE_DIR) if n.endswith(".folded"))
+    for name in names[:max(len(names) - PROFILE_KEEP, 0)]:
+        os.remove(os.path.join(PROFILE_DIR, name))
+
+
+def finish_request_profile(profiler, route, user_id=None):
+    """Stops the sampler and writes <time>-<route>-u<user>-<ms>ms.folded. Returns the file name."""
+    try:
+        counts = profiler.stop()
+        elapsed_ms = int((time.perf_counter() - profiler.started) * 1000)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        user = f"u{user_id}" if user_id is not None else "anon"
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{_route_tag(route)}-{user}-{elapsed_ms}ms.folded"
+        with open(os.path.join(PROFILE_DIR, name), "w") as f:
+            for stack, n in counts.most_common():
+                f.write(f"{stack} {n}\n")
+        _prune()
+        return name
+    finally:
+        _limiter.release()
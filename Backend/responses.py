@@ -0,0 +1,107 @@
+"""
+responses.py - Response Encoding
+
+Process: Makes large JSON responses cheaper to build and to send. jsonify() goes through orjson when it is
+installed, row lists can be returned column-wise when the client asks for it in the Accept header, and text
+responses are gzip-compressed when the client accepts it.
+
+Main Functionality:
+  - install_json_provider(): Switches Flask's JSON provider to orjson (no-op without orjson)
+  - wants_columnar(): Whether the request's Accept header prefers the columnar media type
+  - rows_to_columns(): Row tuples -> {column: [values]}
+  - compress_response(): gzip negotiation for the after_request hook, keeping ETags usable for 304s
+
+Columnar responses keep the same top-level keys; each list of row objects becomes an object of parallel arrays,
+e.g. {"transactions": {"id": [1, 2], "date": ["2024-05-01", "2024-05-02"], ...}}.
+"""
+import gzip
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COLUMNAR_MIMETYPE = "application/vnd.finance.columnar+json"
+
+# Smaller bodies gain little from compression and the gzip header eats into it
+GZIP_MIN_BYTES = 1024
+# Level 1 compresses a 10 MB response about 3x faster than level 6, for output roughly 25% larger
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 1))
+COMPRESSIBLE_MIMETYPES = {"application/json", COLUMNAR_MIMETYPE, "text/csv", "text/plain", "text/html"}
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson. Output matches the default provider except that non-ASCII
+    characters are written as UTF-8 instead of \\u escapes. dumps() keyword arguments orjson cannot express
+    (ensure_ascii, separators, cls, other indents) fall back to the default provider."""
+
+    # Dates keep Flask's HTTP-date format (via default()) instead of orjson's ISO format
+    OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+               | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+    # dumps() keyword arguments orjson can express; any other one goes through the standard library
+    ORJSON_KWARGS = {"default", "sort_keys", "indent"}
+
+    def _options(self, sort_keys=None, indent=False):
+        option = self.OPTIONS
+        if not (self.sort_keys if sort_keys is None else sort_keys):
+            option &= ~orjson.OPT_SORT_KEYS
+        return option | (orjson.OPT_INDENT_2 if indent else 0)
+
+    def dumps(self, obj, **kwargs):
+        # orjson only indents by two spaces
+        if not kwargs.keys() <= self.ORJSON_KWARGS or kwargs.get("indent") not in (None, 2):
+            return super().dumps(obj, **kwargs)
+        option = self._options(kwargs.get("sort_keys"), kwargs.get("indent"))
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        # Bytes straight into the response, skipping the str round trip
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self._options(indent=indent) | orjson.OPT_APPEND_NEWLINE),
+            mimetype=self.mimetype)
+
+
+def install_json_provider(app):
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+
+
+def wants_columnar(request):
+    return request.accept_mimetypes.best_match(["application/json", COLUMNAR_MIMETYPE]) == COLUMNAR_MIMETYPE
+
+
+def rows_to_columns(rows, names):
+    """[(a1, b1), (a2, b2)] -> {"a": [a1, a2], "b": [b1, b2]}"""
+    if not rows:
+        return {name: [] for name in names}
+    return {name: list(col) for name, col in zip(names, zip(*rows))}
+
+
+def compress_response(response, request):
+    """gzip-encodes a buffered text response when the client accepts gzip. Returns the response."""
+    response.vary.add("Accept-Encoding")
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or request.accept_encodings["gzip"] <= 0):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0))
+    response.headers["Content-Encoding"] = "gzip"
+    # The gzip bytes differ from the identity bytes, so a strong ETag would have to change; a weak one
+    # ("same content") may be shared, and If-None-Match still matches it (conditional GETs use weak comparison)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,68 @@
+"""
+search.py - Full-Text Transaction Search
+
+Process: Searches a user's transaction notes and categories through the full-text index created in
+db.init_search_index (FTS5 on SQLite, tsvector/GIN on Postgres).
+
+Main Functionality:
+  - search_transactions(): Prefix search with optional date range, ranked by relevance and paginated
+"""
+import re
+
+from db import PLACEHOLDER, DATABASE_URL
+
+COLUMNS = "t.id, t.date, t.category, t.amount, t.notes, t.type"
+
+
+def _terms(query):
+    """Splits user input into plain word tokens so no operator syntax reaches the engine."""
+    return re.findall(r"\w+", query.lower())
+
+
+def search_transactions(cur, user_id, query, date_from=None, date_to=None, page=1, per_page=20):
+    """Every term must match (as a prefix). Returns (rows, has_more); rows are dicts with a relevance score."""
+    terms = _terms(query)
+    if not terms:
+        return [], False
+
+    filters = ""
+    params = []
+    if date_from:
+        filters += f" AND t.date >= {PLACEHOLDER}"
+        params.append(date_from)
+    if date_to:
+        filters += f" AND t.date <= {PLACEHOLDER}"
+        params.append(date_to)
+    paging = (per_page + 1, (page - 1) * per_page)
+
+    if DATABASE_URL:
+        cur.execute(f"""
+            SELECT {COLUMNS}, ts_rank(t.search_vector, q) AS rank
+            FROM transactions t, to_tsquery('simple', {PLACEHOLDER}) q
+            WHERE t.user_id={PLACEHOLDER} AND t.search_vector @@ q{filters}
+            ORDER BY rank DESC, t.date DESC, t.id DESC
+            LIMIT {PLACEHOLDER} OFFSET {PLACEHOLDER}
+        """, (" & ".join(f"{term}:*" for term in terms), user_id, *params, *paging))
+        rows = cur.fetchall()
+    else:
+        # The user_id term scopes the match itself to the caller's rows, so other users' matches are never
+        # enumerated and joined; the text terms only match notes and category
+        match = f'user_id : "{int(user_id)}" AND {{notes category}} : (' + " ".join(f'"{term}"*' for term in terms) + ")"
+        # bm25() is lower-is-better; negate it so both backends report higher-is-better. user_id gets no weight
+        cur.execute(f"""
+            SELECT {COLUMNS}, -bm25(transactions_fts, 1.0, 1.0, 0.0) AS rank
+            FROM transactions_fts
+            JOIN transactions t ON t.id = transactions_fts.rowid
+            WHERE transactions_fts MATCH {PLACEHOLDER} AND t.user_id={PLACEHOLDER}{filters}
+            ORDER BY rank DESC, t.date DESC, t.id DESC
+            LIMIT {PLACEHOLDER} OFFSET {PLACEHOLDER}
+        """, (match, user_id, *params, *paging))
+        rows = cur.fetchall()
+
+    has_more = len(rows) > per_page
+    results = [
+        {"id": r[0], "date": r[1], "category": r[2], "amount": r[3], "notes": r[4], "type": r[5],
+         "rank": round(float(r[6]), 4)}
+        for r in rows[:per_page]
+    ]
+    return results, has_more
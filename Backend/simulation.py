@@ -0,0 +1,101 @@
+"""
+simulation.py - Monte Carlo Month-End Spend Simulation
+
+Process: Bootstraps the rest of the current month from the user's own recent days. Each remaining day draws the
+variable (non-fixed) spend of a random past day with the same weekday, for thousands of trajectories at once in
+one NumPy batch, and adds it to what has already been spent this month. The spread of the simulated month-end
+totals gives percentile bands and the probability of ending over budget, where /predict only gives one number.
+
+Fixed categories (rent, bills, EMIs) are not resampled: they are lumpy, and whatever has been booked this month
+is carried as is. Days without any expense count as zero-spend days, so quiet days are part of the distribution.
+
+Main Functionality:
+  - daily_variable_spend(): Calendar-day variable spend totals for the history window
+  - simulate_month_end(): Vectorized bootstrap returning percentiles and the over-budget probability
+"""
+import calendar
+import os
+from datetime import date, timedelta
+
+import numpy as np
+
+SIMULATION_TRIALS = int(os.getenv("SIMULATION_TRIALS", 20000))
+MAX_SIMULATION_TRIALS = 100000
+# Days of history the daily spend is resampled from
+SIMULATION_HISTORY_DAYS = 90
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def _parse_day(value):
+    try:
+        return date.fromisoformat(value[:10])
+    except (TypeError, ValueError):
+        # Dates are stored as free text; rows with unparseable dates are left out
+        return None
+
+
+def daily_variable_spend(rows, start, end, fixed_cats):
+    """Variable spend per calendar day in [start, end) from (date, amount, category) expense rows.
+    Returns (totals, weekdays) arrays with one entry per day, zero for days without expenses."""
+    days = (end - start).days
+    totals = np.zeros(max(days, 0))
+    if days <= 0:
+        return totals, np.zeros(0, dtype=np.int64)
+    picked = [(_parse_day(d), a) for d, a, c in rows if c not in fixed_cats and a is not None]
+    picked = [(d, a) for d, a in picked if d is not None]
+    if picked:
+        offsets = np.array([(d - start).days for d, _ in picked], dtype=np.int64)
+        amounts = np.array([a for _, a in picked], dtype=float)
+        inside = (offsets >= 0) & (offsets < days)
+        totals = np.bincount(offsets[inside], weights=amounts[inside], minlength=days)
+    # Monday = 0, as in date.weekday()
+    weekdays = (np.arange(days) + start.weekday()) % 7
+    return totals, weekdays
+
+
+def simulate_month_end(history_rows, month_rows, today, fixed_cats, budget=0, trials=SIMULATION_TRIALS, seed=None):
+    """history_rows: (date, amount, category) expenses since SIMULATION_HISTORY_DAYS before today.
+    month_rows: the same for this month so far. Returns a JSON-ready dict."""
+    month = today.strftime("%Y-%m")
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    remaining = days_in_month - today.day
+    spent = round(sum(r[1] for r in month_rows if r[1] is not None), 2)
+
+    # History ends yesterday (today is still in progress); a newer user only has the days since their first expense
+    end = today
+    start = end - timedelta(days=SIMULATION_HISTORY_DAYS)
+    dated = [d for d in (_parse_day(r[0]) for r in history_rows) if d is not None]
+    start = max(start, min(dated)) if dated else end
+    daily, weekdays = daily_variable_spend(history_rows, start, end, fixed_cats)
+
+    result = {
+        "month": month,
+        "spent_so_far": spent,
+        "days_remaining": remaining,
+        "history_days": len(daily),
+        "trials": trials,
+        "budget": budget,
+    }
+    if remaining == 0 or not len(daily):
+        # Nothing to resample from or nothing left to simulate: the month end is what has been spent
+        totals = np.full(1, spent)
+    else:
+        rng = np.random.default_rng(seed)
+        future = np.zeros(trials)
+        remaining_weekdays = (np.arange(today.day, days_in_month) + date(today.year, today.month, 1).weekday()) % 7
+        for wd in range(7):
+            need = int((remaining_weekdays == wd).sum())
+            if not need:
+                continue
+            pool = daily[weekdays == wd]
+            if not len(pool):
+                pool = daily
+            # One (trials x need) draw per weekday: every trajectory gets its own sample of matching days
+            future += pool[rng.integers(0, len(pool), size=(trials, need))].sum(axis=1)
+        totals = spent + future
+
+    bands = np.percentile(totals, PERCENTILES)
+    result["month_end"] = {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, bands)}
+    result["month_end"]["mean"] = round(float(totals.mean()), 2)
+    result["prob_over_budget"] = round(float((totals > budget).mean()), 4) if budget > 0 else None
+    return result
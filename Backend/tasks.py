@@ -0,0 +1,131 @@
+"""
+tasks.py - Background Job Handlers
+
+Process: The work that runs in worker.py instead of inside a request: statement rendering, recurring
+expansion for every user at the start of a month, and the nightly archival pass.
+
+Main Functionality:
+  - statement_pdf: Renders a monthly PDF statement into JOB_OUTPUT_DIR for download via /jobs/<id>/download
+  - expand_recurring: Materializes recurring templates for one user, or for everyone when the job has no user
+  - archive_months: Moves months past the archive horizon out of the hot table (see archive.py)
+  - check_anomaly_stats: Compares the incremental anomaly statistics with a full recompute and repairs drift
+  - prune_jobs: Deletes finished jobs and job output files older than JOB_RETENTION_DAYS
+  - categorize: Fills in the category of a user's uncategorized transactions (see categorizer.py)
+
+Handlers take (conn, job) and return a JSON-serializable result. Raising marks the attempt failed.
+"""
+import os
+import time
+from datetime import datetime
+
+from db import BASE_DIR
+from jobs import job_handler, delete_finished
+from archive import archive_months, valid_month, ARCHIVE_HORIZON_MONTHS
+from transactions import expand_recurring, statement_rows
+from anomaly_stats import check_consistency, rebuild_stats
+from categorizer import categorize_uncategorized, CATEGORIZE_MIN_CONFIDENCE
+from utils import render_statement_pdf
+
+JOB_OUTPUT_DIR = os.getenv("JOB_OUTPUT_DIR", os.path.join(BASE_DIR, "job_output"))
+# Done/failed jobs and the files they produced are kept this long
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", 14))
+
+# Kinds a user may enqueue through POST /jobs; the rest need the admin token
+USER_JOB_KINDS = {"statement_pdf", "expand_recurring", "categorize"}
+
+# Kinds the worker enqueues once per UTC day (nightly precomputation)
+DAILY_JOBS = ["expand_recurring", "archive_months", "check_anomaly_stats", "prune_jobs"]
+
+
+def _month(job):
+    month = job["payload"].get("month") or datetime.now().strftime("%Y-%m")
+    if not valid_month(month):
+        raise ValueError("month must be YYYY-MM")
+    return month
+
+
+@job_handler("statement_pdf", concurrency=2)
+def statement_pdf(conn, job):
+    month = _month(job)
+    pdf = render_statement_pdf(statement_rows(conn.cursor(), job["user_id"], month), month)
+
+    os.makedirs(JOB_OUTPUT_DIR, exist_ok=True)
+    name = f"statement-{job['id']}.pdf"
+    with open(os.path.join(JOB_OUTPUT_DIR, name), "wb") as f:
+        f.write(pdf)
+    return {"file": name, "download_name": f"Statement_{month}.pdf", "bytes": len(pdf)}
+
+
+@job_handler("expand_recurring", concurrency=2)
+def expand_recurring_job(conn, job):
+    month = _month(job)
+    cur = conn.cursor()
+    if job["user_id"] is not None:
+        user_ids = [job["user_id"]]
+    else:
+        cur.execute("SELECT DISTINCT user_id FROM recurring_transactions")
+        user_ids = [r[0] for r in cur.fetchall()]
+
+    added = 0
+    for user_id in user_ids:
+        added += expand_recurring(cur, user_id, month)
+        # One commit per user keeps write locks short while the web process keeps serving
+        conn.commit()
+    return {"month": month, "users": len(user_ids), "added": added}
+
+
+@job_handler("archive_months", concurrency=1)
+def archive_months_job(conn, job):
+    moved = archive_months(conn, int(job["payload"].get("horizon", ARCHIVE_HORIZON_MONTHS)))
+    return {"months": moved, "rows": sum(moved.values())}
+
+
+@job_handler("check_anomaly_stats", concurrency=1)
+def check_anomaly_stats_job(conn, job):
+    cur = conn.cursor()
+    if job["user_id"] is not None:
+        user_ids = [job["user_id"]]
+    else:
+        cur.execute("SELECT DISTINCT user_id FROM transactions WHERE type='expense'")
+        user_ids = [r[0] for r in cur.fetchall()]
+
+    repaired = []
+    for user_id in user_ids:
+        report = check_consistency(cur, user_id)
+        if not report["consistent"]:
+            print(f"Anomaly stats drift for user {user_id}: {report}")
+            rebuild_stats(cur, user_id)
+            conn.commit()
+            repaired.append(user_id)
+    return {"users": len(user_ids), "repaired": repaired}
+
+
+@job_handler("prune_jobs", concurrency=1)
+def prune_jobs_job(conn, job):
+    days = int(job["payload"].get("days", JOB_RETENTION_DAYS))
+    deleted = delete_finished(conn.cursor(), days)
+    conn.commit()
+
+    removed = 0
+    names = {(j["result"] or {}).get("file") for j in deleted} - {None}
+    for name in names:
+        path = os.path.join(JOB_OUTPUT_DIR, os.path.basename(name))
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    # Files whose job row is already gone (e.g. deleted by hand) age out on their own
+    cutoff = time.time() - days * 86400
+    if os.path.isdir(JOB_OUTPUT_DIR):
+        for entry in os.scandir(JOB_OUTPUT_DIR):
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+    return {"jobs": len(deleted), "files": removed}
+
+
+@job_handler("categorize", concurrency=2)
+def categorize_job(conn, job):
+    min_confidence = float(job["payload"].get("min_confidence", CATEGORIZE_MIN_CONFIDENCE))
+    result = categorize_uncategorized(conn.cursor(), job["user_id"], min_confidence)
+    conn.commit()
+    return {"candidates": result["candidates"], "updated": result["updated"]}
@@ -0,0 +1,80 @@
+"""
+transactions.py - Shared Transaction Write Paths
+
+Process: The inserts and bookkeeping used by the request handlers and by background jobs (see tasks.py),
+so both keep ETags, delta sync and the ledger cache consistent in the same way.
+
+Main Functionality:
+  - insert_transaction(): Interns the category, inserts the row and records the write (anomaly statistics included)
+  - after_transaction_write(): Version bump, change log entry and cache invalidation for any write
+  - expand_recurring(): Materializes a user's recurring templates into one month
+  - statement_rows(): One month of (date, category, amount, notes, type) rows, archive included
+"""
+from db import PLACEHOLDER, DATABASE_URL
+from versions import bump_versions
+from changelog import record_change
+from categories import intern_category
+from ledger import ledger_cache
+from anomaly_stats import record_write
+from archive import archived_months_for, archived_transactions, month_bounds
+
+
+def insert_transaction(cur, user_id, date, category, amount, notes, tx_type):
+    """Inserts a transaction and records it for ETags and delta sync. Returns the new id."""
+    category_id, category = intern_category(cur, user_id, category)
+    sql = f"""
+        INSERT INTO transactions (user_id, date, category, category_id, amount, notes, type)
+        VALUES ({PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER}, {PLACEHOLDER})
+    """
+    params = (user_id, date, category, category_id, amount, notes, tx_type)
+    if DATABASE_URL:
+        # psycopg2 does not support lastrowid
+        cur.execute(sql + " RETURNING id", params)
+        tx_id = cur.fetchone()[0]
+    else:
+        cur.execute(sql, params)
+        tx_id = cur.lastrowid
+    record_write(cur, user_id, new=(category_id, amount, tx_type))
+    after_transaction_write(cur, user_id, tx_id, "insert", date[:7])
+    return tx_id
+
+
+def after_transaction_write(cur, user_id, tx_id, op, *months):
+    """Bookkeeping shared by every transaction insert/update/delete, inside the caller's DB transaction."""
+    bump_versions(cur, user_id, *months)
+    record_change(cur, user_id, tx_id, op)
+    ledger_cache.invalidate(user_id)
+
+
+def expand_recurring(cur, user_id, month):
+    """Adds this month's occurrence of every recurring template that is not there yet. Returns the number added."""
+    # Archived months are read-only, so templates are never expanded into them
+    if month in archived_months_for(cur, user_id):
+        return 0
+
+    cur.execute(f"""
+        SELECT amount, category, notes, type, day_of_month, category_id
+        FROM recurring_transactions WHERE user_id={PLACEHOLDER}
+    """, (user_id,))
+    added = 0
+    for amt, cat, nts, typ, day, cat_id in cur.fetchall():
+        check_date = f"{month}-{str(day).zfill(2)}"
+        # Expanded rows are recognised by the ' [Recurring]' suffix on their notes
+        check_notes = f"{nts} [Recurring]".strip()
+
+        # Match on the interned id so spelling differences in older rows don't cause duplicates
+        cat_match = f"category_id={PLACEHOLDER}" if cat_id is not None else "category_id IS NULL"
+        cur.execute(f"SELECT id FROM transactions WHERE user_id={PLACEHOLDER} AND date={PLACEHOLDER} AND {cat_match} AND notes={PLACEHOLDER}",
+                    (user_id, check_date, *([cat_id] if cat_id is not None else []), check_notes))
+        if not cur.fetchone():
+            insert_transaction(cur, user_id, check_date, cat, amt, check_notes, typ)
+            added += 1
+    return added
+
+
+def statement_rows(cur, user_id, month):
+    """Rows for a monthly statement; older months come from the archive."""
+    cur.execute(f"SELECT date, category, amount, notes, type FROM transactions WHERE user_id={PLACEHOLDER} AND date >= {PLACEHOLDER} AND date < {PLACEHOLDER}",
+                (user_id, *month_bounds(month)))
+    hot = cur.fetchall()
+    return [r[1:] for r in archived_transactions(cur, user_id, month)] + hot
@@ -5,13 +5,21 @@ Process: Provides helper functions for financial calculations, anomaly detection
 
 Updated Functionality:
   - Gemini AI Coach: Integrated Google Generative AI for intelligent, context-aware financial advice.
+    LLM_STUB=1 swaps the Gemini client for StubModel (local, configurable latency and failure rate) in load tests.
   - Anomaly Detection: Identifies unusual spending patterns using statistical outliers.
   - Budget Optimization: Analyzes efficiency and suggests target monthly budgets.
   - Pattern Matching: Fallback logic for basic financial queries.
+  - Necessity Scoring: Vectorized BUY/DELAY/AVOID scoring for one purchase or a whole wishlist.
+  - Dashboard Widgets: Row-based helpers shared by the individual analytics routes and /dashboard.
+  - Statements: Monthly PDF statement rendering, shared by /export-pdf and the statement_pdf job.
 """
 import math
+import numpy as np
 from datetime import date, datetime
+from fpdf import FPDF
 from db import get_connection, PLACEHOLDER
+from analytics import monthly_totals, category_type_totals, active_days, expense_rows
+from anomaly_stats import is_anomalous, SMALL_AMOUNT_LIMIT, MIN_SMALL_SAMPLES
 
 
 # Removed insecure global load_data function to prevent memory leakage and privacy issues.
@@ -22,11 +30,11 @@ def detect_anomalies(user_id=None):
     conn = get_connection()
     cur = conn.cursor()
     if user_id:
-        cur.execute(f"SELECT id, amount, category FROM transactions WHERE user_id={PLACEHOLDER} AND type='expense'", (user_id,))
+        rows = expense_rows(cur, user_id)
     else:
         cur.execute("SELECT id, amount, category FROM transactions WHERE type='expense'")
+        rows = cur.fetchall()
     
-    rows = cur.fetchall()
     if not rows:
         return []
     
@@ -38,6 +46,14 @@ def detect_anomalies(user_id=None):
         b_row = cur.fetchone()
         user_budget = b_row[0] if b_row else 0
 
+    return find_anomalies(rows, user_budget)
+
+
+def find_anomalies(rows, user_budget=0):
+    """Expects rows as (id, amount, category) tuples of expense transactions."""
+    if not rows:
+        return []
+
     # Data: id, amount, category
     data = [{"id": r[0], "amount": r[1], "category": r[2]} for r in rows]
     
@@ -50,73 +66,193 @@ def detect_anomalies(user_id=None):
         return mean, math.sqrt(variance)
 
     # Global fallback for small transactions - now requires a minimum sample size
-    small_amounts = [d['amount'] for d in data if d['amount'] < 10000]
-    global_mean = sum(small_amounts) / len(small_amounts) if len(small_amounts) >= 5 else None
-
-    # Categories that are naturally large and should be exempt from "global small mean" fallback
-    large_categories = ["Rent", "Bills", "Education", "Health", "Investment"]
+    small_amounts = [d['amount'] for d in data if d['amount'] < SMALL_AMOUNT_LIMIT]
+    global_mean = sum(small_amounts) / len(small_amounts) if len(small_amounts) >= MIN_SMALL_SAMPLES else None
 
     categories = set(d['category'] for d in data)
     anomaly_ids = []
     
     for cat in categories:
         cat_items = [d for d in data if d['category'] == cat]
-        amounts = [d['amount'] for d in cat_items]
-        
-        # Method 1: Statistical Outliers (requires at least 3 transactions in this category)
-        if len(cat_items) >= 3:
-            mean, std = get_stats(amounts)
-            if std == 0:
-                continue
-            # Flag if amount is 2 standard deviations above mean
-            for item in cat_items:
-                if item['amount'] > mean + 2 * std:
-                    anomaly_ids.append(item['id'])
-        
-        # Method 2: Global Fallback (for new users/categories)
-        elif global_mean is not None and cat not in large_categories:
-            # Fallback for small categories: flag if it's 5x the global mean of small transactions
-            for item in cat_items:
-                if item['amount'] > global_mean * 5:
-                    # Also check against budget - if it's less than 50% of monthly budget, it's likely fine
-                    if user_budget > 0 and item['amount'] < user_budget * 0.5:
-                        continue
-                    anomaly_ids.append(item['id'])
-        
-        # Method 3: Budget check (for large categories with very few records)
-        elif user_budget > 0 and cat in large_categories:
-            for item in cat_items:
-                # Only flag as anomaly if a single "Rent" etc. exceeds the entire budget or is extremely high
-                if item['amount'] > user_budget * 1.2:
-                    anomaly_ids.append(item['id'])
+        mean, std = get_stats([d['amount'] for d in cat_items])
+
+        # The rule itself (statistical outliers, global fallback, budget check) lives in anomaly_stats,
+        # which applies it incrementally at write time
+        for item in cat_items:
+            if is_anomalous(item['amount'], cat, len(cat_items), mean, std, global_mean, user_budget):
+                anomaly_ids.append(item['id'])
 
     return anomaly_ids
 
 
-def recommend_budget(data):
-    """Expects data as a list of dictionaries with 'date' and 'amount' keys."""
-    if not data:
+def predict_month_end(rows, today, fixed_cats):
+    """Expects rows as (date, amount, category) tuples of this month's expenses and the user's fixed category names."""
+    if not rows:
         return 0
 
-    FIXED_CATS = ["Rent", "Bills", "Education", "Insurance", "Utilities"]
+    days_passed = max(today.day, 1)
+    days_in_month = 30 # Simplified
 
-    # Group by month (YYYY-MM) and separate fixed/variable
-    monthly_data = {} # {month: {'fixed': 0, 'variable': 0}}
-    for item in data:
-        dt_str = item['date']
-        month = dt_str[:7]
-        cat = item.get('category', '')
+    fixed_total = 0
+    variable_total = 0
+
+    for r_date, r_amount, r_cat in rows:
+        if r_cat in fixed_cats:
+            fixed_total += r_amount
+        else:
+            variable_total += r_amount
+
+    effective_days = max(days_passed, 5)
+    variable_avg_daily = variable_total / effective_days
+    remaining_days = max(days_in_month - days_passed, 0)
+    variable_predicted = variable_total + (variable_avg_daily * remaining_days)
+
+    return round(fixed_total + variable_predicted, 2)
+
+
+def optimization_hints(cat_month_totals, total_budget, target_month, fixed_cats):
+    """Expects (category, month, total) expense aggregates (see analytics.category_month_totals) and fixed category names."""
+    cat_month_sums = {}
+    all_categories = set()
+
+    for r_cat, r_month, r_total in cat_month_totals:
+        all_categories.add(r_cat)
+        cat_month_sums.setdefault(r_cat, {})[r_month] = r_total
+
+    result = []
+
+    for cat in all_categories:
+        monthly_data = cat_month_sums.get(cat, {})
+        avg_monthly_spend = sum(monthly_data.values()) / len(monthly_data) if monthly_data else 0
+        category_recent_total = monthly_data.get(target_month, 0)
+
+        # Condition 1: Spending is 20% higher than historical average
+        if len(monthly_data) > 1 and avg_monthly_spend > 0 and category_recent_total > avg_monthly_spend * 1.2:
+            diff = category_recent_total - avg_monthly_spend
+            result.append({
+                "category": cat,
+                "message": f"Spending is ₹{round(diff)} above your monthly average. Try to scale back."
+            })
         
-        if item.get('type') == 'income':
+        # Condition 2: Category consumes > 50% of total budget (EXCLUDE FIXED COSTS)
+        elif total_budget > 0 and category_recent_total > total_budget * 0.5 and cat not in fixed_cats:
+             result.append({
+                "category": cat,
+                "message": f"This category accounts for {round((category_recent_total/total_budget)*100)}% of your total budget."
+            })
+
+    return result
+
+
+def savings_summary(month_totals, budget_rows, current_month):
+    """Expects (month, type, total) aggregates (see analytics.monthly_totals) and (month, amount) budget rows."""
+    monthly_spent = {}
+    monthly_income = {}
+    for r_month, r_type, r_total in month_totals:
+        if r_month is None:
             continue
-            
+        # Anything that is not income counts as spending, whatever its type label
+        target = monthly_income if r_type == 'income' else monthly_spent
+        target[r_month] = round(target.get(r_month, 0) + r_total, 2)
+
+    budgets = {b[0]: b[1] for b in budget_rows}
+    all_months = set(list(monthly_spent.keys()) + list(budgets.keys()) + list(monthly_income.keys()))
+    
+    history = []
+    total_savings = 0
+    
+    for m in sorted(list(all_months), reverse=True):
+        budget = budgets.get(m, 0)
+        spent = monthly_spent.get(m, 0)
+        income = monthly_income.get(m, 0)
+        
+        savings = (budget - spent) + income
+        if m < current_month:
+            total_savings += savings
+        
+        history.append({
+            "month": m, 
+            "budget": budget, 
+            "spent": spent, 
+            "income": income, 
+            "savings": savings
+        })
+    
+    return {
+        "total_savings": round(total_savings, 2),
+        "history": history
+    }
+
+
+def budget_status(budget, spent, month):
+    """Summarises how much of a month's budget has been used."""
+    return {
+        "month": month,
+        "budget": round(budget, 2),
+        "spent": round(spent, 2),
+        "remaining": round(budget - spent, 2),
+        "usage": round((spent / budget * 100) if budget > 0 else 0, 1)
+    }
+
+
+FREQUENCY_POINTS = {"high": 25, "medium": 15}
+
+
+def score_purchases(amounts, is_need, frequency, budget, spent):
+    """Vectorized necessity scoring.
+
+    amounts, is_need and frequency are equal-length sequences. spent is the month's spending so far,
+    either one number for independent scoring or a per-item array for a sequential simulation.
+    Returns (scores, decisions) as lists.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    is_need = np.asarray(is_need, dtype=bool)
+    spent = np.broadcast_to(np.asarray(spent, dtype=float), amounts.shape)
+
+    # 1. Base Score from Type & Frequency
+    score = np.where(is_need, 45, 10)
+    score = score + np.array([FREQUENCY_POINTS.get(f, 5) for f in frequency], dtype=int).reshape(amounts.shape)
+
+    # 2. Budget Impact Scoring
+    if budget > 0:
+        remaining = budget - spent
+        # Penalty for being near or over budget
+        score = score - np.where(spent / budget > 0.9, 15, 0)
+        # Impact of THIS purchase
+        score = score + np.select(
+            [amounts > remaining, amounts < budget * 0.02, amounts < budget * 0.1],
+            [-20, 15, 5],
+            default=0
+        )
+    else:
+        # No budget set - conservative scoring
+        score = score + 10
+
+    # 3. Wants should be hard to justify if expensive
+    score = score - np.where(~is_need & (amounts > 5000), 10, 0)
+
+    decisions = np.select([score >= 70, score >= 35], ["BUY", "DELAY"], default="AVOID")
+    # Ensure needs that are cheap are at least DELAY
+    decisions = np.where(is_need & (amounts < 500) & (decisions == "AVOID"), "DELAY", decisions)
+
+    return np.clip(score, 0, 100).tolist(), decisions.tolist()
+
+
+def recommend_budget(cat_month_totals, fixed_cats):
+    """Expects (category, month, total) expense aggregates (see analytics.category_month_totals) and fixed category names."""
+    if not cat_month_totals:
+        return 0
+
+    # Separate fixed/variable per month (YYYY-MM)
+    monthly_data = {} # {month: {'fixed': 0, 'variable': 0}}
+    for cat, month, total in cat_month_totals:
         if month not in monthly_data:
             monthly_data[month] = {'fixed': 0, 'variable': 0}
             
-        if cat in FIXED_CATS:
-            monthly_data[month]['fixed'] += item['amount']
+        if cat in fixed_cats:
+            monthly_data[month]['fixed'] += total
         else:
-            monthly_data[month]['variable'] += item['amount']
+            monthly_data[month]['variable'] += total
 
     sorted_months = sorted(monthly_data.keys())
     if not sorted_months:
@@ -141,14 +277,34 @@ def recommend_budget(data):
 
 
 import os
+import random
+import time
+from types import SimpleNamespace
 import google.generativeai as genai
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # Configure Gemini
+class StubModel:
+    """Local stand-in for the Gemini client (load testing): waits, then answers with canned text or fails."""
+
+    def __init__(self, latency_ms, failure_rate):
+        self.latency = latency_ms / 1000
+        self.failure_rate = failure_rate
+
+    def generate_content(self, prompt):
+        # +/-50% jitter around the configured latency, like a real API under varying load
+        time.sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.failure_rate:
+            raise RuntimeError("LLM stub: simulated failure")
+        return SimpleNamespace(text=f"(stub) Keep tracking your spending. Prompt was {len(prompt)} characters.")
+
+
 api_key = os.getenv("GEMINI_API_KEY")
-if api_key:
+if os.getenv("LLM_STUB") == "1":
+    model = StubModel(float(os.getenv("LLM_STUB_LATENCY_MS", 800)), float(os.getenv("LLM_STUB_FAILURE_RATE", 0)))
+elif api_key:
     genai.configure(api_key=api_key)
     # Using gemini-flash-latest for best availability
     model = genai.GenerativeModel('gemini-flash-latest')
@@ -158,28 +314,28 @@ else:
 def financial_coach_reply(user_id, message):
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute(f"SELECT date, category, amount, type FROM transactions WHERE user_id={PLACEHOLDER}", (user_id,))
-    rows = cur.fetchall()
+    totals = category_type_totals(cur, user_id)
     
-    if not rows:
+    if not totals:
         return "You haven't recorded any transactions yet! Try adding some expenses first so I can analyze your habits."
 
-    # Process rows into analytics context
+    # Build the analytics context from per-category aggregates
     total_spent = 0
     cat_sums = {}
-    unique_dates = set()
     
     total_income = 0
-    for r_date, r_cat, r_amount, r_type in rows:
+    for r_cat, r_type, r_total in totals:
         if r_type == 'income':
-            total_income += r_amount
+            total_income += r_total
         else:
-            total_spent += r_amount
-            cat_sums[r_cat] = cat_sums.get(r_cat, 0) + r_amount
-        unique_dates.add(r_date) # Assuming r_date is 'YYYY-MM-DD' string
+            total_spent += r_total
+            cat_sums[r_cat] = round(cat_sums.get(r_cat, 0) + r_total, 2)
+    total_spent = round(total_spent, 2)
+    total_income = round(total_income, 2)
     
     top_cat = max(cat_sums, key=cat_sums.get) if cat_sums else "N/A"
-    avg_daily = total_spent / len(unique_dates) if unique_dates else 0
+    day_count = active_days(cur, user_id)
+    avg_daily = total_spent / day_count if day_count else 0
     
     # 1. Fetch Chat History (last 10 messages for context)
     cur.execute(f"SELECT role, content FROM chat_history WHERE user_id={PLACEHOLDER} ORDER BY timestamp DESC LIMIT 10", (user_id,))
@@ -231,9 +387,10 @@ def financial_coach_reply(user_id, message):
             cur.execute(f"SELECT amount FROM budget WHERE user_id={PLACEHOLDER} AND month={PLACEHOLDER}", (user_id, this_month,))
             budget_row = cur.fetchone()
             
-            # Calculate current month's spending manually
-            current_spent = sum(r[2] for r in rows if r[0][:7] == this_month and r[3] == 'expense')
-            current_income = sum(r[2] for r in rows if r[0][:7] == this_month and r[3] == 'income')
+            # Current month's spending from the monthly aggregates
+            month_rows = [r for r in monthly_totals(cur, user_id) if r[0] == this_month]
+            current_spent = sum(r[2] for r in month_rows if r[1] == 'expense')
+            current_income = sum(r[2] for r in month_rows if r[1] == 'income')
             
             if not budget_row:
                 return f"You haven't set a budget, but you've spent ₹{round(current_spent, 2)} so far."
@@ -242,3 +399,52 @@ def financial_coach_reply(user_id, message):
             return f"You've spent ₹{round(current_spent, 2)} out of ₹{round(budget, 2)}."
         
         return "Gemini API key not configured. I can only answer basic budget questions for now!"
+
+
+def render_statement_pdf(rows, month):
+    """Renders (date, category, amount, notes, type) rows as a monthly statement. Returns the PDF bytes."""
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 16)
+    pdf.cell(0, 10, f"Monthly Financial Statement - {month}", ln=True, align="C")
+    pdf.ln(10)
+    
+    # Summary Stats
+    total_spent = sum(r[2] for r in rows if r[4] == 'expense')
+    total_income = sum(r[2] for r in rows if r[4] == 'income')
+    
+    pdf.set_font("Helvetica", "B", 12)
+    pdf.cell(0, 10, f"Total Income: INR {total_income:,.2f}", ln=True)
+    pdf.cell(0, 10, f"Total Spent: INR {total_spent:,.2f}", ln=True)
+    pdf.cell(0, 10, f"Net Flow: INR {total_income - total_spent:,.2f}", ln=True)
+    pdf.ln(10)
+    
+    # Table Header
+    pdf.set_fill_color(240, 240, 240)
+    pdf.set_font("Helvetica", "B", 10)
+    pdf.cell(30, 10, "Date", border=1, fill=True)
+    pdf.cell(40, 10, "Category", border=1, fill=True)
+    pdf.cell(30, 10, "Amount", border=1, fill=True)
+    pdf.cell(20, 10, "Type", border=1, fill=True)
+    pdf.cell(70, 10, "Notes", border=1, fill=True)
+    pdf.ln()
+    
+    # Table Rows
+    pdf.set_font("Helvetica", "", 9)
+    for r_date, r_cat, r_amt, r_notes, r_type in rows:
+        # Format date for report: dd-mm-yy
+        formatted_date = r_date
+        try:
+            d_obj = datetime.strptime(r_date, "%Y-%m-%d")
+            formatted_date = d_obj.strftime("%d-%m-%y")
+        except:
+            pass
+            
+        pdf.cell(30, 8, formatted_date, border=1)
+        pdf.cell(40, 8, str(r_cat or "-"), border=1)
+        pdf.cell(30, 8, f"{r_amt:,.2f}", border=1)
+        pdf.cell(20, 8, str(r_type).upper(), border=1)
+        pdf.cell(70, 8, str(r_notes or "-")[:40], border=1) # Truncate long notes
+        pdf.ln()
+
+    return bytes(pdf.output())
@@ -0,0 +1,53 @@
+"""
+versions.py - Per-User Data Versions
+
+Process: Keeps a monotonically increasing counter per user (and per month) that every write route bumps,
+so read routes can answer conditional requests without touching the transactions table.
+
+Main Functionality:
+  - bump_versions(): Increments the user-wide counter plus any extra scopes (months, recurring templates)
+  - get_versions(): Reads the current counters for a set of scopes
+  - next_version(): Increments a single scope and returns its new value (used as a sequence number)
+  - make_etag(): Builds a stable ETag from a user id and the counters a response depends on
+"""
+from db import PLACEHOLDER
+
+# Scopes: USER_SCOPE changes on every write, months are keyed as 'YYYY-MM'
+USER_SCOPE = "*"
+RECURRING_SCOPE = "recurring"
+CHANGES_SCOPE = "changes"
+CATEGORIES_SCOPE = "categories"
+
+
+def bump_versions(cur, user_id, *scopes):
+    """Increments the counters for USER_SCOPE and each given scope. Runs inside the caller's transaction."""
+    for scope in {USER_SCOPE, *[s for s in scopes if s]}:
+        cur.execute(f"""
+            INSERT INTO data_versions (user_id, scope, version) VALUES ({PLACEHOLDER}, {PLACEHOLDER}, 1)
+            ON CONFLICT (user_id, scope) DO UPDATE SET version = data_versions.version + 1
+        """, (user_id, scope))
+
+
+def next_version(cur, user_id, scope):
+    """Increments one scope and returns its new value. The row stays locked until the caller commits."""
+    cur.execute(f"""
+        INSERT INTO data_versions (user_id, scope, version) VALUES ({PLACEHOLDER}, {PLACEHOLDER}, 1)
+        ON CONFLICT (user_id, scope) DO UPDATE SET version = data_versions.version + 1
+    """, (user_id, scope))
+    cur.execute(f"SELECT version FROM data_versions WHERE user_id={PLACEHOLDER} AND scope={PLACEHOLDER}", (user_id, scope))
+    return cur.fetchone()[0]
+
+
+def get_versions(cur, user_id, *scopes):
+    """Returns {scope: version}; scopes that were never written report version 0."""
+    markers = ", ".join([PLACEHOLDER] * len(scopes))
+    cur.execute(f"SELECT scope, version FROM data_versions WHERE user_id={PLACEHOLDER} AND scope IN ({markers})",
+                (user_id, *scopes))
+    found = dict(cur.fetchall())
+    return {s: found.get(s, 0) for s in scopes}
+
+
+def make_etag(user_id, versions, *extra):
+    """ETag for a response derived from versions plus any extra inputs (e.g. today's date)."""
+    parts = [f"u{user_id}"] + [f"{scope}:{versions[scope]}" for scope in sorted(versions)] + [str(e) for e in extra]
+    return "-".join(parts)
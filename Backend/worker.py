@@ -0,0 +1,128 @@
+"""
+worker.py - Background Job Worker
+
+Process: Long-running process that claims due jobs from the database queue (jobs.py) and runs their
+handlers (tasks.py) on a thread pool. While jobs run it renews their leases every JOB_HEARTBEAT_SECONDS, so
+long jobs are never mistaken for abandoned ones. It also enqueues the daily jobs and returns jobs abandoned by
+crashed workers to the queue. Any number of workers can run against the same database.
+
+Usage:
+    python worker.py [--concurrency N] [--poll SECONDS] [--once]
+
+--once drains the jobs that are due and exits, for running from cron instead of as a service.
+Per-kind concurrency limits are read from the database before every claim, so they hold across workers
+up to the rare case of two workers claiming at the same instant.
+"""
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+
+from db import get_connection, init_db
+from jobs import (HANDLERS, enqueue, claim, complete, fail, heartbeat, requeue_stale, running_counts,
+                  JOB_HEARTBEAT_SECONDS)
+from tasks import DAILY_JOBS
+
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 2))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2))
+
+# How often the lease check and daily scheduling run
+MAINTENANCE_SECONDS = 60
+
+
+def run_job(job, worker_id):
+    handler, _ = HANDLERS[job["kind"]]
+    conn = get_connection()
+    try:
+        result = handler(conn, job)
+        conn.commit()
+        complete(conn, job, worker_id, result)
+    except Exception as e:
+        conn.rollback()
+        print(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed: {e}")
+        fail(conn, job, worker_id, f"{type(e).__name__}: {e}")
+    finally:
+        conn.close()
+
+
+def schedule_daily(conn):
+    """Enqueues each daily job once per UTC day; the dedupe key makes this safe from every worker."""
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    cur = conn.cursor()
+    for kind in DAILY_JOBS:
+        enqueue(cur, kind, dedupe_key=f"{kind}:{today}")
+    conn.commit()
+
+
+def available_kinds(conn):
+    counts = running_counts(conn.cursor())
+    conn.commit()
+    return [kind for kind, (_, limit) in HANDLERS.items() if counts.get(kind, 0) < limit]
+
+
+def _heartbeat(conn, worker_id):
+    try:
+        heartbeat(conn, worker_id)
+    except Exception as e:
+        # e.g. SQLite busy while a handler holds the write lock; the lease allows several missed beats
+        conn.rollback()
+        print(f"Heartbeat for {worker_id} failed: {e}")
+
+
+def run_worker(concurrency=JOB_WORKER_CONCURRENCY, poll_seconds=JOB_POLL_SECONDS, once=False):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stopping.set())
+
+    conn = get_connection()
+    running = set()
+    last_maintenance = None
+    last_heartbeat = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        while not stopping.is_set():
+            if last_maintenance is None or time.monotonic() - last_maintenance >= MAINTENANCE_SECONDS:
+                requeue_stale(conn)
+                schedule_daily(conn)
+                last_maintenance = time.monotonic()
+
+            while len(running) < concurrency:
+                job = claim(conn, worker_id, available_kinds(conn))
+                if not job:
+                    break
+                running.add(pool.submit(run_job, job, worker_id))
+
+            if once and not running:
+                break
+            if running:
+                done, _ = wait(running, timeout=min(poll_seconds, JOB_HEARTBEAT_SECONDS), return_when=FIRST_COMPLETED)
+                running -= done
+            else:
+                stopping.wait(poll_seconds)
+            if running and time.monotonic() - last_heartbeat >= JOB_HEARTBEAT_SECONDS:
+                _heartbeat(conn, worker_id)
+                last_heartbeat = time.monotonic()
+
+        # Let in-flight jobs finish on shutdown rather than leaving them to the lease timeout; keep renewing
+        # their leases meanwhile
+        while running:
+            done, _ = wait(running, timeout=JOB_HEARTBEAT_SECONDS)
+            running -= done
+            if running:
+                _heartbeat(conn, worker_id)
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background jobs from the database queue.")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY)
+    parser.add_argument("--poll", type=float, default=JOB_POLL_SECONDS, help="seconds between polls when idle")
+    parser.add_argument("--once", action="store_true", help="run the due jobs and exit")
+    args = parser.parse_args()
+
+    init_db()
+    run_worker(args.concurrency, args.poll, args.once)